@@ -57,9 +57,12 @@ CREATE TABLE IF NOT EXISTS public.messages (
   sentiment sentiment_type,
   action TEXT,
   rag_sources TEXT[],
+  metadata JSONB DEFAULT '{}',
   created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
 );
 
+CREATE INDEX IF NOT EXISTS messages_conversation_created_idx ON public.messages (conversation_id, created_at);
+
 -- Create table for knowledge base documents
 CREATE TABLE IF NOT EXISTS public.knowledge_documents (
   id UUID NOT NULL DEFAULT gen_random_uuid() PRIMARY KEY,
@@ -67,20 +70,30 @@ CREATE TABLE IF NOT EXISTS public.knowledge_documents (
   file_type TEXT,
   content TEXT,
   chunk_count INTEGER DEFAULT 0,
-  status TEXT DEFAULT 'pending' CHECK (status IN ('pending', 'indexed', 'needs-update', 'error')),
+  status TEXT DEFAULT 'pending' CHECK (status IN ('pending', 'queued', 'processing', 'indexed', 'needs-update', 'error')),
   metadata JSONB DEFAULT '{}',
+  progress JSONB DEFAULT '{}',
   created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
   updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
 );
 
+-- External ingest workers poll for queued documents
+CREATE INDEX IF NOT EXISTS knowledge_documents_queued_idx ON public.knowledge_documents (created_at) WHERE status = 'queued';
+
 -- Create table for document chunks (Vector Store)
 CREATE TABLE IF NOT EXISTS public.document_chunks (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
   document_id UUID REFERENCES public.knowledge_documents(id) ON DELETE CASCADE,
   content TEXT,
+  content_hash TEXT, -- Lets re-ingestion keep unchanged chunks
+  content_tsv tsvector GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED,
+  metadata JSONB DEFAULT '{}',
   embedding vector(384) -- Embedding vectors stored at 384 dimensions
 );
 
+CREATE INDEX IF NOT EXISTS document_chunks_document_hash_idx ON public.document_chunks (document_id, content_hash);
+CREATE INDEX IF NOT EXISTS document_chunks_content_tsv_idx ON public.document_chunks USING gin (content_tsv);
+
 -- Create table for feedback/learning
 CREATE TABLE IF NOT EXISTS public.agent_feedback (
   id UUID NOT NULL DEFAULT gen_random_uuid() PRIMARY KEY,
@@ -120,6 +133,37 @@ BEGIN
 END;
 $$;
 
+-- Keyword counterpart of match_documents for hybrid retrieval, ranked by ts_rank_cd.
+-- Query terms are OR'ed. filter_company_id keeps the signature the backend calls;
+-- this single-tenant schema has no company_id, so it is ignored here.
+CREATE OR REPLACE FUNCTION match_documents_keyword (
+  query_text text,
+  match_count int,
+  filter_company_id uuid DEFAULT NULL
+)
+RETURNS TABLE (
+  id uuid,
+  document_id uuid,
+  content text,
+  rank float
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY
+  SELECT
+    document_chunks.id,
+    document_chunks.document_id,
+    document_chunks.content,
+    ts_rank_cd(document_chunks.content_tsv, q)::float as rank
+  FROM document_chunks,
+    nullif(replace(plainto_tsquery('english', query_text)::text, ' & ', ' | '), '')::tsquery q
+  WHERE document_chunks.content_tsv @@ q
+  ORDER BY rank DESC
+  LIMIT match_count;
+END;
+$$;
+
 -- Enable Row Level Security
 ALTER TABLE public.user_profiles ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.conversations ENABLE ROW LEVEL SECURITY;
@@ -56,7 +56,10 @@ export default function KnowledgeBasePage() {
       const { data, error } = await query;
       if (error) throw error;
       return data;
-    }
+    },
+    // Background ingestion jobs update status and chunk counts as they run
+    refetchInterval: (query) =>
+      query.state.data?.some((doc) => doc.status === "queued" || doc.status === "processing") ? 3000 : false
   });
 
   // 2. Fetch Stats
@@ -354,9 +357,12 @@ export default function KnowledgeBasePage() {
                           item.status === "indexed" ? "text-success border-success/30 bg-success/10" :
                           item.status === "needs-update" ? "text-warning border-warning/30 bg-warning/10" :
                           item.status === "error" ? "text-destructive border-destructive/30 bg-destructive/10" :
+                          item.status === "processing" ? "text-primary border-primary/30 bg-primary/10" :
+                          item.status === "queued" ? "text-muted-foreground border-muted-foreground/30 bg-muted" :
                           "text-muted-foreground"
                         }
                       >
+                        {item.status === "processing" && <Loader2 className="w-3 h-3 mr-1 animate-spin" />}
                         {item.status}
                       </Badge>
                       
@@ -0,0 +1,16 @@
+-- Progress counters for background ingestion jobs
+-- { "pages_parsed": 0, "chunks_total": 0, "chunks_embedded": 0, "chunks_stored": 0 }
+alter table knowledge_documents
+  add column if not exists progress jsonb default '{}'::jsonb;
+
+-- External ingest workers poll for queued documents
+create index if not exists knowledge_documents_queued_idx
+  on knowledge_documents (created_at)
+  where status = 'queued';
+
+-- Background jobs move documents through queued -> processing -> indexed / error
+alter table knowledge_documents
+  drop constraint if exists knowledge_documents_status_check;
+alter table knowledge_documents
+  add constraint knowledge_documents_status_check
+  check (status in ('pending', 'queued', 'processing', 'indexed', 'needs-update', 'error'));
@@ -0,0 +1,6 @@
+-- Content hash per chunk so re-ingesting a document only re-embeds changed chunks
+alter table document_chunks
+  add column if not exists content_hash text;
+
+create index if not exists document_chunks_document_hash_idx
+  on document_chunks (document_id, content_hash);
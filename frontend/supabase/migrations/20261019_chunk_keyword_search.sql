@@ -0,0 +1,38 @@
+-- Full-text index over chunk content for hybrid (dense + keyword) retrieval
+alter table document_chunks
+  add column if not exists content_tsv tsvector
+  generated always as (to_tsvector('english', coalesce(content, ''))) stored;
+
+create index if not exists document_chunks_content_tsv_idx
+  on document_chunks using gin (content_tsv);
+
+-- Keyword counterpart of match_documents, ranked by ts_rank_cd.
+-- Query terms are OR'ed so questions match chunks containing any of their terms
+create or replace function match_documents_keyword (
+  query_text text,
+  match_count int,
+  filter_company_id uuid default null
+)
+returns table (
+  id uuid,
+  document_id uuid,
+  content text,
+  rank float
+)
+language plpgsql
+as $$
+begin
+  return query
+  select
+    document_chunks.id,
+    document_chunks.document_id,
+    document_chunks.content,
+    ts_rank_cd(document_chunks.content_tsv, q)::float as rank
+  from document_chunks,
+    nullif(replace(plainto_tsquery('english', query_text)::text, ' & ', ' | '), '')::tsquery q
+  where document_chunks.content_tsv @@ q
+  and (filter_company_id is null or document_chunks.company_id = filter_company_id)
+  order by rank desc
+  limit match_count;
+end;
+$$;
@@ -0,0 +1,6 @@
+-- Response metadata (cache flag, token usage, stage timings) stored with each agent message
+alter table messages
+  add column if not exists metadata jsonb default '{}';
+
+create index if not exists messages_conversation_created_idx
+  on messages (conversation_id, created_at);
@@ -0,0 +1,3 @@
+-- Chunk metadata (source page, start_index / end_index offsets, nearest heading) for citations
+alter table document_chunks
+  add column if not exists metadata jsonb default '{}';
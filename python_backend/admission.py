@@ -0,0 +1,364 @@
+"""
+Per-tenant admission control for provider calls (Gemini embeddings and generations).
+
+Every provider call takes a slot from the process-wide AdmissionController:
+- at most LLM_MAX_CONCURRENCY calls are in flight, and at most
+  TENANT_MAX_CONCURRENCY for any one company;
+- each company has a calls/min budget (TENANT_REQUESTS_PER_MIN, burst
+  TENANT_REQUESTS_BURST);
+- waiting calls are served interactive (/chat) before bulk (ingest, batch chat),
+  and between companies by weighted fair queueing (TENANT_WEIGHTS), so a company
+  with a deep backlog cannot starve one that sends the odd request;
+- INTERACTIVE_RESERVED_SLOTS slots are never handed to bulk work, so a chat does
+  not wait for a long ingest batch to finish.
+
+Interactive calls are shed with OverloadedError (503 + Retry-After) when the
+company already has TENANT_MAX_QUEUE calls waiting, its rate budget would make
+it wait longer than ADMISSION_MAX_WAIT, or it has waited that long in the queue.
+Bulk calls are never shed; they wait.
+
+A company with nothing in flight or queued for ADMISSION_TENANT_IDLE_TTL
+seconds is forgotten (its rate budget would have refilled by then anyway);
+its counters are kept in the process totals.
+
+SingleFlight coalesces identical concurrent computations (query embeddings).
+"""
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Deque, Dict, Iterable, Optional
+from telemetry import span
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+TENANT_MAX_CONCURRENCY = int(os.getenv("TENANT_MAX_CONCURRENCY", "4"))
+# Provider calls per company per minute; 0 disables the budget
+TENANT_REQUESTS_PER_MIN = float(os.getenv("TENANT_REQUESTS_PER_MIN", "600"))
+TENANT_REQUESTS_BURST = float(os.getenv("TENANT_REQUESTS_BURST", "30"))
+TENANT_MAX_QUEUE = int(os.getenv("TENANT_MAX_QUEUE", "32"))
+# Seconds an interactive call may wait for a slot before it is shed
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "10"))
+INTERACTIVE_RESERVED_SLOTS = int(os.getenv("INTERACTIVE_RESERVED_SLOTS", "2"))
+# "company_id:weight,..."; companies not listed weigh 1
+TENANT_WEIGHTS = os.getenv("TENANT_WEIGHTS", "")
+# Idle companies' state is dropped after this many seconds
+ADMISSION_TENANT_IDLE_TTL = float(os.getenv("ADMISSION_TENANT_IDLE_TTL", "600"))
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BULK)
+
+
+class OverloadedError(Exception):
+    """The company is over its budget; retry after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    weights: Dict[str, float] = {}
+    for item in spec.split(","):
+        tenant, _, weight = item.strip().rpartition(":")
+        if tenant:
+            try:
+                weights[tenant] = max(float(weight), 0.01)
+            except ValueError:
+                print(f"Ignoring invalid tenant weight: {item}")
+    return weights
+
+
+class _Waiter:
+    __slots__ = ("future", "priority", "cost", "start_tag", "finish_tag", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, priority: str, cost: float, start_tag: float, finish_tag: float):
+        self.future = future
+        self.priority = priority
+        self.cost = cost
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.enqueued_at = time.monotonic()
+
+
+class _Tenant:
+    def __init__(self, weight: float, rate_per_min: float, burst: float):
+        self.weight = weight
+        self.active = 0
+        self.queues: Dict[str, Deque[_Waiter]] = {p: deque() for p in PRIORITIES}
+        self.last_finish: Dict[str, float] = {p: 0.0 for p in PRIORITIES}
+        self.rate = rate_per_min / 60.0
+        self.capacity = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        # Last grant or release; with nothing active or waiting, idle since then
+        self.last_used = self.updated_at
+        self.counters = {"admitted": 0, "shed": 0, "queued": 0}
+
+    def waiting(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def refill(self, now: float):
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def rate_wait(self, cost: float, now: float) -> float:
+        """Seconds until the budget covers `cost` (0 when it already does)."""
+        if self.rate <= 0:
+            return 0.0
+        self.refill(now)
+        cost = min(cost, self.capacity)
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        tenant_concurrency: int = TENANT_MAX_CONCURRENCY,
+        tenant_rate_per_min: float = TENANT_REQUESTS_PER_MIN,
+        tenant_burst: float = TENANT_REQUESTS_BURST,
+        tenant_max_queue: int = TENANT_MAX_QUEUE,
+        max_wait: float = ADMISSION_MAX_WAIT,
+        reserved_interactive: int = INTERACTIVE_RESERVED_SLOTS,
+        weights: Optional[Dict[str, float]] = None,
+        tenant_idle_ttl: float = ADMISSION_TENANT_IDLE_TTL
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.tenant_concurrency = max(1, tenant_concurrency)
+        self.tenant_rate_per_min = tenant_rate_per_min
+        self.tenant_burst = max(1.0, tenant_burst)
+        self.tenant_max_queue = tenant_max_queue
+        self.max_wait = max_wait
+        self.reserved_interactive = min(max(0, reserved_interactive), self.max_concurrency - 1)
+        self.weights = parse_weights(TENANT_WEIGHTS) if weights is None else weights
+        self.in_flight = 0
+        self.virtual_time = 0.0
+        # Smoothed slot hold time, used for Retry-After estimates
+        self.avg_hold = 1.0
+        self.tenant_idle_ttl = tenant_idle_ttl
+        self._tenants: Dict[str, _Tenant] = {}
+        # Counters of evicted companies, so the process totals don't go backwards
+        self._evicted_counters = {"admitted": 0, "shed": 0, "queued": 0}
+        self._last_sweep = time.monotonic()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _evict_idle(self, now: float):
+        """Forgets companies with nothing in flight or queued for tenant_idle_ttl seconds."""
+        self._last_sweep = now
+        for tenant_id, tenant in list(self._tenants.items()):
+            if tenant.active == 0 and not tenant.waiting() and now - tenant.last_used > self.tenant_idle_ttl:
+                for name, value in tenant.counters.items():
+                    self._evicted_counters[name] += value
+                del self._tenants[tenant_id]
+
+    def _tenant(self, tenant_id: str) -> _Tenant:
+        now = time.monotonic()
+        if now - self._last_sweep > self.tenant_idle_ttl / 2:
+            self._evict_idle(now)
+        tenant = self._tenants.get(tenant_id)
+        if tenant is None:
+            tenant = _Tenant(self.weights.get(tenant_id, 1.0), self.tenant_rate_per_min, self.tenant_burst)
+            self._tenants[tenant_id] = tenant
+        return tenant
+
+    def _retry_after(self, tenant: _Tenant, rate_wait: float = 0.0) -> int:
+        backlog = (tenant.waiting() + 1) * self.avg_hold / self.tenant_concurrency
+        return int(min(60, max(1, math.ceil(max(backlog, rate_wait)))))
+
+    def _shed(self, tenant: _Tenant, reason: str, rate_wait: float = 0.0) -> OverloadedError:
+        tenant.counters["shed"] += 1
+        return OverloadedError(f"Too many requests for this company ({reason}), try again later", self._retry_after(tenant, rate_wait))
+
+    def check(self, tenant_id: str, priority: str = INTERACTIVE):
+        """Raises OverloadedError if a call for this company would be shed right now (nothing is reserved)."""
+        if not ADMISSION_ENABLED or priority != INTERACTIVE:
+            return
+        tenant = self._tenant(tenant_id)
+        if len(tenant.queues[INTERACTIVE]) >= self.tenant_max_queue:
+            raise self._shed(tenant, "queue full")
+        rate_wait = tenant.rate_wait(1, time.monotonic())
+        if rate_wait > self.max_wait:
+            raise self._shed(tenant, "rate budget exhausted", rate_wait)
+
+    def _can_start(self, tenant: _Tenant, priority: str) -> bool:
+        limit = self.max_concurrency if priority == INTERACTIVE else self.max_concurrency - self.reserved_interactive
+        return self.in_flight < limit and tenant.active < self.tenant_concurrency
+
+    def _grant(self, tenant: _Tenant, cost: float):
+        if tenant.rate > 0:
+            tenant.tokens -= min(cost, tenant.capacity)
+        tenant.active += 1
+        tenant.last_used = time.monotonic()
+        tenant.counters["admitted"] += 1
+        self.in_flight += 1
+
+    async def acquire(self, tenant_id: str, priority: str = INTERACTIVE, cost: float = 1.0):
+        self.check(tenant_id, priority)
+        tenant = self._tenant(tenant_id)
+        now = time.monotonic()
+
+        # Fast path: nobody is waiting that this call would overtake
+        if (not any(t.waiting() for t in self._tenants.values())
+                and self._can_start(tenant, priority) and tenant.rate_wait(cost, now) == 0):
+            self._grant(tenant, cost)
+            return
+
+        # Weighted fair queueing tags (per priority class)
+        start_tag = max(self.virtual_time, tenant.last_finish[priority])
+        finish_tag = start_tag + cost / tenant.weight
+        tenant.last_finish[priority] = finish_tag
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), priority, cost, start_tag, finish_tag)
+        tenant.queues[priority].append(waiter)
+        tenant.counters["queued"] += 1
+        self._dispatch()
+
+        try:
+            with span("admission_wait"):
+                if priority == INTERACTIVE:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+                else:
+                    await asyncio.shield(waiter.future)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as we gave up: hand the slot back
+                self.release(tenant_id)
+            else:
+                waiter.future.cancel()
+                tenant.queues[priority].remove(waiter)
+                self._dispatch()
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._shed(tenant, "queue wait too long")
+            raise
+
+    def release(self, tenant_id: str, held: Optional[float] = None):
+        tenant = self._tenants[tenant_id]
+        tenant.active -= 1
+        tenant.last_used = time.monotonic()
+        self.in_flight -= 1
+        if held is not None:
+            self.avg_hold = 0.9 * self.avg_hold + 0.1 * held
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hands free slots to waiting calls: interactive first, then lowest finish tag."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        while self.in_flight < self.max_concurrency:
+            best = None
+            next_eligible = None
+            for tenant in self._tenants.values():
+                for priority in PRIORITIES:
+                    queue = tenant.queues[priority]
+                    if not queue or not self._can_start(tenant, priority):
+                        continue
+                    waiter = queue[0]
+                    rate_wait = tenant.rate_wait(waiter.cost, now)
+                    if rate_wait > 0:
+                        next_eligible = rate_wait if next_eligible is None else min(next_eligible, rate_wait)
+                        continue
+                    rank = (PRIORITIES.index(priority), waiter.finish_tag)
+                    if best is None or rank < best[0]:
+                        best = (rank, tenant, waiter)
+            if best is None:
+                if next_eligible is not None:
+                    # Woken up when the earliest rate budget refills
+                    self._timer = asyncio.get_running_loop().call_later(next_eligible, self._dispatch)
+                return
+            _, tenant, waiter = best
+            tenant.queues[waiter.priority].popleft()
+            self.virtual_time = max(self.virtual_time, waiter.start_tag)
+            self._grant(tenant, waiter.cost)
+            waiter.future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, tenant_id: Optional[str], priority: str = INTERACTIVE, cost: float = 1.0) -> AsyncIterator[None]:
+        """Holds a provider call slot for `tenant_id` (no-op when disabled or no tenant is known)."""
+        if not ADMISSION_ENABLED or tenant_id is None:
+            yield
+            return
+        await self.acquire(tenant_id, priority, cost)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(tenant_id, time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": ADMISSION_ENABLED,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "tenant_concurrency": self.tenant_concurrency,
+            "avg_hold_seconds": round(self.avg_hold, 3),
+            "tenants": len(self._tenants),
+            "waiting": sum(t.waiting() for t in self._tenants.values()),
+            "admitted": self._evicted_counters["admitted"] + sum(t.counters["admitted"] for t in self._tenants.values()),
+            "shed": self._evicted_counters["shed"] + sum(t.counters["shed"] for t in self._tenants.values())
+        }
+
+    def tenant_stats(self, tenant_id: str) -> Dict[str, Any]:
+        tenant = self._tenant(tenant_id)
+        return {
+            "weight": tenant.weight,
+            "active": tenant.active,
+            "waiting": {p: len(q) for p, q in tenant.queues.items()},
+            **tenant.counters
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent work: the first caller for a key starts it,
+    later callers for the same key await the same task until it finishes.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[asyncio.Future]:
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        return future
+
+    def start(self, keys: Iterable[str], work: Awaitable[Any]) -> asyncio.Future:
+        """Runs `work` as its own task (a caller going away does not cancel it for the others)."""
+        task = asyncio.ensure_future(work)
+        keys = list(keys)
+        for key in keys:
+            self._inflight[key] = task
+
+        def done(_):
+            for key in keys:
+                if self._inflight.get(key) is task:
+                    del self._inflight[key]
+
+        task.add_done_callback(done)
+        return task
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+
+_controller: Optional[AdmissionController] = None
+_embedding_flights: Optional[SingleFlight] = None
+
+def get_admission_controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
+
+def get_embedding_flights() -> SingleFlight:
+    global _embedding_flights
+    if _embedding_flights is None:
+        _embedding_flights = SingleFlight()
+    return _embedding_flights
@@ -0,0 +1,166 @@
+"""
+Per-tenant semantic cache of structured chat answers.
+
+A cached answer is reused when a new question's embedding is within
+ANSWER_CACHE_THRESHOLD cosine similarity of a cached question, the
+retrieved context chunk ids are exactly the same, and the preceding
+conversation turns match. Tenants are invalidated when their documents
+are re-ingested; entries are bounded per tenant (LRU) and by TTL.
+"""
+import os
+import time
+import json
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_PER_TENANT = int(os.getenv("ANSWER_CACHE_MAX_PER_TENANT", "500"))
+ANSWER_CACHE_MAX_TENANTS = int(os.getenv("ANSWER_CACHE_MAX_TENANTS", "1000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+
+def history_key(messages: List[Dict[str, str]]) -> str:
+    """Hash of the turns before the question - they are part of the prompt too."""
+    history = [(m.get("role"), m.get("content")) for m in messages[-5:-1]]
+    return hashlib.sha256(json.dumps(history).encode("utf-8")).hexdigest()
+
+
+def context_key(matches: List[Dict[str, Any]]) -> Tuple[str, ...]:
+    return tuple(sorted(
+        str(m.get("id") or hashlib.sha256(m.get("content", "").encode("utf-8")).hexdigest())
+        for m in matches
+    ))
+
+
+class CachedAnswer:
+    def __init__(self, vector: np.ndarray, history: str, context: Tuple[str, ...], response: Dict[str, Any], generation_ms: float):
+        self.vector = vector
+        self.history = history
+        self.context = context
+        self.response = response
+        self.generation_ms = generation_ms
+        self.created_at = time.time()
+
+
+class TenantAnswerCache:
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_PER_TENANT):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._next_id = 0
+        # Stacked question vectors, rebuilt lazily after inserts/evictions
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: List[int] = []
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+
+    def _vectors(self) -> Tuple[np.ndarray, List[int]]:
+        if self._matrix is None:
+            self._matrix_ids = list(self.entries.keys())
+            self._matrix = np.stack([self.entries[i].vector for i in self._matrix_ids]) if self._matrix_ids else np.zeros((0, 1), dtype=np.float32)
+        return self._matrix, self._matrix_ids
+
+    def lookup(self, vector: np.ndarray, history: str, context: Tuple[str, ...], threshold: float, ttl: float) -> Optional[CachedAnswer]:
+        matrix, ids = self._vectors()
+        if not ids:
+            return None
+        scores = matrix @ vector
+        cutoff = time.time() - ttl
+        for pos in np.argsort(-scores):
+            if scores[pos] < threshold:
+                break
+            entry = self.entries.get(ids[pos])
+            if entry is None or entry.created_at < cutoff:
+                continue
+            if entry.history == history and entry.context == context:
+                self.entries.move_to_end(ids[pos])
+                return entry
+        return None
+
+    def add(self, entry: CachedAnswer):
+        self.entries[self._next_id] = entry
+        self._next_id += 1
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._matrix = None
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        max_tenants: int = ANSWER_CACHE_MAX_TENANTS,
+        max_per_tenant: int = ANSWER_CACHE_MAX_PER_TENANT,
+        ttl: float = ANSWER_CACHE_TTL_SECONDS
+    ):
+        self.threshold = threshold
+        self.max_tenants = max_tenants
+        self.max_per_tenant = max_per_tenant
+        self.ttl = ttl
+        self._tenants: "OrderedDict[str, TenantAnswerCache]" = OrderedDict()
+
+    def _tenant(self, company_id: str) -> TenantAnswerCache:
+        tenant = self._tenants.get(company_id)
+        if tenant is None:
+            tenant = TenantAnswerCache(self.max_per_tenant)
+            self._tenants[company_id] = tenant
+            while len(self._tenants) > self.max_tenants:
+                self._tenants.popitem(last=False)
+        self._tenants.move_to_end(company_id)
+        return tenant
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def get(self, company_id: str, query_vector: np.ndarray, messages: List[Dict[str, str]], matches: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        tenant = self._tenant(company_id)
+        entry = tenant.lookup(self._normalize(query_vector), history_key(messages), context_key(matches), self.threshold, self.ttl)
+        if entry is None:
+            tenant.misses += 1
+            return None
+        tenant.hits += 1
+        tenant.saved_ms += entry.generation_ms
+        return entry.response
+
+    def set(self, company_id: str, query_vector: np.ndarray, messages: List[Dict[str, str]], matches: List[Dict[str, Any]], response: Dict[str, Any], generation_ms: float):
+        if not response.get("content"):
+            return
+        self._tenant(company_id).add(CachedAnswer(
+            self._normalize(query_vector), history_key(messages), context_key(matches), response, generation_ms
+        ))
+
+    def invalidate_tenant(self, company_id: str):
+        """Drops a tenant's answers but keeps its counters."""
+        tenant = self._tenants.get(company_id)
+        if tenant:
+            tenant.entries.clear()
+            tenant._matrix = None
+
+    def stats(self, company_id: str) -> Dict[str, Any]:
+        tenant = self._tenants.get(company_id) or TenantAnswerCache(self.max_per_tenant)
+        total = tenant.hits + tenant.misses
+        return {
+            "enabled": ANSWER_CACHE_ENABLED,
+            "threshold": self.threshold,
+            "entries": len(tenant.entries),
+            "hits": tenant.hits,
+            "misses": tenant.misses,
+            "hit_rate": round(tenant.hits / total, 4) if total else 0.0,
+            "saved_ms": round(tenant.saved_ms, 1),
+        }
+
+
+_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> AnswerCache:
+    global _cache
+    if _cache is None:
+        _cache = AnswerCache()
+    return _cache
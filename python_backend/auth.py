@@ -1,11 +1,16 @@
 from fastapi import Header, HTTPException, Depends
 from pydantic import BaseModel
-from typing import Optional
-from supabase import Client, create_client
+from typing import Optional, Dict, Any
+from supabase import AsyncClient
 import os
+import time
+import asyncio
 import hashlib
+import jwt
 from postgrest.exceptions import APIError
+from telemetry import timed
 from utils import get_supabase_client
+from ttl_cache import TTLCache
 
 # Initialize Supabase client for Auth (Service Role for checking keys)
 supabase_url = os.getenv("SUPABASE_URL") or os.getenv("VITE_SUPABASE_URL")
@@ -15,7 +20,27 @@ supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("VITE_SUPABAS
 if not supabase_url or not supabase_key:
     raise ValueError("Missing Supabase credentials. Ensure SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY (or VITE_ equivalents) are set.")
 
-supabase: Client = create_client(supabase_url, supabase_key)
+# Legacy HS256 projects sign with the JWT secret; asymmetric keys are published on the JWKS endpoint
+supabase_jwt_secret = os.getenv("SUPABASE_JWT_SECRET")
+
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "10000"))
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", "60"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "60"))
+
+# key_hash -> UserContext, user_id -> profile row, sha256(token) -> claims (remote verification only)
+_api_key_cache: "TTLCache[UserContext]" = TTLCache(AUTH_CACHE_MAX_SIZE, API_KEY_CACHE_TTL)
+_profile_cache: "TTLCache[Dict[str, Any]]" = TTLCache(AUTH_CACHE_MAX_SIZE, PROFILE_CACHE_TTL)
+_token_cache: "TTLCache[Dict[str, Any]]" = TTLCache(AUTH_CACHE_MAX_SIZE, PROFILE_CACHE_TTL)
+
+_jwks_client: Optional[jwt.PyJWKClient] = None
+_ASYMMETRIC_ALGS = ["RS256", "ES256", "EdDSA"]
+
+def get_service_client() -> AsyncClient:
+    """
+    Service-role client for key/profile lookups.
+    Cheap to build: it rides on the pooled transport of the running event loop.
+    """
+    return get_supabase_client(supabase_url, supabase_key)
 
 class UserContext(BaseModel):
     user_id: str
@@ -23,49 +48,125 @@ class UserContext(BaseModel):
     role: str
     token: Optional[str] = None
 
+def invalidate_api_key(key_hash: str):
+    """Drops a revoked key from this process's cache (other workers expire it within API_KEY_CACHE_TTL)."""
+    _api_key_cache.pop(key_hash)
+
+def invalidate_user(user_id: str):
+    """Drops a cached profile, e.g. after a role or company change."""
+    _profile_cache.pop(user_id)
+
+def _get_jwks_client() -> jwt.PyJWKClient:
+    global _jwks_client
+    if _jwks_client is None:
+        _jwks_client = jwt.PyJWKClient(f"{supabase_url.rstrip('/')}/auth/v1/.well-known/jwks.json", cache_keys=True, lifespan=3600)
+    return _jwks_client
+
+async def verify_token_locally(token: str) -> Optional[Dict[str, Any]]:
+    """
+    Verifies a Supabase access token without a round trip to GoTrue.
+    Returns the claims, None if local verification is not possible (caller falls back
+    to auth.get_user), and raises 401 for expired or tampered tokens.
+    """
+    try:
+        header = jwt.get_unverified_header(token)
+        alg = header.get("alg")
+        if alg == "HS256":
+            if not supabase_jwt_secret:
+                return None
+            key = supabase_jwt_secret
+        elif alg in _ASYMMETRIC_ALGS:
+            # PyJWKClient fetches with urllib; keep that off the event loop (keys are cached after the first call)
+            signing_key = await asyncio.to_thread(_get_jwks_client().get_signing_key_from_jwt, token)
+            key = signing_key.key
+        else:
+            raise HTTPException(status_code=401, detail="Invalid Token")
+        return jwt.decode(token, key, algorithms=[alg], audience="authenticated")
+    except jwt.PyJWKClientError as e:
+        print(f"JWKS unavailable, falling back to remote token check: {e}")
+        return None
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid Token")
+
+async def _resolve_token_claims(token: str) -> Dict[str, Any]:
+    claims = await verify_token_locally(token)
+    if claims is not None:
+        return claims
+
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    claims = _token_cache.get(token_hash)
+    if claims is not None:
+        return claims
+
+    user_res = await get_service_client().auth.get_user(token)
+    if not user_res.user:
+        raise HTTPException(status_code=401, detail="Invalid Token")
+    claims = {"sub": user_res.user.id}
+
+    # Never cache past the token's own expiry
+    try:
+        exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+    except jwt.InvalidTokenError:
+        exp = None
+    ttl = min(PROFILE_CACHE_TTL, exp - time.time()) if exp else PROFILE_CACHE_TTL
+    if ttl > 0:
+        _token_cache.set(token_hash, claims, ttl=ttl)
+    return claims
+
+@timed("auth")
 async def get_current_user(
     x_api_key: Optional[str] = Header(None, alias="x-api-key"),
     authorization: Optional[str] = Header(None)
 ) -> UserContext:
-    
+
     # 1. API Key Auth (for SDK/Widget)
     if x_api_key:
         # Hash the key to match storage
         key_hash = hashlib.sha256(x_api_key.encode()).hexdigest()
-        
-        res = supabase.table("api_keys").select("company_id, scope").eq("key_hash", key_hash).execute()
-        
+
+        cached_user = _api_key_cache.get(key_hash)
+        if cached_user is not None:
+            return cached_user
+
+        supabase = get_service_client()
+        res = await supabase.table("api_keys").select("company_id, scope").eq("key_hash", key_hash).execute()
+
         if not res.data:
             raise HTTPException(status_code=401, detail="Invalid API Key")
-        
+
         key_record = res.data[0]
-        
-        return UserContext(
+
+        user = UserContext(
             user_id="api_key", # Represents machine/widget user
             company_id=key_record["company_id"],
             role="employee" # API keys act as employees/agents
         )
+        _api_key_cache.set(key_hash, user)
+        return user
 
     # 2. Bearer Token Auth (for Dashboard/Management)
     if authorization:
         token = authorization.split(" ")[1]
-        user_res = supabase.auth.get_user(token)
-        if not user_res.user:
-            raise HTTPException(status_code=401, detail="Invalid Token")
-        user_id = user_res.user.id
-        client = get_supabase_client(supabase_url, supabase_key, token)
-        try:
-            profile_res = client.table("user_profiles").select("company_id, role").eq("user_id", user_id).execute()
-            if profile_res.data:
-                profile = profile_res.data[0]
-                return UserContext(
-                    user_id=user_id,
-                    company_id=profile.get("company_id") or user_id,
-                    role=profile.get("role", "employee"),
-                    token=token
-                )
-        except APIError:
-            pass
+        claims = await _resolve_token_claims(token)
+        user_id = claims["sub"]
+
+        profile = _profile_cache.get(user_id)
+        if profile is None:
+            client = get_supabase_client(supabase_url, supabase_key, token)
+            try:
+                profile_res = await client.table("user_profiles").select("company_id, role").eq("user_id", user_id).execute()
+                profile = profile_res.data[0] if profile_res.data else {}
+                _profile_cache.set(user_id, profile)
+            except APIError:
+                profile = {}
+
+        if profile:
+            return UserContext(
+                user_id=user_id,
+                company_id=profile.get("company_id") or user_id,
+                role=profile.get("role", "employee"),
+                token=token
+            )
         return UserContext(
             user_id=user_id,
             company_id=user_id,
@@ -0,0 +1,62 @@
+"""
+Offline batch triage: run a JSONL file of tickets through the chat pipeline.
+
+Each input line is {"id": ..., "messages": [...]} or {"id": ..., "text": "..."}.
+Results are written as NDJSON (same shape as POST /chat/batch), in completion order:
+
+    python batch_chat.py tickets.jsonl --company-id <uuid> > triage.ndjson
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+from typing import Any, AsyncIterator, Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from auth import get_service_client, UserContext
+from services.rag import RAGService, BATCH_CHAT_CONCURRENCY
+
+
+def to_conversation(ticket: Dict[str, Any]) -> Dict[str, Any]:
+    if "messages" in ticket:
+        return {"id": ticket.get("id"), "messages": ticket["messages"]}
+    return {"id": ticket.get("id"), "messages": [{"role": "user", "content": ticket.get("text", "")}]}
+
+
+async def run_batch(
+    conversations: List[Dict[str, Any]],
+    company_id: str,
+    provider_config: Optional[dict] = None,
+    concurrency: int = BATCH_CHAT_CONCURRENCY
+) -> AsyncIterator[Dict[str, Any]]:
+    """Python entry point for batch chat, using the service client scoped to one company."""
+    user = UserContext(user_id="batch_chat", company_id=company_id, role="admin")
+    service = RAGService(get_service_client())
+    async for result in service.chat_batch(conversations, provider_config or {}, user, concurrency):
+        yield result
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="JSONL file of tickets")
+    parser.add_argument("--company-id", required=True)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CHAT_CONCURRENCY)
+    args = parser.parse_args()
+
+    with open(args.input, encoding="utf-8") as f:
+        conversations = [to_conversation(json.loads(line)) for line in f if line.strip()]
+
+    done = failed = 0
+    async for result in run_batch(conversations, args.company_id, concurrency=args.concurrency):
+        print(json.dumps(result), flush=True)
+        done += 1
+        failed += "error" in result
+    print(f"{done} tickets processed, {failed} failed", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,187 @@
+"""
+Noisy-neighbour simulation: latency of a quiet company's /chat calls while
+another company floods the service, with and without admission control.
+
+Both companies go through the real generate_embeddings (query embedding) and an
+admission slot around a stand-in generation, as RAGService.chat does (retrieval
+and DB are left out). The stand-in provider serves at most --provider-slots
+calls at once (the shared Gemini quota); embedding and generation calls queue
+for it FIFO. The noisy company runs --noisy-clients closed-loop chat clients
+that retry 50ms after a 503, plus a bulk ingest of --ingest-chunks chunks. The
+quiet company sends one chat every --quiet-interval seconds.
+
+Also reports how many provider calls --identical identical concurrent query
+embeddings cost (single-flight coalescing).
+
+Usage:
+    python benchmarks/bench_admission.py [--duration 15] [--noisy-clients 64] [--provider-slots 8]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--duration", type=float, default=15)
+parser.add_argument("--noisy-clients", type=int, default=64)
+parser.add_argument("--ingest-chunks", type=int, default=4000)
+parser.add_argument("--quiet-interval", type=float, default=0.25)
+parser.add_argument("--provider-slots", type=int, default=8)
+parser.add_argument("--llm-latency", type=float, default=0.3)
+parser.add_argument("--embed-latency", type=float, default=0.05)
+parser.add_argument("--identical", type=int, default=50)
+parser.add_argument("--tenant-rpm", type=float, default=600, help="per-company provider calls/min")
+args = parser.parse_args()
+
+os.environ["LLM_MAX_CONCURRENCY"] = str(args.provider_slots)
+os.environ["TENANT_REQUESTS_PER_MIN"] = str(args.tenant_rpm)
+# The stand-in provider's slots are the shared limit, not the per-key embedding budget
+os.environ["EMBED_REQUESTS_PER_MIN"] = "1000000"
+os.environ["EMBED_TOKENS_PER_MIN"] = "1000000000"
+
+import admission
+import model_registry
+from admission import AdmissionController, OverloadedError, BULK, get_admission_controller
+import embedding_cache
+
+KEY = "fake-gemini-key"
+
+
+class Provider:
+    """Shared quota: a fixed number of concurrent calls, served in arrival order."""
+
+    def __init__(self, slots: int):
+        self.slots = threading.BoundedSemaphore(slots)
+        self.calls = 0
+
+    def call(self, latency: float):
+        with self.slots:
+            self.calls += 1
+            time.sleep(latency)
+
+
+provider = Provider(args.provider_slots)
+
+
+class FakeEmbeddings:
+    def __init__(self, **kwargs):
+        pass
+
+    def embed_documents(self, texts):
+        # Called in an executor thread by generate_embeddings
+        provider.call(args.embed_latency)
+        return [[float(len(t) % 7)] * 384 for t in texts]
+
+
+model_registry.GoogleGenerativeAIEmbeddings = FakeEmbeddings
+from utils import generate_embeddings
+
+
+async def generate():
+    await asyncio.get_running_loop().run_in_executor(None, provider.call, args.llm_latency)
+
+
+async def chat(tenant: str, text: str):
+    await generate_embeddings([text], KEY, task_type="retrieval_query", tenant=tenant)
+    async with get_admission_controller().slot(tenant):
+        await generate()
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else float("nan")
+
+
+async def simulate(enabled: bool) -> Dict[str, float]:
+    admission.ADMISSION_ENABLED = enabled
+    admission._controller = AdmissionController()
+    embedding_cache._cache = embedding_cache.EmbeddingCache()
+    stop_at = time.monotonic() + args.duration
+    quiet: List[float] = []
+    counts = {"quiet_shed": 0, "noisy_ok": 0, "noisy_shed": 0, "ingested": 0}
+    seq = 0
+
+    async def noisy_client(i: int):
+        nonlocal seq
+        while time.monotonic() < stop_at:
+            seq += 1
+            try:
+                await chat("noisy", f"noisy question {seq}")
+                counts["noisy_ok"] += 1
+            except OverloadedError:
+                counts["noisy_shed"] += 1
+                await asyncio.sleep(0.05)
+
+    async def ingest():
+        chunks = [f"noisy chunk {i} " + "lorem ipsum " * 40 for i in range(args.ingest_chunks)]
+        for i in range(0, len(chunks), 200):
+            if time.monotonic() >= stop_at:
+                return
+            await generate_embeddings(chunks[i:i + 200], KEY, tenant="noisy", priority=BULK)
+            counts["ingested"] += len(chunks[i:i + 200])
+
+    async def quiet_request(n: int):
+        start = time.perf_counter()
+        try:
+            await chat("quiet", f"quiet question {n}")
+            quiet.append(time.perf_counter() - start)
+        except OverloadedError:
+            counts["quiet_shed"] += 1
+
+    async def quiet_client():
+        requests = []
+        n = 0
+        while time.monotonic() < stop_at:
+            n += 1
+            requests.append(asyncio.create_task(quiet_request(n)))
+            await asyncio.sleep(args.quiet_interval)
+        await asyncio.gather(*requests)
+
+    calls_before = provider.calls
+    await asyncio.gather(quiet_client(), ingest(), *(noisy_client(i) for i in range(args.noisy_clients)))
+    return {
+        "p50": percentile(quiet, 0.5) * 1000,
+        "p95": percentile(quiet, 0.95) * 1000,
+        "p99": percentile(quiet, 0.99) * 1000,
+        "quiet_ok": len(quiet),
+        "provider_calls": provider.calls - calls_before,
+        **counts
+    }
+
+
+async def coalescing() -> int:
+    admission.ADMISSION_ENABLED = True
+    admission._controller = AdmissionController()
+    embedding_cache._cache = embedding_cache.EmbeddingCache()
+    before = provider.calls
+    await asyncio.gather(*(
+        generate_embeddings(["how do I reset my password?"], KEY, task_type="retrieval_query", tenant="quiet")
+        for _ in range(args.identical)
+    ))
+    return provider.calls - before
+
+
+async def main():
+    # Enough threads that the executor is not the bottleneck (the provider is)
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=256))
+    print(f"provider slots {args.provider_slots}, generation {args.llm_latency}s, embedding {args.embed_latency}s; "
+          f"noisy: {args.noisy_clients} chat clients + {args.ingest_chunks}-chunk ingest; "
+          f"quiet: 1 chat / {args.quiet_interval}s for {args.duration:g}s; {args.tenant_rpm:g} calls/min per company")
+    print(f"{'admission':10s} {'quiet p50':>10} {'p95':>8} {'p99':>8} {'ok':>5} {'shed':>5} | "
+          f"{'noisy ok':>8} {'shed':>6} {'ingested':>8} {'calls':>6}")
+    for enabled in (False, True):
+        r = await simulate(enabled)
+        print(f"{'on' if enabled else 'off':10s} {r['p50']:8.0f}ms {r['p95']:6.0f}ms {r['p99']:6.0f}ms "
+              f"{r['quiet_ok']:5d} {r['quiet_shed']:5d} | {r['noisy_ok']:8d} {r['noisy_shed']:6d} "
+              f"{r['ingested']:8d} {r['provider_calls']:6d}")
+    print(f"{args.identical} identical concurrent query embeddings -> {await coalescing()} provider call(s)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+"""
+Ticket triage throughput: one /chat call per ticket vs POST /chat/batch.
+
+Runs the FastAPI app in-process against stand-in providers: the PostgREST
+stand-in (admin profile for a locally signed token, match_documents, conversation insert), a fake
+embeddings model that costs a fixed latency per provider call (behind the real
+generate_embeddings scheduler) and a fake LLM with a fixed generation latency.
+The sequential run uses a sample of the tickets and is extrapolated.
+
+Usage:
+    python benchmarks/bench_batch_chat.py [--tickets 500] [--concurrency 8] [--llm-latency 0.5]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import start_fake_postgrest
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--tickets", type=int, default=500)
+parser.add_argument("--sequential-sample", type=int, default=20, help="tickets sent one by one to /chat")
+parser.add_argument("--concurrency", type=int, default=8)
+parser.add_argument("--llm-latency", type=float, default=0.5, help="stand-in seconds per generation")
+parser.add_argument("--embed-latency", type=float, default=0.15, help="stand-in seconds per embedding call")
+parser.add_argument("--db-latency", type=float, default=0.02, help="stand-in seconds per DB call")
+args = parser.parse_args()
+
+server, base_url = start_fake_postgrest(args.db_latency)
+os.environ["SUPABASE_URL"] = base_url
+os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "service-role-key"
+os.environ["GEMINI_API_KEY"] = "fake-gemini-key"
+# Batch chat is for admins/owners: sign in with a locally verified token (the stand-in's profile is an admin)
+JWT_SECRET = "bench-jwt-secret-for-local-stand-ins"
+os.environ["SUPABASE_JWT_SECRET"] = JWT_SECRET
+# Every ticket should reach the (fake) LLM
+os.environ["ANSWER_CACHE_ENABLED"] = "false"
+
+import httpx
+import jwt
+from langchain_core.messages import AIMessage
+
+import main
+import model_registry
+
+ANSWER = json.dumps({"content": "Routing to billing.", "intent": "billing_issue", "confidence": 0.9,
+                     "sentiment": "negative", "action": "escalate", "reasoning": "bench"})
+
+
+class FakeLLM:
+    def __init__(self, **kwargs):
+        pass
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(args.llm_latency)
+        return AIMessage(content=ANSWER)
+
+
+class FakeEmbeddings:
+    def __init__(self, **kwargs):
+        pass
+
+    def embed_documents(self, texts):
+        # Called in an executor thread by generate_embeddings
+        time.sleep(args.embed_latency)
+        return [[float(len(t) % 7)] * 384 for t in texts]
+
+
+model_registry.ChatGoogleGenerativeAI = FakeLLM
+model_registry.GoogleGenerativeAIEmbeddings = FakeEmbeddings
+
+TICKETS = [f"Ticket {i}: I was charged twice for order #{10000 + i}, please refund" for i in range(args.tickets)]
+
+
+async def run():
+    transport = httpx.ASGITransport(app=main.app)
+    token = jwt.encode({"sub": "bench-admin", "aud": "authenticated", "exp": int(time.time()) + 3600}, JWT_SECRET, algorithm="HS256")
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # One ticket at a time through /chat
+        sample = TICKETS[:args.sequential_sample]
+        start = time.perf_counter()
+        for text in sample:
+            res = await client.post("/chat", json={"messages": [{"role": "user", "content": f"{text} (single)"}]}, headers=headers)
+            assert res.status_code == 200, res.text
+        sequential = time.perf_counter() - start
+        sequential_rate = len(sample) / sequential * 60
+
+        # Whole set through /chat/batch
+        payload = {
+            "conversations": [{"id": str(i), "messages": [{"role": "user", "content": text}]} for i, text in enumerate(TICKETS)],
+            "concurrency": args.concurrency
+        }
+        # (the in-process ASGI transport delivers the NDJSON body at the end, so only totals are timed)
+        start = time.perf_counter()
+        results = errors = 0
+        async with client.stream("POST", "/chat/batch", json=payload, headers=headers) as res:
+            assert res.status_code == 200
+            async for line in res.aiter_lines():
+                if not line:
+                    continue
+                results += 1
+                errors += "error" in json.loads(line)
+        batch = time.perf_counter() - start
+
+    print(f"stand-ins: llm={args.llm_latency * 1000:.0f}ms embed={args.embed_latency * 1000:.0f}ms/call db={args.db_latency * 1000:.0f}ms")
+    print(f"/chat one by one   {sequential_rate:10.1f} tickets/min  ({sequential / len(sample) * 1000:.0f} ms/ticket, {len(sample)} sampled)")
+    print(f"/chat/batch        {results / batch * 60:10.1f} tickets/min  ({results} tickets in {batch:.1f}s, "
+          f"{errors} errors, concurrency={args.concurrency})")
+
+
+asyncio.run(run())
+server.shutdown()
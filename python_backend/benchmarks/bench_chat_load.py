@@ -0,0 +1,96 @@
+"""
+/chat latency under concurrent load with an artificially slow DB stand-in.
+
+Drives the FastAPI app in-process (ASGI transport) with N concurrent users
+authenticating by x-api-key, so the api_keys lookup, match_documents RPC and
+conversation insert all hit the stand-in. LLM and embeddings are instant fakes.
+With a non-blocking data path p50 stays close to (DB hops x latency); if a DB
+call blocked the event loop, latency would grow with the number of users.
+
+Usage:
+    python benchmarks/bench_chat_load.py [--users 50] [--rounds 4] [--latency 0.1]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import start_fake_postgrest
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--users", type=int, default=50)
+parser.add_argument("--rounds", type=int, default=4, help="requests per user")
+parser.add_argument("--latency", type=float, default=0.1, help="stand-in seconds per DB call")
+args = parser.parse_args()
+
+server, base_url = start_fake_postgrest(args.latency)
+os.environ["SUPABASE_URL"] = base_url
+os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "service-role-key"
+os.environ["GEMINI_API_KEY"] = "fake-gemini-key"
+# Every request should reach the (fake) LLM; this measures the Supabase path
+os.environ["ANSWER_CACHE_ENABLED"] = "false"
+
+import httpx
+from langchain_core.messages import AIMessage
+
+import main
+import model_registry
+from services import rag
+
+ANSWER = json.dumps({"content": "ok", "intent": "general_query", "confidence": 0.9,
+                     "sentiment": "neutral", "action": "resolve", "reasoning": "bench"})
+
+
+class FakeLLM:
+    def __init__(self, **kwargs):
+        pass
+
+    async def ainvoke(self, messages):
+        return AIMessage(content=ANSWER)
+
+
+async def fake_embeddings(texts, api_key, task_type="retrieval_document", **kwargs):
+    return [[0.0] * 384 for _ in texts]
+
+
+model_registry.ChatGoogleGenerativeAI = FakeLLM
+rag.generate_embeddings = fake_embeddings
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run():
+    latencies = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        async def user(i):
+            for r in range(args.rounds):
+                start = time.perf_counter()
+                res = await client.post(
+                    "/chat",
+                    json={"messages": [{"role": "user", "content": f"question {i}-{r}"}]},
+                    headers={"x-api-key": f"key-{i}"},
+                )
+                assert res.status_code == 200, res.text
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(i) for i in range(args.users)))
+        elapsed = time.perf_counter() - start
+
+    print(f"users={args.users} requests={len(latencies)} db_latency={args.latency * 1000:.0f}ms")
+    print(f"throughput {len(latencies) / elapsed:8.1f} req/s")
+    print(f"p50 {percentile(latencies, 50) * 1000:8.1f} ms")
+    print(f"p99 {percentile(latencies, 99) * 1000:8.1f} ms")
+
+
+asyncio.run(run())
+server.shutdown()
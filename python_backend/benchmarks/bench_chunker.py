@@ -0,0 +1,139 @@
+"""
+Chunking throughput and chunk-size distribution: the previous
+RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200) vs the
+structure-aware chunker, single-threaded and through the process pool.
+
+Inputs are test_doc.txt and a synthetic corpus (default 50 MB) of headed
+sections with hard-wrapped paragraphs of varying sentence lengths. Sizes are
+reported in estimated model tokens (the unit the embedding batches and
+prompt budgets use), with the share of chunks over the token budget.
+
+Usage:
+    python benchmarks/bench_chunker.py [--corpus-mb 50] [--workers 4]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from typing import List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.append(BACKEND_DIR)
+
+WORDS = ("customer order refund invoice account password billing shipment carrier warehouse subscription "
+         "plan upgrade downgrade ticket agent escalation priority response policy return exchange warranty "
+         "device firmware update error code network latency region integration webhook token quota").split()
+
+
+def synthetic_corpus(size_mb: float, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    parts: List[str] = []
+    total = 0
+    section = 0
+    while total < size_mb * 1024 * 1024:
+        section += 1
+        heading = f"{section}. " + " ".join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(2, 5)))
+        paragraphs = []
+        for _ in range(rng.randint(2, 6)):
+            sentences = []
+            for _ in range(rng.randint(2, 9)):
+                words = [rng.choice(WORDS) for _ in range(rng.randint(5, 40))]
+                if rng.random() < 0.1:
+                    words.append(f"E-{rng.randint(1000, 9999)}")
+                sentences.append(" ".join(words).capitalize() + rng.choice(".!?."))
+            paragraph = " ".join(sentences)
+            # Hard-wrap like text exported from PDFs
+            lines, line = [], ""
+            for word in paragraph.split(" "):
+                if len(line) + len(word) > 78:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = f"{line} {word}" if line else word
+            lines.append(line)
+            paragraphs.append("\n".join(lines))
+        part = heading + "\n\n" + "\n\n".join(paragraphs) + "\n\n"
+        parts.append(part)
+        total += len(part)
+    return "".join(parts)
+
+
+def distribution(token_counts: List[int], budget: int) -> str:
+    ordered = sorted(token_counts)
+
+    def pct(p: float) -> int:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    over = sum(1 for t in ordered if t > budget) / len(ordered) * 100
+    return (f"chunks={len(ordered):7d}  tokens p5={pct(0.05):4d} p50={pct(0.5):4d} p95={pct(0.95):4d} "
+            f"max={ordered[-1]:5d} mean={statistics.mean(ordered):6.1f}  over {budget}: {over:4.1f}%")
+
+
+def run_recursive(text: str):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from langchain_core.documents import Document
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+    return [c.page_content for c in splitter.split_documents([Document(page_content=text, metadata={})])]
+
+
+def run_chunker(text: str):
+    from langchain_core.documents import Document
+    from chunker import chunk_documents
+    return [c.page_content for c in chunk_documents([Document(page_content=text, metadata={})])]
+
+
+def run_chunker_pool(text: str):
+    from langchain_core.documents import Document
+    import chunker
+
+    async def collect():
+        out = []
+        async for batch in chunker.aiter_chunks([Document(page_content=text, metadata={})]):
+            out.extend(c.page_content for c in batch)
+        return out
+
+    return asyncio.run(collect())
+
+
+def measure(name: str, fn, text: str, budget: int):
+    from embedding_scheduler import estimate_tokens
+    start = time.perf_counter()
+    chunks = fn(text)
+    elapsed = time.perf_counter() - start
+    mb = len(text.encode("utf-8")) / (1024 * 1024)
+    print(f"  {name:22s} {mb / elapsed:7.2f} MB/s  {elapsed:7.2f}s  {distribution([estimate_tokens(c) for c in chunks], budget)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus-mb", type=float, default=50)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--doc", default=os.path.join(BACKEND_DIR, "..", "test_doc.txt"))
+    args = parser.parse_args()
+
+    # Must be set before chunker is imported
+    os.environ["CHUNK_WORKERS"] = str(args.workers)
+    import chunker
+
+    with open(args.doc, encoding="utf-8") as f:
+        inputs = [("test_doc.txt", f.read())]
+    inputs.append((f"synthetic {args.corpus_mb:g} MB", synthetic_corpus(args.corpus_mb)))
+
+    budget = chunker.CHUNK_TOKENS
+    print(f"token budget {budget} (overlap {chunker.CHUNK_OVERLAP_TOKENS}); recursive splitter: 1000 chars / 200 overlap; "
+          f"{args.workers} pool workers, {os.cpu_count()} CPUs")
+    for name, text in inputs:
+        print(name)
+        measure("recursive (previous)", run_recursive, text, budget)
+        measure("chunker", run_chunker, text, budget)
+        if args.workers > 1 and len(text) >= chunker.CHUNK_PARALLEL_MIN_CHARS:
+            measure(f"chunker pool x{args.workers}", run_chunker_pool, text, budget)
+    chunker.shutdown_chunk_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,481 @@
+"""
+End-to-end load and regression benchmark of the API against local stand-ins.
+
+The app runs unmodified as `uvicorn main:app` in a child process; only its
+providers are local:
+- Supabase: fake_postgrest in its in-memory store mode, seeded with one API key
+  and one admin profile per company (api_keys, user_profiles), storing what the
+  app writes (knowledge_documents, document_chunks, conversations, messages)
+  and answering match_documents by cosine similarity over the stored chunks.
+  Admins sign in with HS256 tokens verified against SUPABASE_JWT_SECRET.
+- Gemini: fake_gemini's chat and embedding models (latency, streaming, and
+  500 / 429 injection).
+
+Scenarios, each against a freshly started server:
+- ingest: --ingest-docs uploads of the repo fixtures (test_doc.txt,
+  dummy_ingest.txt) by admins, --ingest-concurrency at a time, timed from
+  upload until the job is indexed. Copies are tagged per line so the embedding
+  cache does not turn them into hits.
+- chat / chat_stream: --concurrency closed-loop clients asking distinct
+  questions about the fixtures through /chat or /chat/stream for --duration
+  seconds, after a --warmup. chat_stream also reports time to first token.
+The chat scenarios retrieve from the chunks ingested before them (a setup
+ingest runs unmeasured when the ingest scenario is skipped).
+
+Each reports throughput, p50/p95/p99 latency, the error count, the per-stage
+breakdown (stage_duration_seconds from /metrics, per request or document) and
+the server's peak RSS. Admission control keeps its concurrency limits but the
+per-company rate budgets are lifted and the answer cache is off, so every
+request runs the whole pipeline; set these in the environment to override.
+
+With --repeat N each scenario runs N times on fresh servers and reports the
+median of each metric. --save-baseline stores the results in --baseline
+(benchmarks/baseline.json); later runs compare against it and exit 1 when
+throughput drops, p50 / p95 latency or peak RSS rise, or the error rate grows
+by more than --tolerance. Record the baseline on the machine that runs the
+comparison, with the same settings (the committed one: --repeat 3 on 1 CPU).
+
+Usage:
+    python benchmarks/bench_e2e.py [--scenarios ingest,chat,chat_stream] [--concurrency 16] [--duration 15]
+    python benchmarks/bench_e2e.py --repeat 3 [--save-baseline]
+    python benchmarks/bench_e2e.py --gemini-429-rate 0.05 --db-latency 0.01 --no-compare
+"""
+import os
+import re
+import sys
+import json
+import time
+import socket
+import asyncio
+import hashlib
+import argparse
+import platform
+import itertools
+import subprocess
+from typing import Any, Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+sys.path.append(BACKEND_DIR)
+sys.path.append(BENCH_DIR)
+
+FIXTURES = [os.path.join(REPO_DIR, "test_doc.txt"), os.path.join(REPO_DIR, "dummy_ingest.txt")]
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+SCENARIOS = ("ingest", "chat", "chat_stream")
+JWT_SECRET = "bench-jwt-secret-for-local-stand-ins"
+INGEST_TIMEOUT = 300
+QUESTIONS = [
+    "What is the secret code for Project Alpha?",
+    "Which Azure AI services does the training report cover?",
+    "Who submitted the training report and to which department?",
+    "How does Azure speech to text work?",
+    "What does the declaration in the report certify?",
+    "How is the ingestion pipeline verified?",
+]
+# Metric -> True when higher is better (p99 is reported but too noisy over short runs to gate on)
+COMPARED = {"throughput": True, "p50_ms": False, "p95_ms": False, "peak_rss_mb": False}
+STAGE_LINE = re.compile(r'^stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+
+
+def run_child():
+    """Server process: Gemini stand-ins, then the unmodified app under uvicorn."""
+    import fake_gemini
+    fake_gemini.install(fake_gemini.FakeGeminiConfig.from_json(os.environ["BENCH_FAKE_GEMINI"]))
+    import uvicorn
+    uvicorn.run("main:app", host="127.0.0.1", port=int(os.environ["PORT"]), log_level="warning")
+
+
+def api_key(company: int) -> str:
+    return f"bench-key-{company}"
+
+
+def admin_token(company: int) -> str:
+    import jwt
+    return jwt.encode({"sub": f"admin-{company}", "aud": "authenticated", "role": "authenticated",
+                       "exp": int(time.time()) + 24 * 3600}, JWT_SECRET, algorithm="HS256")
+
+
+def seed_rows(companies: int) -> Dict[str, List[Dict[str, Any]]]:
+    return {
+        "api_keys": [
+            {"id": f"key-{i}", "key_hash": hashlib.sha256(api_key(i).encode()).hexdigest(),
+             "company_id": f"company-{i}", "scope": ["chat:use"]}
+            for i in range(companies)
+        ],
+        "user_profiles": [
+            {"user_id": f"admin-{i}", "company_id": f"company-{i}", "role": "admin"}
+            for i in range(companies)
+        ],
+        "knowledge_documents": [],
+        "document_chunks": [],
+        "conversations": [],
+        "messages": [],
+    }
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000 if ordered else float("nan")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    """The app in a child process, with /metrics scrapes and its peak RSS."""
+
+    def __init__(self, env: Dict[str, str], verbose: bool):
+        import httpx
+        port = free_port()
+        self.url = f"http://127.0.0.1:{port}"
+        output = None if verbose else subprocess.DEVNULL
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--child"],
+            cwd=BACKEND_DIR, env={**env, "PORT": str(port)}, stdout=output, stderr=output
+        )
+        deadline = time.monotonic() + 60
+        with httpx.Client(base_url=self.url) as client:
+            while True:
+                try:
+                    if client.get("/").status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("API server did not start (rerun with --verbose)")
+                time.sleep(0.05)
+
+    async def stages(self, client) -> Dict[str, List[float]]:
+        """stage -> [seconds, calls] so far."""
+        totals: Dict[str, List[float]] = {}
+        for line in (await client.get("/metrics")).text.splitlines():
+            match = STAGE_LINE.match(line)
+            if match:
+                kind, stage, value = match.groups()
+                totals.setdefault(stage, [0.0, 0])[0 if kind == "sum" else 1] = float(value)
+        return totals
+
+    def peak_rss_mb(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return None
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=40)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def stage_breakdown(before: Dict[str, List[float]], after: Dict[str, List[float]], units: int) -> Dict[str, Dict[str, float]]:
+    """Per stage: calls and total ms per request (or document), and mean ms per call."""
+    breakdown = {}
+    for stage, (seconds, calls) in after.items():
+        seconds -= before.get(stage, [0.0, 0])[0]
+        calls -= before.get(stage, [0.0, 0])[1]
+        if calls:
+            breakdown[stage] = {
+                "calls_per_unit": round(calls / max(1, units), 2),
+                "ms_per_unit": round(seconds * 1000 / max(1, units), 2),
+                "ms_per_call": round(seconds * 1000 / calls, 2),
+            }
+    return dict(sorted(breakdown.items(), key=lambda item: -item[1]["ms_per_unit"]))
+
+
+def fixture_copy(path: str, copy: int) -> Tuple[str, bytes]:
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    tagged = "\n".join(f"{line} [copy {copy}]" if line.strip() else line for line in lines)
+    name, ext = os.path.splitext(os.path.basename(path))
+    return f"{name}-{copy}{ext}", tagged.encode()
+
+
+async def ingest_documents(client, docs: int, concurrency: int, companies: int, first_copy: int) -> Tuple[List[float], int, Dict[int, int]]:
+    """Uploads `docs` fixture copies; returns (seconds until indexed per doc, chunks stored, errors by status)."""
+    latencies: List[float] = []
+    errors: Dict[int, int] = {}
+    chunks = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def ingest(n: int):
+        nonlocal chunks
+        company = n % companies
+        headers = {"Authorization": f"Bearer {admin_token(company)}"}
+        name, content = fixture_copy(FIXTURES[n % len(FIXTURES)], first_copy + n)
+        async with slots:
+            start = time.perf_counter()
+            res = await client.post("/ingest", files={"file": (name, content, "text/plain")}, headers=headers)
+            if res.status_code != 202:
+                errors[res.status_code] = errors.get(res.status_code, 0) + 1
+                return
+            job_id = res.json()["job_id"]
+            job = {"status": "error"}
+            while time.perf_counter() - start < INGEST_TIMEOUT:
+                await asyncio.sleep(0.02)
+                res = await client.get(f"/ingest/{job_id}", headers=headers)
+                # Injected DB errors can fail a poll; the job itself carries on
+                if res.status_code == 200 and res.json()["status"] in ("indexed", "error"):
+                    job = res.json()
+                    break
+            if job["status"] == "error":
+                errors[500] = errors.get(500, 0) + 1
+                return
+            latencies.append(time.perf_counter() - start)
+            chunks += (job.get("progress") or {}).get("chunks_stored", 0)
+
+    await asyncio.gather(*(ingest(n) for n in range(docs)))
+    return latencies, chunks, errors
+
+
+async def chat_load(client, path: str, concurrency: int, duration: float, companies: int, counter) -> Tuple[List[float], List[float], Dict[int, int]]:
+    """Closed-loop clients; returns (latencies, times to first token, errors by status)."""
+    latencies: List[float] = []
+    first_tokens: List[float] = []
+    errors: Dict[int, int] = {}
+    stop_at = time.perf_counter() + duration
+
+    async def user(i: int):
+        headers = {"x-api-key": api_key(i % companies)}
+        while time.perf_counter() < stop_at:
+            n = next(counter)
+            body = {"messages": [{"role": "user", "content": f"{QUESTIONS[n % len(QUESTIONS)]} (ticket {n})"}]}
+            start = time.perf_counter()
+            if path == "/chat":
+                res = await client.post(path, json=body, headers=headers)
+                status = res.status_code
+            else:
+                status, first_token = 200, None
+                async with client.stream("POST", path, json=body, headers=headers) as res:
+                    event = None
+                    async for line in res.aiter_lines():
+                        if line.startswith("event: "):
+                            event = line[7:]
+                            if event == "token" and first_token is None:
+                                first_token = time.perf_counter() - start
+                            elif event == "error":
+                                status = 500
+                    status = res.status_code if res.status_code != 200 else status
+                if first_token is not None and status == 200:
+                    first_tokens.append(first_token)
+            if status != 200:
+                errors[status] = errors.get(status, 0) + 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    return latencies, first_tokens, errors
+
+
+async def run_scenario(name: str, args, server: Server, copies) -> Dict[str, Any]:
+    import httpx
+    limits = httpx.Limits(max_connections=args.concurrency + 8, max_keepalive_connections=args.concurrency + 8)
+    async with httpx.AsyncClient(base_url=server.url, timeout=120, limits=limits) as client:
+        first_tokens: List[float] = []
+        if name == "ingest":
+            before = await server.stages(client)
+            start = time.perf_counter()
+            latencies, chunks, errors = await ingest_documents(client, args.ingest_docs, args.ingest_concurrency, args.companies, next(copies))
+            elapsed = time.perf_counter() - start
+            extra = {"chunks": chunks, "chunks_per_s": round(chunks / elapsed, 1)}
+        else:
+            path = "/chat" if name == "chat" else "/chat/stream"
+            counter = itertools.count()
+            # Connections, auth caches, model clients and per-company vector state
+            await chat_load(client, path, args.concurrency, args.warmup, args.companies, counter)
+            before = await server.stages(client)
+            start = time.perf_counter()
+            latencies, first_tokens, errors = await chat_load(client, path, args.concurrency, args.duration, args.companies, counter)
+            elapsed = time.perf_counter() - start
+            extra = {}
+        after = await server.stages(client)
+
+    total = len(latencies) + sum(errors.values())
+    result = {
+        "requests": total,
+        "errors": errors,
+        "error_rate": round(sum(errors.values()) / max(1, total), 4),
+        "throughput": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.5), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+        **extra,
+    }
+    if first_tokens:
+        result.update({"ttft_p50_ms": round(percentile(first_tokens, 0.5), 1), "ttft_p95_ms": round(percentile(first_tokens, 0.95), 1)})
+    result["peak_rss_mb"] = round(server.peak_rss_mb() or 0, 1) or None
+    result["stages"] = stage_breakdown(before, after, len(latencies))
+    return result
+
+
+def median_result(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Median of each metric over repeated runs; errors summed, stages from the median-throughput run."""
+    ordered = sorted(runs, key=lambda r: r["throughput"])
+    result = dict(ordered[len(ordered) // 2])
+    for key, value in result.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            values = sorted(r[key] for r in runs if r.get(key) is not None)
+            result[key] = values[len(values) // 2] if values else None
+    errors: Dict[str, int] = {}
+    for run in runs:
+        for status, count in run["errors"].items():
+            errors[str(status)] = errors.get(str(status), 0) + count
+    result["errors"] = errors
+    result["runs"] = len(runs)
+    return result
+
+
+def print_result(name: str, result: Dict[str, Any]):
+    unit = "docs" if name == "ingest" else "req"
+    print(f"\n{name}: {result['throughput']:.2f} {unit}/s   p50 {result['p50_ms']:.0f} ms   p95 {result['p95_ms']:.0f} ms"
+          f"   p99 {result['p99_ms']:.0f} ms   peak RSS {result['peak_rss_mb']} MB")
+    details = [f"{result['requests']} {unit}" + (f" per run (median of {result['runs']} runs)" if result["runs"] > 1 else ""),
+               f"errors {result['errors'] or 0}"]
+    if "chunks" in result:
+        details.append(f"{result['chunks']} chunks ({result['chunks_per_s']}/s)")
+    if "ttft_p50_ms" in result:
+        details.append(f"first token p50 {result['ttft_p50_ms']:.0f} ms, p95 {result['ttft_p95_ms']:.0f} ms")
+    print("  " + "   ".join(details))
+    print(f"  {'stage':22s} {'calls/' + unit:>10s} {'ms/' + unit:>10s} {'ms/call':>10s}")
+    for stage, row in result["stages"].items():
+        print(f"  {stage:22s} {row['calls_per_unit']:10.2f} {row['ms_per_unit']:10.1f} {row['ms_per_call']:10.1f}")
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Human-readable regressions of `results` against the stored baseline."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{name} {metric}: {old} -> {new} ({change:+.0%})")
+        if result["error_rate"] > previous.get("error_rate", 0) + tolerance / 10:
+            regressions.append(f"{name} error_rate: {previous.get('error_rate', 0)} -> {result['error_rate']}")
+    return regressions
+
+
+def machine() -> Dict[str, Any]:
+    return {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--child", action="store_true")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent chat clients")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per chat scenario")
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per scenario; metrics are the median")
+    parser.add_argument("--ingest-docs", type=int, default=32)
+    parser.add_argument("--ingest-concurrency", type=int, default=4)
+    parser.add_argument("--companies", type=int, default=4)
+    parser.add_argument("--db-latency", type=float, default=0.002, help="stand-in seconds per Supabase call")
+    parser.add_argument("--db-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-ttft", type=float, default=0.3)
+    parser.add_argument("--llm-token-latency", type=float, default=0.005)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-429-rate", type=float, default=0.0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--no-compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true", help="show the API server's output")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child()
+        return
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    import fake_gemini
+    from fake_postgrest import start_fake_postgrest
+    gemini = fake_gemini.FakeGeminiConfig(
+        ttft=args.llm_ttft, token_latency=args.llm_token_latency, embed_latency=args.embed_latency,
+        error_rate=args.gemini_error_rate, rate_limit_rate=args.gemini_429_rate
+    )
+    fake, fake_url = start_fake_postgrest(args.db_latency, seed=seed_rows(args.companies), error_rate=args.db_error_rate)
+    env = {
+        **os.environ,
+        "SUPABASE_URL": fake_url,
+        "SUPABASE_SERVICE_ROLE_KEY": "service-role-key",
+        "SUPABASE_JWT_SECRET": JWT_SECRET,
+        "GEMINI_API_KEY": "fake-gemini-key",
+        "BENCH_FAKE_GEMINI": gemini.to_json(),
+    }
+    # Every request runs the whole pipeline; the limits, not the budgets, shape the load
+    for name, value in (("ANSWER_CACHE_ENABLED", "false"), ("TENANT_REQUESTS_PER_MIN", "1000000"),
+                        ("TENANT_REQUESTS_BURST", "100000"), ("EMBED_REQUESTS_PER_MIN", "1000000"),
+                        ("EMBED_TOKENS_PER_MIN", "1000000000")):
+        env.setdefault(name, value)
+
+    config = {k: v for k, v in vars(args).items() if k not in ("child", "baseline", "save_baseline", "no_compare", "tolerance", "verbose")}
+    print(f"{os.cpu_count()} CPUs; {args.companies} companies; Supabase +{args.db_latency * 1000:g} ms/call; "
+          f"Gemini first token {args.llm_ttft * 1000:g} ms, embed {args.embed_latency * 1000:g} ms/call; "
+          f"injected errors db {args.db_error_rate:g}, gemini {args.gemini_error_rate:g}, 429 {args.gemini_429_rate:g}")
+
+    copies = itertools.count(0, args.ingest_docs)
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        if "ingest" not in scenarios:
+            server = Server(env, args.verbose)
+            try:
+                asyncio.run(run_scenario("ingest", args, server, copies))
+            finally:
+                server.stop()
+        for name in scenarios:
+            runs = []
+            for _ in range(max(1, args.repeat)):
+                server = Server(env, args.verbose)
+                try:
+                    runs.append(asyncio.run(run_scenario(name, args, server, copies)))
+                finally:
+                    server.stop()
+            results[name] = median_result(runs)
+            print_result(name, results[name])
+    finally:
+        fake.shutdown()
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"machine": machine(), "config": config, "results": results}, f, indent=2)
+            f.write("\n")
+        print(f"\nBaseline saved to {os.path.relpath(args.baseline)}")
+        return
+    if args.no_compare or not os.path.exists(args.baseline):
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("machine") != machine() or baseline.get("config") != config:
+        print("\nNote: the baseline was recorded on another machine or with other settings; differences may not be regressions")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\nRegressions beyond {args.tolerance:.0%} of {os.path.relpath(args.baseline)}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"\nNo regressions beyond {args.tolerance:.0%} of {os.path.relpath(args.baseline)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Wall-clock embedding time for 10/100/1000 chunks against a fake provider.
+
+Compares the EmbeddingScheduler with the old serial loop (5 texts per call,
+0.5s before every call, 2s between batches). The fake provider simulates
+per-call latency and enforces its own requests/min quota with 429 + Retry-After.
+
+Usage:
+    python benchmarks/bench_embeddings.py [--latency 0.3] [--rpm 100] [--legacy]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+from typing import List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_scheduler import EmbeddingScheduler, KeyRateLimiter, RateLimitError
+
+
+class FakeEmbeddingProvider:
+    def __init__(self, latency: float, rpm: float, dims: int = 768):
+        self.latency = latency
+        self.rpm = rpm
+        self.dims = dims
+        self.calls = 0
+        self.rate_limited = 0
+        self._window_start = time.monotonic()
+        self._window_calls = 0
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        now = time.monotonic()
+        if now - self._window_start >= 60:
+            self._window_start, self._window_calls = now, 0
+        if self._window_calls >= self.rpm:
+            self.rate_limited += 1
+            raise RateLimitError("429 RESOURCE_EXHAUSTED", retry_after=60 - (now - self._window_start))
+        self._window_calls += 1
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [[float(len(t))] * self.dims for t in texts]
+
+
+async def legacy_embed(provider: FakeEmbeddingProvider, texts: List[str]) -> List[List[float]]:
+    results = []
+    for i in range(0, len(texts), 5):
+        if i > 0:
+            await asyncio.sleep(2)
+        await asyncio.sleep(0.5)
+        results.extend(await provider.embed_batch(texts[i:i + 5]))
+    return results
+
+
+async def run(n_chunks: int, args) -> None:
+    texts = [f"chunk {i} " + "lorem ipsum " * 80 for i in range(n_chunks)]
+
+    provider = FakeEmbeddingProvider(args.latency, args.rpm)
+    scheduler = EmbeddingScheduler(
+        provider.embed_batch,
+        KeyRateLimiter(requests_per_min=args.rpm, tokens_per_min=args.tpm),
+        concurrency=args.concurrency,
+    )
+    start = time.perf_counter()
+    embeddings = await scheduler.embed(texts)
+    elapsed = time.perf_counter() - start
+    assert [e[0] for e in embeddings] == [float(len(t)) for t in texts], "results out of order"
+    print(f"scheduler  chunks={n_chunks:5d}  calls={provider.calls:4d}  429s={provider.rate_limited}  wall={elapsed:7.2f}s")
+
+    if args.legacy:
+        provider = FakeEmbeddingProvider(args.latency, args.rpm)
+        start = time.perf_counter()
+        await legacy_embed(provider, texts)
+        elapsed = time.perf_counter() - start
+        print(f"legacy     chunks={n_chunks:5d}  calls={provider.calls:4d}  429s={provider.rate_limited}  wall={elapsed:7.2f}s")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.3, help="fake provider seconds per call")
+    parser.add_argument("--rpm", type=float, default=100)
+    parser.add_argument("--tpm", type=float, default=1_000_000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--sizes", default="10,100,1000")
+    parser.add_argument("--legacy", action="store_true", help="also time the old serial loop (slow)")
+    args = parser.parse_args()
+
+    for n in [int(s) for s in args.sizes.split(",")]:
+        await run(n, args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
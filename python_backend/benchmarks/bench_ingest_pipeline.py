@@ -0,0 +1,202 @@
+"""
+Peak RSS and end-to-end ingest time on large inputs: pipelined vs staged.
+
+"pipelined" is IngestionService.process_document as shipped (split -> embed ->
+insert stages joined by bounded queues, inserts cut by payload bytes).
+"staged" replays the previous flow on the same primitives: each page window
+is split, fully embedded, then inserted in fixed batches of 50 rows, one
+stage after the other.
+
+Each (mode, size) runs in its own subprocess so ru_maxrss is that run's peak.
+The embeddings model is a stand-in with a fixed latency per provider call
+(behind the real generate_embeddings scheduler, rate limits lifted) and the
+DB is an in-process stand-in whose insert latency grows with payload bytes.
+Inserted rows are counted, not kept.
+
+Usage:
+    python benchmarks/bench_ingest_pipeline.py [--sizes 1,5,20] [--embed-latency 0.15]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BENCH_DIR))
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", default="1,5,20", help="document sizes in MB")
+parser.add_argument("--embed-latency", type=float, default=0.15, help="stand-in seconds per embedding call")
+parser.add_argument("--insert-latency", type=float, default=0.03, help="stand-in seconds per insert call")
+parser.add_argument("--insert-mbps", type=float, default=20.0, help="stand-in insert bandwidth (MB/s)")
+parser.add_argument("--run", default=None, help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+
+def run_one(mode: str, size_mb: float):
+    os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+    os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "bench")
+    os.environ["GEMINI_API_KEY"] = "fake-gemini-key"
+    os.environ["ANSWER_CACHE_ENABLED"] = "false"
+    # Measure the pipeline, not the provider quota
+    os.environ["EMBED_REQUESTS_PER_MIN"] = "1000000"
+    os.environ["EMBED_TOKENS_PER_MIN"] = "1000000000"
+
+    import asyncio
+    import model_registry
+    from services import ingestion
+    from auth import UserContext
+    from utils import EMBEDDING_DIMS
+
+    class FakeEmbeddings:
+        def __init__(self, **kwargs):
+            pass
+
+        def embed_documents(self, texts):
+            time.sleep(args.embed_latency)
+            return [[(len(t) % 97) / 97.0 + 0.123456] * EMBEDDING_DIMS for t in texts]
+
+    model_registry.GoogleGenerativeAIEmbeddings = FakeEmbeddings
+
+    stats = {"rows": 0, "inserts": 0, "bytes": 0}
+
+    class Result:
+        def __init__(self, data):
+            self.data = data
+
+    class Query:
+        def __init__(self, table):
+            self.table = table
+            self.op = "select"
+            self.payload = None
+
+        def select(self, *a):
+            return self
+
+        def insert(self, payload):
+            self.op, self.payload = "insert", payload
+            return self
+
+        def update(self, payload):
+            self.op = "update"
+            return self
+
+        def delete(self):
+            self.op = "delete"
+            return self
+
+        def eq(self, *a):
+            return self
+
+        def in_(self, *a):
+            return self
+
+        def order(self, *a):
+            return self
+
+        def range(self, *a):
+            return self
+
+        async def execute(self):
+            if self.table != "document_chunks":
+                return Result([{"id": "doc-1"}])
+            if self.op == "insert":
+                size = len(json.dumps(self.payload))
+                stats["rows"] += len(self.payload)
+                stats["inserts"] += 1
+                stats["bytes"] += size
+                await asyncio.sleep(args.insert_latency + size / (args.insert_mbps * 1024 * 1024))
+            return Result([])
+
+    class DB:
+        def table(self, name):
+            return Query(name)
+
+    class StagedPipeline(ingestion.IngestPipeline):
+        async def run(self, pages):
+            self.chunk_queue = asyncio.Queue()
+            self.row_queue = asyncio.Queue()
+
+            async def flush(window):
+                pending = []
+                await self._split_window(window, pending)
+                if pending:
+                    self.chunk_queue.put_nowait(pending)
+                self.chunk_queue.put_nowait(None)
+                await self.embed_stage()
+                await self.insert_stage()
+
+            window = []
+            async for page in pages:
+                window.append(page)
+                self.progress["pages_parsed"] += 1
+                if len(window) >= ingestion.INGEST_PAGE_WINDOW:
+                    await flush(window)
+                    window = []
+            if window:
+                await flush(window)
+
+    if mode == "staged":
+        ingestion.IngestPipeline = StagedPipeline
+        ingestion.INGEST_EMBED_GROUP = 10 ** 9
+        ingestion.INGEST_INSERT_MAX_ROWS = 50
+        ingestion.INGEST_INSERT_MAX_BYTES = 10 ** 12
+
+    paragraph = ("Orders ship within two business days. Refunds for duplicate charges are issued "
+                 "to the original payment method within five days. ") * 4
+    parts, total, i = [], 0, 0
+    while total < size_mb * 1024 * 1024:
+        part = f"Section {i}. {paragraph}"
+        parts.append(part)
+        total += len(part) + 2
+        i += 1
+    content = "\n\n".join(parts).encode()
+    del parts
+
+    user = UserContext(user_id="bench", company_id="bench", role="admin")
+    service = ingestion.IngestionService(DB())
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    result = asyncio.run(service.process_document("doc-1", "large.txt", content, {}, user))
+    elapsed = time.perf_counter() - start
+    assert result["status"] == "success", result
+    print(json.dumps({
+        "elapsed": elapsed,
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "rss_before_mb": rss_before / 1024,
+        **stats
+    }))
+
+
+if args.run:
+    mode, size = args.run.split(":")
+    # Keep the child's stdout to the one JSON line
+    real_stdout = sys.stdout
+    sys.stdout = sys.stderr
+    import io
+    captured = io.StringIO()
+    sys.stdout = captured
+    run_one(mode, float(size))
+    sys.stdout = real_stdout
+    print(captured.getvalue().strip().splitlines()[-1])
+    sys.exit(0)
+
+print(f"stand-ins: embed={args.embed_latency * 1000:.0f}ms/call insert={args.insert_latency * 1000:.0f}ms + {args.insert_mbps:.0f}MB/s")
+print(f"{'size':>6}  {'mode':10s} {'time':>8}  {'MB/s':>6}  {'peak RSS':>9}  {'inserts':>7}  {'avg insert':>10}")
+for size in [float(s) for s in args.sizes.split(",")]:
+    for mode in ("staged", "pipelined"):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run", f"{mode}:{size}",
+             "--embed-latency", str(args.embed_latency), "--insert-latency", str(args.insert_latency),
+             "--insert-mbps", str(args.insert_mbps)],
+            capture_output=True, text=True
+        )
+        if out.returncode != 0:
+            print(out.stderr)
+            raise SystemExit(f"{mode} run failed")
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{size:5.0f}M  {mode:10s} {r['elapsed']:7.1f}s  {size / r['elapsed']:6.2f}  {r['rss_mb']:7.0f}MB  "
+              f"{r['inserts']:7d}  {r['bytes'] / max(r['inserts'], 1) / 1024:8.0f}KB")
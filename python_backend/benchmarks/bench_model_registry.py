@@ -0,0 +1,71 @@
+"""
+Per-request model setup overhead with and without the model registry.
+
+/chat builds a query embeddings model and a chat model per request; /ingest
+builds a document embeddings model per call. This times constructing the real
+langchain-google-genai objects (no network calls are made) the old way vs
+fetching them from the registry, over a mix of keys.
+
+Usage:
+    python benchmarks/bench_model_registry.py [--requests 50] [--keys 3]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from model_registry import get_chat_model, get_embeddings_model, get_model_registry
+from utils import EMBEDDING_MODEL
+
+
+def legacy_chat_setup(key: str):
+    GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=key, task_type="retrieval_query")
+    ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=key, temperature=0.3)
+
+
+def registry_chat_setup(key: str):
+    get_embeddings_model(EMBEDDING_MODEL, key, "retrieval_query")
+    get_chat_model("gemini-2.5-flash", key, temperature=0.3)
+
+
+def legacy_ingest_setup(key: str):
+    GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=key, task_type="retrieval_document")
+
+
+def registry_ingest_setup(key: str):
+    get_embeddings_model(EMBEDDING_MODEL, key, "retrieval_document")
+
+
+def measure(label: str, setup, requests: int, keys):
+    samples = []
+    for i in range(requests):
+        start = time.perf_counter()
+        setup(keys[i % len(keys)])
+        samples.append((time.perf_counter() - start) * 1000)
+    print(f"{label:24s} mean={statistics.mean(samples):8.2f}ms  p50={statistics.median(samples):8.3f}ms  max={max(samples):8.2f}ms")
+    return statistics.mean(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--keys", type=int, default=3, help="distinct API keys (BYO keys)")
+    args = parser.parse_args()
+    keys = [f"fake-key-{i}" for i in range(args.keys)]
+
+    for name, legacy, registry in [
+        ("/chat", legacy_chat_setup, registry_chat_setup),
+        ("/ingest", legacy_ingest_setup, registry_ingest_setup),
+    ]:
+        before = measure(f"{name} per request", legacy, args.requests, keys)
+        after = measure(f"{name} registry", registry, args.requests, keys)
+        print(f"{name} setup saved per request: {before - after:.1f}ms\n")
+    print(get_model_registry().stats())
+
+
+if __name__ == "__main__":
+    main()
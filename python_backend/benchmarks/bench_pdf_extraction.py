@@ -0,0 +1,118 @@
+"""
+Peak RSS and pages/sec for PDF extraction on a synthetic 500-page PDF.
+
+Compares the old path (temp file + PyPDFLoader.load(), all pages in memory)
+with the streaming extractor (in-memory buffer, process-pool page ranges,
+pages consumed and dropped as they arrive). Each mode runs in a fresh
+subprocess so peak RSS is measured independently.
+
+Usage:
+    python benchmarks/bench_pdf_extraction.py [--pages 500] [--workers 4]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+
+def make_pdf(pages: int, lines_per_page: int = 45) -> bytes:
+    """Builds a plain-text PDF (Helvetica, one content stream per page) without extra dependencies."""
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(b"")  # placeholder, filled in below
+    page_ids = []
+    for p in range(pages):
+        lines = [f"Page {p + 1} line {n}: the quick brown fox jumps over the lazy dog, error E-{p:04d}-{n:02d}." for n in range(lines_per_page)]
+        text = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+        stream = text.encode("latin-1")
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (pages_id, font_id, content_id)
+        ))
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages
+    catalog_id = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref_at = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref_at)
+    return bytes(out)
+
+
+def run_legacy(content: bytes) -> int:
+    import tempfile
+    from langchain_community.document_loaders import PyPDFLoader
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+        tmp_file.write(content)
+        tmp_path = tmp_file.name
+    try:
+        docs = PyPDFLoader(tmp_path).load()
+    finally:
+        os.remove(tmp_path)
+    return len(docs)
+
+
+def run_streaming(content: bytes) -> int:
+    from extraction import aiter_pdf_pages, shutdown_pdf_pool
+
+    async def consume():
+        count = 0
+        async for _ in aiter_pdf_pages(content, "bench.pdf"):
+            count += 1
+        return count
+
+    try:
+        return asyncio.run(consume())
+    finally:
+        shutdown_pdf_pool()
+
+
+def child(mode: str, pages: int):
+    content = make_pdf(pages)
+    start = time.perf_counter()
+    count = run_legacy(content) if mode == "legacy" else run_streaming(content)
+    elapsed = time.perf_counter() - start
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(f"{mode:10s} pages={count:5d} size={len(content) / 1e6:5.1f}MB  {count / elapsed:8.1f} pages/s  "
+          f"peak RSS main={own:6.1f}MB largest worker={workers:6.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--child", choices=["legacy", "streaming"])
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.pages)
+        return
+
+    env = {**os.environ, "PDF_WORKERS": str(args.workers)}
+    for mode in ["legacy", "streaming"]:
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode, "--pages", str(args.pages)], env=env, check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Startup cost and worker scaling of the API process.
+
+1. Import time of `main`: lazily imported provider SDKs vs importing them up
+   front (what main.py did before: langchain_google_genai, the langchain
+   message classes and pypdf at import).
+2. Time from process start to the first healthy GET / and the latency of the
+   first /chat after that: a single `uvicorn main:app` process vs serve.py
+   (1 worker, no SDK preload) vs serve.py with N preloaded workers.
+3. /chat throughput and latency for 1 vs N serve.py workers under concurrent
+   load (the PostgREST stand-in answers auth / match_documents / inserts; LLM
+   and embeddings are instant fakes, so this measures the CPU the API spends
+   per request). Worker scaling needs as many cores as workers.
+
+The servers are this script re-run in --child mode, which installs the fakes
+and then starts uvicorn or serve.py.
+
+Usage:
+    python benchmarks/bench_startup.py [--workers 4] [--clients 64] [--duration 10]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import statistics
+import subprocess
+from typing import List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.append(BACKEND_DIR)
+sys.path.append(BENCH_DIR)
+
+ANSWER = json.dumps({"content": "ok", "intent": "general_query", "confidence": 0.9,
+                     "sentiment": "neutral", "action": "resolve", "reasoning": "bench"})
+EAGER_IMPORTS = "import langchain_google_genai, langchain_core.messages, pypdf"
+
+
+def run_child(mode: str):
+    """Server process: fake LLM / embeddings, then uvicorn (single process) or serve.py."""
+    import model_registry
+
+    class FakeLLM:
+        def __init__(self, **kwargs):
+            pass
+
+        async def ainvoke(self, messages):
+            from langchain_core.messages import AIMessage
+            return AIMessage(content=ANSWER)
+
+    class FakeEmbeddings:
+        def __init__(self, **kwargs):
+            pass
+
+        def embed_documents(self, texts):
+            return [[0.01] * 384 for _ in texts]
+
+    model_registry.ChatGoogleGenerativeAI = FakeLLM
+    model_registry.GoogleGenerativeAIEmbeddings = FakeEmbeddings
+    if mode == "uvicorn":
+        import uvicorn
+        uvicorn.run("main:app", host="127.0.0.1", port=int(os.environ["PORT"]), log_level="warning")
+    else:
+        import serve
+        serve.main()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_time(code: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, check=True, env=os.environ.copy())
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def chat_body(i: int) -> dict:
+    return {"messages": [{"role": "user", "content": f"How do I reset my password? ({i})"}]}
+
+
+def start_server(mode: str, workers: int, preload_modules: Optional[str]) -> Tuple[subprocess.Popen, str, float, float]:
+    """Starts a server; returns (process, base_url, ms to first healthy /, ms for the first /chat)."""
+    import httpx
+    port = free_port()
+    env = {**os.environ, "PORT": str(port), "HOST": "127.0.0.1", "WEB_CONCURRENCY": str(workers)}
+    if preload_modules is not None:
+        env["SERVE_PRELOAD_MODULES"] = preload_modules
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--child", mode],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        while True:
+            try:
+                if client.get("/").status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if process.poll() is not None:
+                raise RuntimeError(f"{mode} server exited during startup")
+            time.sleep(0.01)
+        healthy = time.perf_counter() - start
+        chat_start = time.perf_counter()
+        res = client.post("/chat", json=chat_body(0), headers={"x-api-key": "key-0"})
+        assert res.status_code == 200, res.text
+        first_chat = time.perf_counter() - chat_start
+    return process, base_url, healthy * 1000, first_chat * 1000
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=40)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def load(base_url: str, clients: int, duration: float) -> Tuple[int, List[float]]:
+    import httpx
+    latencies: List[float] = []
+    stop_at = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        async def user(i: int):
+            n = 0
+            while time.perf_counter() < stop_at:
+                n += 1
+                start = time.perf_counter()
+                res = await client.post("/chat", json=chat_body(n), headers={"x-api-key": f"key-{i % 16}"})
+                assert res.status_code == 200, res.text
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(user(i) for i in range(clients)))
+    return len(latencies), latencies
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--child", choices=["uvicorn", "serve"])
+    parser.add_argument("--workers", type=int, default=max(2, os.cpu_count() or 1))
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--db-latency", type=float, default=0.0, help="stand-in seconds per DB call")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    from fake_postgrest import start_fake_postgrest
+    fake, fake_url = start_fake_postgrest(args.db_latency)
+    os.environ.update({
+        "SUPABASE_URL": fake_url,
+        "SUPABASE_SERVICE_ROLE_KEY": "service-role-key",
+        "GEMINI_API_KEY": "fake-gemini-key",
+        # Every request should do the full pipeline
+        "ANSWER_CACHE_ENABLED": "false",
+        "METRICS_ENABLED": "false",
+        # All load comes from one company; measure the API, not its admission budget
+        "ADMISSION_ENABLED": "false",
+    })
+    print(f"{os.cpu_count()} CPUs")
+
+    print("\nimport main (best of %d)" % args.repeat)
+    eager = import_time(f"{EAGER_IMPORTS}; import main", args.repeat)
+    lazy = import_time("import main", args.repeat)
+    print(f"  {'SDKs at import (previous)':34s} {eager:7.0f} ms")
+    print(f"  {'lazy SDK imports':34s} {lazy:7.0f} ms")
+
+    print("\nstart -> first healthy GET /, then first /chat")
+    for label, mode, workers, preload in (
+        ("uvicorn main:app (1 process)", "uvicorn", 1, None),
+        ("serve.py 1 worker, no SDK preload", "serve", 1, ""),
+        ("serve.py 1 worker, SDK preload", "serve", 1, None),
+        (f"serve.py {args.workers} workers, SDK preload", "serve", args.workers, None),
+    ):
+        process, _, healthy, first_chat = start_server(mode, workers, preload)
+        stop_server(process)
+        print(f"  {label:34s} healthy {healthy:7.0f} ms   first /chat {first_chat:7.0f} ms")
+
+    print(f"\n/chat throughput, {args.clients} concurrent clients for {args.duration:g}s")
+    for workers in sorted({1, args.workers}):
+        process, base_url, _, _ = start_server("serve", workers, None)
+        try:
+            # Warm every worker's auth cache and connection pool
+            asyncio.run(load(base_url, args.clients, 1.0))
+            count, latencies = asyncio.run(load(base_url, args.clients, args.duration))
+        finally:
+            stop_server(process)
+        print(f"  {workers:2d} worker(s) {count / args.duration:8.1f} req/s   p50 {percentile(latencies, 0.5) * 1000:6.1f} ms"
+              f"   p99 {percentile(latencies, 0.99) * 1000:6.1f} ms   mean {statistics.mean(latencies) * 1000:6.1f} ms")
+
+    fake.shutdown()
+
+
+if __name__ == "__main__":
+    main()
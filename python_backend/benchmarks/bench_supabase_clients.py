@@ -0,0 +1,81 @@
+"""
+/chat requests/sec with per-request create_client vs the pooled client factory.
+
+Runs the FastAPI app in-process against a local PostgREST stand-in, with the
+LLM and embeddings replaced by instant fakes so only the Supabase path differs.
+
+Usage:
+    python benchmarks/bench_supabase_clients.py [--requests 200] [--latency 0.0]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import start_fake_postgrest
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--requests", type=int, default=200)
+parser.add_argument("--latency", type=float, default=0.0, help="stand-in seconds per DB call")
+args = parser.parse_args()
+
+server, base_url = start_fake_postgrest(args.latency)
+os.environ["SUPABASE_URL"] = base_url
+os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "service-role-key"
+os.environ["GEMINI_API_KEY"] = "fake-gemini-key"
+os.environ["ANSWER_CACHE_ENABLED"] = "false"
+
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage
+from supabase import AsyncClient, AsyncClientOptions
+
+import main
+from auth import UserContext, supabase_url, supabase_key
+import model_registry
+from services import rag
+
+ANSWER = json.dumps({"content": "ok", "intent": "general_query", "confidence": 0.9,
+                     "sentiment": "neutral", "action": "resolve", "reasoning": "bench"})
+
+
+class FakeLLM:
+    def __init__(self, **kwargs):
+        pass
+
+    async def ainvoke(self, messages):
+        return AIMessage(content=ANSWER)
+
+
+async def fake_embeddings(texts, api_key, task_type="retrieval_document", **kwargs):
+    return [[0.0] * 384 for _ in texts]
+
+
+def legacy_auth_client(user: UserContext):
+    # Previous behaviour: a fresh client (and connection pool) per request
+    return AsyncClient(supabase_url, supabase_key, options=AsyncClientOptions(headers={"Authorization": f"Bearer {user.token}"}))
+
+
+model_registry.ChatGoogleGenerativeAI = FakeLLM
+rag.generate_embeddings = fake_embeddings
+main.app.dependency_overrides[main.get_current_user] = lambda: UserContext(
+    user_id="user-1", company_id="company-1", role="admin", token="user-jwt"
+)
+
+pooled_auth_client = main.get_auth_client
+body = {"messages": [{"role": "user", "content": "how do I reset my password"}]}
+
+with TestClient(main.app) as client:
+    for label, factory in [("per-request client", legacy_auth_client), ("pooled factory", pooled_auth_client)]:
+        main.get_auth_client = factory
+        client.post("/chat", json=body)  # warm up
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            assert client.post("/chat", json=body).status_code == 200
+        elapsed = time.perf_counter() - start
+        print(f"{label:28s} {args.requests / elapsed:8.1f} req/s  ({elapsed / args.requests * 1000:.2f} ms/req)")
+
+server.shutdown()
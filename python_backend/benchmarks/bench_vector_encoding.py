@@ -0,0 +1,80 @@
+"""
+Serialization time and payload bytes per 1k chunk vectors.
+
+"json list" is the previous path: pad/truncate with list slicing, then a
+JSON list of Python floats in the insert body / RPC params. The pgvector
+rows are what document_chunks inserts and match_documents calls now send
+(float32 arrays rounded to N decimals, encoded by orjson). Also reports
+decode time for the index loader and the worst cosine error the rounding
+introduces, plus in-process footprint of the float16 / int8 index storage.
+
+Usage:
+    python benchmarks/bench_vector_encoding.py [--chunks 1000] [--dims 384]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_codec import to_vector, format_vector, parse_vector, quantize, dequantize
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--chunks", type=int, default=1000)
+parser.add_argument("--dims", type=int, default=384)
+parser.add_argument("--provider-dims", type=int, default=768, help="size of the vectors the provider returns")
+parser.add_argument("--repeat", type=int, default=5)
+args = parser.parse_args()
+
+rng = np.random.default_rng(0)
+raw = rng.standard_normal((args.chunks, args.provider_dims))
+raw /= np.linalg.norm(raw, axis=1, keepdims=True)
+# The provider client hands back Python lists
+provider_rows = raw.tolist()
+reference = raw[:, :args.dims].astype(np.float32)
+
+
+def best_of(fn):
+    best = float("inf")
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, out
+
+
+def cosine_error(decoded: np.ndarray) -> float:
+    a = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    b = decoded / np.linalg.norm(decoded, axis=1, keepdims=True)
+    return float(1 - (a * b).sum(axis=1).min())
+
+
+def legacy_encode():
+    vectors = [emb[:args.dims] if len(emb) >= args.dims else emb + [0.0] * (args.dims - len(emb)) for emb in provider_rows]
+    return [json.dumps(v) for v in vectors]
+
+
+print(f"{args.chunks} vectors, {args.dims} dims (provider returns {args.provider_dims})")
+print(f"{'encoding':18s} {'encode':>9} {'decode':>9} {'KB/1k':>8} {'B/vector':>9} {'cos err':>9}")
+
+ms, payloads = best_of(legacy_encode)
+decode_ms, decoded = best_of(lambda: np.stack([np.asarray(json.loads(p), dtype=np.float32) for p in payloads]))
+size = sum(len(p) for p in payloads)
+print(f"{'json list':18s} {ms:7.1f}ms {decode_ms:7.1f}ms {size / 1024 * 1000 / args.chunks:8.0f} {size / args.chunks:9.0f} {cosine_error(decoded):9.1e}")
+
+for decimals in (7, 6, 5, 4):
+    ms, payloads = best_of(lambda: [format_vector(to_vector(emb, args.dims), decimals) for emb in provider_rows])
+    decode_ms, decoded = best_of(lambda: np.stack([parse_vector(p) for p in payloads]))
+    size = sum(len(p) for p in payloads)
+    name = f"pgvector {decimals} dp"
+    print(f"{name:18s} {ms:7.1f}ms {decode_ms:7.1f}ms {size / 1024 * 1000 / args.chunks:8.0f} {size / args.chunks:9.0f} {cosine_error(decoded):9.1e}")
+
+print()
+print(f"{'index storage':18s} {'bytes/vector':>12} {'cos err':>9}")
+for dtype in ("float32", "float16", "int8"):
+    values, scales = quantize(reference, dtype)
+    per_vector = (values.nbytes + scales.nbytes) / args.chunks
+    print(f"{dtype:18s} {per_vector:12.0f} {cosine_error(dequantize(values, scales)):9.1e}")
@@ -0,0 +1,92 @@
+"""
+Retrieval latency and recall@5 of the local vector index vs brute force.
+
+The baseline is what match_documents does without an index: score every
+row in float64 and fully sort. The local index is TenantIndex (normalised
+float32 matrix, argpartition top-k). Vectors are clustered so queries have
+real neighbours, and recall@5 is measured against the baseline's top 5.
+
+Usage:
+    python benchmarks/bench_vector_index.py [--sizes 1000,100000,1000000] [--queries 50]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_index import TenantIndex, normalize_rows
+
+DIMS = 384
+BLOCK = 100_000
+
+
+def make_vectors(n: int, rng: np.random.Generator, clusters: int = 256) -> np.ndarray:
+    centers = rng.standard_normal((clusters, DIMS)).astype(np.float32)
+    out = np.empty((n, DIMS), dtype=np.float32)
+    for start in range(0, n, BLOCK):
+        end = min(start + BLOCK, n)
+        assign = rng.integers(0, clusters, end - start)
+        block = centers[assign] + 0.8 * rng.standard_normal((end - start, DIMS)).astype(np.float32)
+        out[start:end] = normalize_rows(block)
+    return out
+
+
+def brute_force_top5(matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+    q = query.astype(np.float64)
+    q /= np.linalg.norm(q)
+    scores = np.empty(len(matrix), dtype=np.float64)
+    for start in range(0, len(matrix), BLOCK):
+        scores[start:start + BLOCK] = matrix[start:start + BLOCK].astype(np.float64) @ q
+    return np.argsort(-scores)[:5]
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def run(n: int, queries: int, rng: np.random.Generator):
+    matrix = make_vectors(n, rng)
+    index = TenantIndex(DIMS)
+    index.matrix = matrix
+    index.ids = [str(i) for i in range(n)]
+    index.document_ids = [None] * n
+    index.contents = [""] * n
+
+    query_vectors = [matrix[rng.integers(0, n)] + 0.3 * rng.standard_normal(DIMS).astype(np.float32) for _ in range(queries)]
+
+    base_ms, local_ms, recalls = [], [], []
+    for q in query_vectors:
+        start = time.perf_counter()
+        expected = brute_force_top5(matrix, q)
+        base_ms.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        got = index.search(q.tolist(), match_count=5, match_threshold=-1.0)
+        local_ms.append((time.perf_counter() - start) * 1000)
+
+        recalls.append(len({int(m["id"]) for m in got} & set(expected.tolist())) / 5)
+
+    print(f"{n:>9,d} vectors  {matrix.nbytes / 1e6:8.1f}MB  "
+          f"brute force p50={statistics.median(base_ms):8.2f}ms p99={percentile(base_ms, 0.99):8.2f}ms  "
+          f"local p50={statistics.median(local_ms):8.2f}ms p99={percentile(local_ms, 0.99):8.2f}ms  "
+          f"recall@5={statistics.mean(recalls):.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    for n in [int(s) for s in args.sizes.split(",")]:
+        run(n, args.queries, rng)
+
+
+if __name__ == "__main__":
+    main()
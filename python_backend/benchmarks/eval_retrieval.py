@@ -0,0 +1,127 @@
+"""
+Offline retrieval eval: dense-only vs keyword-only vs hybrid (RRF).
+
+Chunks test_doc.txt with the ingestion splitter and runs the labelled
+queries in benchmarks/retrieval_queries.json. A chunk is relevant to a
+query when it contains the query's "relevant" passage. Reports recall@k
+(share of queries with a relevant chunk in the top k), MRR@10 and
+per-query retrieval latency (query embedding time excluded).
+
+Dense vectors come from Gemini with --embedder gemini (needs GEMINI_API_KEY).
+The default "hashed" embedder is an offline stand-in (feature-hashed words and
+character trigrams into 384 dims): good enough to exercise the pipeline and
+show the fusion effect, but absolute numbers should be taken from Gemini runs.
+
+Usage:
+    python benchmarks/eval_retrieval.py [--embedder hashed|gemini] [--candidates 20]
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import asyncio
+import argparse
+import statistics
+from typing import Callable, Dict, List
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.append(BACKEND_DIR)
+# services.rag imports auth, which insists on credentials; nothing is contacted
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "eval")
+
+from langchain_core.documents import Document
+from utils import split_documents, EMBEDDING_DIMS
+from vector_index import TenantIndex
+from keyword_index import BM25Index, tokenize
+from services.rag import reciprocal_rank_fusion
+
+KS = [1, 3, 5]
+
+
+def hashed_embedding(text: str) -> List[float]:
+    vector = np.zeros(EMBEDDING_DIMS, dtype=np.float32)
+    for word in tokenize(text):
+        features = [(word, 1.0)] + [(word[i:i + 3], 0.3) for i in range(max(1, len(word) - 2))]
+        for feature, weight in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % EMBEDDING_DIMS] += weight if (h >> 16) & 1 else -weight
+    return vector.tolist()
+
+
+def embed_all(texts: List[str], embedder: str, task_type: str) -> List[List[float]]:
+    if embedder == "hashed":
+        return [hashed_embedding(t) for t in texts]
+    from utils import generate_embeddings
+    key = os.getenv("GEMINI_API_KEY") or os.getenv("VITE_GEMINI_API_KEY")
+    if not key:
+        raise SystemExit("--embedder gemini needs GEMINI_API_KEY")
+    return asyncio.run(generate_embeddings(texts, key, task_type=task_type))
+
+
+def evaluate(name: str, retrieve: Callable[[int], List[Dict]], queries: List[Dict], relevant: List[set]):
+    hits = {k: 0 for k in KS}
+    reciprocal_ranks, latencies = [], []
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        results = retrieve(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ranked = [r["id"] for r in results[:10]]
+        for k in KS:
+            if relevant[i] & set(ranked[:k]):
+                hits[k] += 1
+        first = next((rank for rank, chunk_id in enumerate(ranked, start=1) if chunk_id in relevant[i]), None)
+        reciprocal_ranks.append(1 / first if first else 0.0)
+
+    recall = "  ".join(f"recall@{k}={hits[k] / len(queries):.3f}" for k in KS)
+    print(f"{name:8s} {recall}  MRR@10={statistics.mean(reciprocal_ranks):.3f}  "
+          f"latency p50={statistics.median(latencies):.3f}ms max={max(latencies):.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embedder", choices=["hashed", "gemini"], default="hashed")
+    parser.add_argument("--candidates", type=int, default=20, help="per-retriever candidates before fusion")
+    parser.add_argument("--threshold", type=float, default=None, help="dense similarity threshold (default: 0.5 for gemini, none for hashed)")
+    parser.add_argument("--doc", default=os.path.join(BACKEND_DIR, "..", "test_doc.txt"))
+    parser.add_argument("--queries", default=os.path.join(BENCH_DIR, "retrieval_queries.json"))
+    args = parser.parse_args()
+    threshold = args.threshold if args.threshold is not None else (0.5 if args.embedder == "gemini" else -1.0)
+
+    with open(args.doc, encoding="utf-8") as f:
+        text = f.read()
+    with open(args.queries, encoding="utf-8") as f:
+        queries = json.load(f)
+
+    chunks = [c.page_content for c in split_documents([Document(page_content=text, metadata={"source": "test_doc.txt"})])]
+    rows = [{"id": i, "document_id": "test_doc", "content": c} for i, c in enumerate(chunks)]
+    relevant = [{i for i, c in enumerate(chunks) if q["relevant"] in c} for q in queries]
+    for q, rel in zip(queries, relevant):
+        if not rel:
+            print(f"warning: no chunk contains the passage for {q['query']!r}")
+
+    chunk_vectors = embed_all(chunks, args.embedder, "retrieval_document")
+    query_vectors = embed_all([q["query"] for q in queries], args.embedder, "retrieval_query")
+    dense_index = TenantIndex.from_rows([{**r, "embedding": v} for r, v in zip(rows, chunk_vectors)])
+    bm25 = BM25Index(chunks)
+
+    def dense(i: int, count: int = 10) -> List[Dict]:
+        return dense_index.search(query_vectors[i], count, threshold)
+
+    def keyword(i: int, count: int = 10) -> List[Dict]:
+        return [rows[pos] for pos, _ in bm25.search(queries[i]["query"], count)]
+
+    def hybrid(i: int) -> List[Dict]:
+        return reciprocal_rank_fusion([dense(i, args.candidates), keyword(i, args.candidates)])
+
+    print(f"{len(chunks)} chunks, {len(queries)} queries, embedder={args.embedder}, candidates={args.candidates}")
+    evaluate("dense", dense, queries, relevant)
+    evaluate("keyword", keyword, queries, relevant)
+    evaluate("hybrid", hybrid, queries, relevant)
+
+
+if __name__ == "__main__":
+    main()
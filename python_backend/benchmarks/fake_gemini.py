@@ -0,0 +1,140 @@
+"""
+Local Gemini stand-ins for benchmarks: chat (ainvoke and astream) and embeddings.
+
+`install(config)` swaps them in for the langchain_google_genai classes the
+model registry builds, so the app runs its real pipeline against them.
+
+- Chat answers in the JSON shape the RAG prompt asks for, with `answer_tokens`
+  words of content. ainvoke takes ttft + answer_tokens * token_latency seconds;
+  astream waits ttft and then streams chunks of `stream_chunk_tokens` words,
+  token_latency per word. Responses carry usage_metadata like Gemini's.
+- Embeddings sleep embed_latency per call plus embed_latency_per_text per text,
+  and are deterministic bag-of-words hashes with a component shared by every
+  text, so cosine similarity is 0.5 for unrelated texts and rises with word
+  overlap (retrieval at the default 0.5 threshold finds chunks sharing words).
+- error_rate fails that fraction of calls with a 500; rate_limit_rate with the
+  "429 RESOURCE_EXHAUSTED ... retry in Xs" error Gemini sends, which the
+  embedding scheduler backs off on.
+"""
+import json
+import time
+import asyncio
+import hashlib
+import random
+from dataclasses import dataclass, asdict
+from typing import Any, AsyncIterator, Dict, List
+
+import numpy as np
+
+DIMS = 384
+
+
+@dataclass
+class FakeGeminiConfig:
+    ttft: float = 0.3
+    token_latency: float = 0.005
+    answer_tokens: int = 60
+    stream_chunk_tokens: int = 8
+    embed_latency: float = 0.05
+    embed_latency_per_text: float = 0.0005
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 0.5
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, text: str) -> "FakeGeminiConfig":
+        return cls(**json.loads(text))
+
+
+config = FakeGeminiConfig()
+
+
+def _maybe_fail():
+    roll = random.random()
+    if roll < config.rate_limit_rate:
+        raise Exception(f"429 RESOURCE_EXHAUSTED: Quota exceeded (injected). Please retry in {config.retry_after}s.")
+    if roll < config.rate_limit_rate + config.error_rate:
+        raise Exception("500 INTERNAL: An internal error has occurred (injected)")
+
+
+def _words(text: str) -> List[str]:
+    return [w for w in "".join(c.lower() if c.isalnum() else " " for c in text).split() if len(w) > 2]
+
+
+def fake_embedding(text: str) -> List[float]:
+    """Unit vector: 1/sqrt(2) on a shared axis plus the normalized hashed word counts."""
+    vector = np.zeros(DIMS, dtype=np.float32)
+    for word in _words(text):
+        vector[1 + int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), "little") % (DIMS - 1)] += 1.0
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    vector[0] = 1.0
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeEmbeddings:
+    def __init__(self, **kwargs):
+        self.task_type = kwargs.get("task_type")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Called in an executor thread, like the real client's blocking call
+        time.sleep(config.embed_latency + config.embed_latency_per_text * len(texts))
+        _maybe_fail()
+        return [fake_embedding(t) for t in texts]
+
+
+class FakeChat:
+    def __init__(self, **kwargs):
+        self.model = kwargs.get("model")
+
+    @staticmethod
+    def _answer(messages: List[Any]) -> str:
+        question = messages[-1].content if messages else ""
+        filler = " ".join(["details"] * max(0, config.answer_tokens - 8))
+        return json.dumps({
+            "content": f"Here is what I found about: {question[:80]}. {filler}".strip(),
+            "intent": "general_query",
+            "confidence": 0.9,
+            "sentiment": "neutral",
+            "action": "resolve",
+            "reasoning": "benchmark stand-in"
+        })
+
+    @staticmethod
+    def _usage(messages: List[Any]) -> Dict[str, int]:
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        return {"input_tokens": prompt_tokens, "output_tokens": config.answer_tokens,
+                "total_tokens": prompt_tokens + config.answer_tokens}
+
+    async def ainvoke(self, messages: List[Any]):
+        from langchain_core.messages import AIMessage
+        await asyncio.sleep(config.ttft + config.answer_tokens * config.token_latency)
+        _maybe_fail()
+        return AIMessage(content=self._answer(messages), usage_metadata=self._usage(messages))
+
+    async def astream(self, messages: List[Any]) -> AsyncIterator[Any]:
+        from langchain_core.messages import AIMessageChunk
+        await asyncio.sleep(config.ttft)
+        _maybe_fail()
+        pieces = self._answer(messages).split(" ")
+        step = max(1, config.stream_chunk_tokens)
+        for i in range(0, len(pieces), step):
+            if i:
+                await asyncio.sleep(config.token_latency * step)
+            text = " ".join(pieces[i:i + step]) + (" " if i + step < len(pieces) else "")
+            last = i + step >= len(pieces)
+            yield AIMessageChunk(content=text, usage_metadata=self._usage(messages) if last else None)
+
+
+def install(new_config: FakeGeminiConfig = None):
+    """Makes the model registry build the stand-ins (call before the first model is created)."""
+    global config
+    import model_registry
+    if new_config is not None:
+        config = new_config
+    model_registry.ChatGoogleGenerativeAI = FakeChat
+    model_registry.GoogleGenerativeAIEmbeddings = FakeEmbeddings
@@ -0,0 +1,309 @@
+"""
+Minimal local PostgREST / GoTrue stand-in for benchmarks.
+
+By default it answers the handful of routes the backend uses with canned rows
+after an optional artificial delay: just enough wire behaviour to measure
+client and connection overhead.
+
+With `seed` it keeps an in-memory table store instead, enough of PostgREST for
+the whole app to run end to end: select (columns, eq / in / lt / gt filters, order,
+offset / limit), insert and upsert (ignore / merge duplicates on id,
+return=minimal), update and delete by filter, and the match_documents
+(cosine similarity over stored pgvector text) and match_documents_keyword
+(term overlap) RPCs. GET /auth/v1/user returns the unverified `sub` of the
+bearer token. `error_rate` answers that fraction of requests with a 503.
+"""
+import json
+import math
+import time
+import uuid
+import random
+import threading
+import multiprocessing
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import jwt
+import numpy as np
+
+# Query parameters that are not column filters
+RESERVED_PARAMS = {"select", "order", "offset", "limit", "on_conflict", "columns"}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _parse_list(value: str) -> List[str]:
+    return [v.strip().strip('"') for v in value.strip("()").split(",") if v.strip()]
+
+
+def _tokens(text: str) -> set:
+    return {t for t in "".join(c.lower() if c.isalnum() else " " for c in text).split() if len(t) > 2}
+
+
+class TableStore:
+    """Rows per table behind one lock; just the query features the backend uses."""
+
+    def __init__(self, seed: Dict[str, List[Dict[str, Any]]]):
+        self.tables: Dict[str, List[Dict[str, Any]]] = {name: [dict(row) for row in rows] for name, rows in seed.items()}
+        self.lock = threading.Lock()
+        # document_chunks id -> parsed embedding, so match_documents doesn't re-parse text per call
+        self._vectors: Dict[str, np.ndarray] = {}
+
+    @staticmethod
+    def _matches(row: Dict[str, Any], filters: List[Tuple[str, str]]) -> bool:
+        for column, expression in filters:
+            op, _, value = expression.partition(".")
+            actual = row.get(column)
+            if op == "eq" and str(actual) != value:
+                return False
+            if op == "in" and str(actual) not in _parse_list(value):
+                return False
+            # ISO timestamps in one format compare correctly as strings
+            if op == "lt" and not (actual is not None and str(actual) < value):
+                return False
+            if op == "gt" and not (actual is not None and str(actual) > value):
+                return False
+        return True
+
+    def select(self, table: str, params: Dict[str, str], filters: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = [row for row in self.tables.get(table, []) if self._matches(row, filters)]
+        if "order" in params:
+            column, _, direction = params["order"].partition(".")
+            rows.sort(key=lambda r: str(r.get(column) or ""), reverse=direction.startswith("desc"))
+        offset = int(params.get("offset", 0))
+        limit = int(params["limit"]) if "limit" in params else None
+        rows = rows[offset:offset + limit if limit is not None else None]
+        columns = [c.strip() for c in params.get("select", "*").split(",")]
+        if "*" in columns:
+            return [dict(row) for row in rows]
+        return [{c: row.get(c) for c in columns} for row in rows]
+
+    def insert(self, table: str, rows: List[Dict[str, Any]], resolution: Optional[str]) -> List[Dict[str, Any]]:
+        written = []
+        with self.lock:
+            stored = self.tables.setdefault(table, [])
+            by_id = {row["id"]: row for row in stored} if resolution else {}
+            for row in rows:
+                row = {"created_at": _now(), "updated_at": _now(), **row}
+                row.setdefault("id", str(uuid.uuid4()))
+                existing = by_id.get(row["id"])
+                if existing is not None:
+                    if resolution == "merge-duplicates":
+                        existing.update(row)
+                        written.append(existing)
+                    continue
+                stored.append(row)
+                by_id[row["id"]] = row
+                written.append(row)
+        return [dict(row) for row in written]
+
+    def update(self, table: str, values: Dict[str, Any], filters: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = [row for row in self.tables.get(table, []) if self._matches(row, filters)]
+            for row in rows:
+                # The update_updated_at_column trigger
+                row.update({**values, "updated_at": _now()})
+            return [dict(row) for row in rows]
+
+    def delete(self, table: str, filters: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self.tables.get(table, [])
+            removed = [row for row in rows if self._matches(row, filters)]
+            self.tables[table] = [row for row in rows if not self._matches(row, filters)]
+            for row in removed:
+                self._vectors.pop(row.get("id"), None)
+            return removed
+
+    def _chunks(self, company_id: Optional[str]) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [row for row in self.tables.get("document_chunks", [])
+                    if company_id is None or row.get("company_id") == company_id]
+
+    def match_documents(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        query = np.asarray(json.loads(params["query_embedding"]), dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        scored = []
+        for row in self._chunks(params.get("filter_company_id")):
+            vector = self._vectors.get(row["id"])
+            if vector is None:
+                vector = np.asarray(json.loads(row["embedding"]), dtype=np.float32)
+                vector /= np.linalg.norm(vector) or 1.0
+                self._vectors[row["id"]] = vector
+            similarity = float(query @ vector)
+            if similarity > params.get("match_threshold", 0.0):
+                scored.append((similarity, row))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [
+            {"id": row["id"], "document_id": row.get("document_id"), "content": row["content"], "similarity": similarity}
+            for similarity, row in scored[:params.get("match_count", 5)]
+        ]
+
+    def match_documents_keyword(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        terms = _tokens(params["query_text"])
+        scored = []
+        for row in self._chunks(params.get("filter_company_id")):
+            overlap = len(terms & _tokens(row["content"]))
+            if overlap:
+                scored.append((overlap / math.sqrt(len(terms) or 1), row))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [
+            {"id": row["id"], "document_id": row.get("document_id"), "content": row["content"], "rank": rank}
+            for rank, row in scored[:params.get("match_count", 5)]
+        ]
+
+
+def make_handler(latency: float, store: Optional[TableStore] = None, error_rate: float = 0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, payload, status: int = 200):
+            if latency:
+                time.sleep(latency)
+            body = json.dumps(payload).encode() if payload is not None else b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"null") if length else None
+
+        def _inject_error(self) -> bool:
+            if error_rate and random.random() < error_rate:
+                self._read_body()
+                self._reply({"code": "PGRST000", "message": "injected error", "details": None, "hint": None}, status=503)
+                return True
+            return False
+
+        def _route(self) -> Tuple[str, Dict[str, str], List[Tuple[str, str]]]:
+            url = urlsplit(self.path)
+            pairs = parse_qsl(url.query, keep_blank_values=True)
+            params = {k: v for k, v in pairs if k in RESERVED_PARAMS}
+            filters = [(k, v) for k, v in pairs if k not in RESERVED_PARAMS]
+            return url.path.rsplit("/", 1)[-1], params, filters
+
+        def _prefer(self, option: str) -> Optional[str]:
+            for part in (self.headers.get("Prefer") or "").split(","):
+                name, _, value = part.strip().partition("=")
+                if name == option:
+                    return value
+            return None
+
+        def _rows_reply(self, rows, status: int = 200):
+            if self._prefer("return") == "minimal":
+                return self._reply(None, status=204 if status == 200 else status)
+            return self._reply(rows, status=status)
+
+        def do_GET(self):
+            if self._inject_error():
+                return
+            if self.path.startswith("/auth/v1/user"):
+                user_id = "user-1"
+                if store is not None:
+                    token = (self.headers.get("Authorization") or "").split(" ")[-1]
+                    user_id = jwt.decode(token, options={"verify_signature": False}).get("sub", user_id)
+                return self._reply({"id": user_id, "aud": "authenticated", "role": "authenticated",
+                                    "app_metadata": {}, "user_metadata": {}, "created_at": "2026-01-01T00:00:00Z"})
+            if store is not None:
+                table, params, filters = self._route()
+                return self._reply(store.select(table, params, filters))
+            if self.path.startswith("/rest/v1/api_keys"):
+                return self._reply([{"company_id": "company-1", "scope": ["chat:use"]}])
+            if self.path.startswith("/rest/v1/user_profiles"):
+                return self._reply([{"company_id": "company-1", "role": "admin"}])
+            return self._reply([])
+
+        def do_POST(self):
+            if self._inject_error():
+                return
+            payload = self._read_body()
+            if store is not None:
+                name, _, _ = self._route()
+                if self.path.startswith("/rest/v1/rpc/match_documents_keyword"):
+                    return self._reply(store.match_documents_keyword(payload))
+                if self.path.startswith("/rest/v1/rpc/match_documents"):
+                    return self._reply(store.match_documents(payload))
+                rows = payload if isinstance(payload, list) else [payload or {}]
+                return self._rows_reply(store.insert(name, rows, self._prefer("resolution")), status=201)
+            if self.path.startswith("/rest/v1/rpc/match_documents"):
+                return self._reply([
+                    {"id": str(uuid.uuid4()), "document_id": "doc-1", "content": f"Context chunk {i}", "similarity": 0.9 - i * 0.05}
+                    for i in range(5)
+                ])
+            rows = payload if isinstance(payload, list) else [payload or {}]
+            return self._reply([{"id": str(uuid.uuid4()), **row} for row in rows], status=201)
+
+        def do_PATCH(self):
+            if self._inject_error():
+                return
+            payload = self._read_body()
+            if store is not None:
+                table, _, filters = self._route()
+                return self._rows_reply(store.update(table, payload or {}, filters))
+            return self._reply([payload or {}])
+
+        def do_DELETE(self):
+            if self._inject_error():
+                return
+            # postgrest-py sends a (empty) JSON body with deletes; leaving it unread corrupts the next keep-alive request
+            self._read_body()
+            if store is not None:
+                table, _, filters = self._route()
+                return self._rows_reply(store.delete(table, filters))
+            return self._reply([])
+
+    return Handler
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # default of 5 drops connects under load
+
+
+def _serve(latency: float, port: int, ready, seed: Optional[Dict[str, List[Dict[str, Any]]]], error_rate: float):
+    store = TableStore(seed) if seed is not None else None
+    server = FakeServer(("127.0.0.1", port), make_handler(latency, store, error_rate))
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+class FakePostgrestProcess:
+    """
+    Runs the stand-in in its own process so its request threads don't
+    compete for the GIL with the event loop being measured.
+    """
+
+    def __init__(self, latency: float, port: int, seed: Optional[Dict[str, List[Dict[str, Any]]]] = None, error_rate: float = 0.0):
+        ready = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_serve, args=(latency, port, ready, seed, error_rate), daemon=True)
+        self.process.start()
+        self.port = ready.get(timeout=10)
+
+    def shutdown(self):
+        self.process.terminate()
+        self.process.join()
+
+
+def start_fake_postgrest(
+    latency: float = 0.0,
+    port: int = 0,
+    seed: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+    error_rate: float = 0.0
+) -> Tuple[FakePostgrestProcess, str]:
+    """
+    Starts the stand-in in a child process. Returns (server, base_url).
+    `seed` ({table: rows}) switches from canned replies to the in-memory store.
+    """
+    server = FakePostgrestProcess(latency, port, seed, error_rate)
+    return server, f"http://127.0.0.1:{server.port}"
@@ -0,0 +1,339 @@
+"""
+Structure-aware, token-sized chunking.
+
+Text is cut into blocks at blank lines and heading-like lines, blocks into
+sentences, and sentences are packed greedily into chunks of at most
+CHUNK_TOKENS. A chunk that is already reasonably full ends at the last
+paragraph start rather than mid-paragraph, and a heading always starts a new
+chunk once the current one has some content. Overlap (CHUNK_OVERLAP_TOKENS of
+whole sentences) is only carried over when a chunk has to end mid-paragraph.
+
+Every chunk is a contiguous slice of its page, so metadata carries exact
+start_index / end_index offsets (plus the page for PDFs and the nearest
+heading) for citations. Sizes use the same token estimate as embedding
+batching and prompt budgets.
+
+Large texts (one multi-megabyte export is a single "page") are cut at
+paragraph breaks into segments that a process pool chunks in parallel;
+aiter_chunks yields each segment's chunks in order as they complete.
+"""
+import os
+import re
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+from langchain_core.documents import Document
+from embedding_scheduler import estimate_tokens
+
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+# Every web worker has its own pool, so by default the CPUs are split between WEB_CONCURRENCY workers
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", str(max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", "1"))))))
+# Texts shorter than this are chunked in a thread; longer ones go to the process pool
+CHUNK_PARALLEL_MIN_CHARS = int(os.getenv("CHUNK_PARALLEL_MIN_CHARS", str(2 * 1024 * 1024)))
+CHUNK_SEGMENT_CHARS = int(os.getenv("CHUNK_SEGMENT_CHARS", str(1024 * 1024)))
+# Segments in flight per text (bounds chunks held ahead of the consumer)
+CHUNK_WINDOW_SEGMENTS = int(os.getenv("CHUNK_WINDOW_SEGMENTS", str(max(2, CHUNK_WORKERS * 2))))
+# A chunk at least this full ends at a paragraph start instead of mid-paragraph
+PARAGRAPH_BREAK_FILL = 0.5
+# A heading starts a new chunk once the current one is at least this full
+HEADING_BREAK_FILL = 0.25
+MAX_HEADING_CHARS = 80
+
+# Blank lines separate paragraphs
+_PARAGRAPH_BREAK_RE = re.compile(r"\n[ \t]*\n\s*")
+# Heading candidates: short lines starting like a title (filtered further by _is_heading)
+_HEADING_CANDIDATE_RE = re.compile(r"^[ \t]*(?:#{1,6}[ \t]+\S[^\n]*|[A-Z0-9][^\n]{0,%d})$" % (MAX_HEADING_CHARS - 1), re.M)
+_SENTENCE_END_RE = re.compile(r"[.!?]+[\"')\]”’]*\s+")
+_WORD_RE = re.compile(r"\S+\s*")
+_MARKDOWN_HEADING_RE = re.compile(r"#{1,6}\s+\S")
+_NUMBERED_HEADING_RE = re.compile(r"(?:\d+(?:\.\d+)*\.?|[IVX]+\.|Chapter\s+\d+|Section\s+\d+)\s+[A-Z]")
+
+# (start, end, tokens, starts_block, is_heading)
+Unit = Tuple[int, int, int, bool, bool]
+# (start, end, tokens, heading)
+Span = Tuple[int, int, int, Optional[str]]
+
+
+def _is_heading(text: str, start: int, end: int) -> bool:
+    line = text[start:end].strip()
+    if _MARKDOWN_HEADING_RE.match(line):
+        return True
+    if line[-1] in ".,;:!?)\"'":
+        return False
+    if _NUMBERED_HEADING_RE.match(line):
+        return True
+    # Short title-like line after a finished sentence, a blank line or at the start
+    if len(line.split()) > 8:
+        return False
+    # Last character of the previous line (text[start - 1] is its newline)
+    i = start - 2
+    while i >= 0 and text[i] in " \t":
+        i -= 1
+    return i < 0 or text[i] in ".!?:\n"
+
+
+def _blocks(text: str) -> Iterator[Tuple[int, int, bool]]:
+    """(start, end, is_heading) for paragraphs and heading lines, in order."""
+    headings = [m.span() for m in _HEADING_CANDIDATE_RE.finditer(text) if _is_heading(text, m.start(), m.end())]
+    h = 0
+    start = 0
+    breaks = [m.span() for m in _PARAGRAPH_BREAK_RE.finditer(text)] + [(len(text), len(text))]
+    for break_start, break_end in breaks:
+        block_start = start
+        while h < len(headings) and headings[h][0] < break_start:
+            heading_start, heading_end = headings[h]
+            if heading_start > block_start:
+                yield block_start, heading_start, False
+            yield heading_start, heading_end, True
+            block_start = heading_end
+            h += 1
+        if block_start < break_start:
+            yield block_start, break_start, False
+        start = break_end
+
+
+def _strip_span(text: str, start: int, end: int) -> Tuple[int, int]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _units(text: str, chunk_tokens: int, count_tokens: Callable[[str], int]) -> Iterator[Unit]:
+    """Sentences (or word runs / hard cuts for over-long sentences), flagged with block starts and headings."""
+    for block_start, block_end, is_heading in _blocks(text):
+        block_start, block_end = _strip_span(text, block_start, block_end)
+        if block_start == block_end:
+            continue
+        if is_heading:
+            yield block_start, block_end, count_tokens(text[block_start:block_end]), True, True
+            continue
+
+        first = True
+        cursor = block_start
+        ends = [m.end() for m in _SENTENCE_END_RE.finditer(text, block_start, block_end)]
+        for sentence_end in ends + [block_end]:
+            start, end = _strip_span(text, cursor, sentence_end)
+            cursor = sentence_end
+            if start == end:
+                continue
+            tokens = count_tokens(text[start:end])
+            if tokens <= chunk_tokens:
+                yield start, end, tokens, first, False
+                first = False
+                continue
+            for piece in _split_long(text, start, end, chunk_tokens, count_tokens):
+                yield piece[0], piece[1], piece[2], first, False
+                first = False
+
+
+def _split_long(text: str, start: int, end: int, chunk_tokens: int, count_tokens: Callable[[str], int]) -> Iterator[Tuple[int, int, int]]:
+    """Word runs of at most chunk_tokens; words longer than that are cut by characters."""
+    piece_start = piece_end = start
+    for word in _WORD_RE.finditer(text, start, end):
+        word_tokens = count_tokens(word.group())
+        if word_tokens > chunk_tokens:
+            if piece_end > piece_start:
+                yield piece_start, piece_end, count_tokens(text[piece_start:piece_end])
+            step = max(1, len(word.group()) * chunk_tokens // word_tokens)
+            for cut in range(word.start(), word.end(), step):
+                cut_end = min(cut + step, word.end())
+                yield cut, cut_end, count_tokens(text[cut:cut_end])
+            piece_start = piece_end = word.end()
+            continue
+        if piece_end > piece_start and count_tokens(text[piece_start:word.end()]) > chunk_tokens:
+            yield piece_start, piece_end, count_tokens(text[piece_start:piece_end])
+            piece_start = word.start()
+        piece_end = word.end()
+    if piece_end > piece_start:
+        piece_start, piece_end = _strip_span(text, piece_start, piece_end)
+        yield piece_start, piece_end, count_tokens(text[piece_start:piece_end])
+
+
+def chunk_spans(
+    text: str,
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    count_tokens: Callable[[str], int] = estimate_tokens
+) -> Iterator[Span]:
+    """Yields (start, end, tokens, heading) for each chunk of `text`."""
+    current: List[Unit] = []
+    current_tokens = 0
+    heading: Optional[str] = None
+    chunk_heading: Optional[str] = None
+
+    def span_tokens(start: int, end: int) -> int:
+        # Counted over the actual slice: it includes the whitespace between units
+        return count_tokens(text[start:end])
+
+    def emit(units: List[Unit]) -> Span:
+        start, end = units[0][0], units[-1][1]
+        return start, end, span_tokens(start, end), chunk_heading
+
+    for unit in _units(text, chunk_tokens, count_tokens):
+        start, end, tokens, starts_block, is_heading = unit
+
+        if current and is_heading and current_tokens >= chunk_tokens * HEADING_BREAK_FILL:
+            yield emit(current)
+            current, current_tokens = [], 0
+
+        if current and span_tokens(current[0][0], end) > chunk_tokens:
+            # Prefer ending at the last paragraph start if the chunk is full enough there
+            cut = len(current)
+            for i in range(len(current) - 1, 0, -1):
+                if current[i][3]:
+                    if span_tokens(current[0][0], current[i - 1][1]) >= chunk_tokens * PARAGRAPH_BREAK_FILL:
+                        cut = i
+                    break
+            yield emit(current[:cut])
+            if cut < len(current):
+                # The paragraph that didn't fit moves to the next chunk whole (if it can)
+                current = current[cut:]
+                if span_tokens(current[0][0], end) > chunk_tokens:
+                    yield emit(current)
+                    current = []
+            else:
+                overlap: List[Unit] = []
+                if not starts_block:
+                    # Ending mid-paragraph: repeat its last sentences for context
+                    last_end = current[-1][1]
+                    for previous in reversed(current):
+                        if previous[4] or span_tokens(previous[0], last_end) > overlap_tokens or span_tokens(previous[0], end) > chunk_tokens:
+                            break
+                        overlap.insert(0, previous)
+                        if previous[3]:
+                            break
+                current = overlap
+            current_tokens = sum(u[2] for u in current)
+
+        if is_heading:
+            heading = text[start:end].lstrip("# ").strip()
+        if not current:
+            chunk_heading = heading
+        current.append(unit)
+        current_tokens += tokens
+
+    if current:
+        yield emit(current)
+
+
+def iter_chunks(
+    doc: Document,
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    offset: int = 0
+) -> Iterator[Document]:
+    text = doc.page_content
+    for start, end, tokens, heading in chunk_spans(text, chunk_tokens, overlap_tokens):
+        metadata = {
+            **doc.metadata,
+            "start_index": offset + start,
+            "end_index": offset + end,
+            "tokens": tokens,
+        }
+        if heading:
+            metadata["heading"] = heading
+        yield Document(page_content=text[start:end], metadata=metadata)
+
+
+def chunk_documents(
+    docs: List[Document],
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+) -> List[Document]:
+    return [chunk for doc in docs for chunk in iter_chunks(doc, chunk_tokens, overlap_tokens)]
+
+
+def _segments(text: str, size: int) -> List[Tuple[int, int]]:
+    """Cuts text into ~size pieces at paragraph breaks (else line breaks, else anywhere)."""
+    bounds = []
+    start = 0
+    while start < len(text):
+        end = start + size
+        if end >= len(text):
+            bounds.append((start, len(text)))
+            break
+        cut = text.find("\n\n", end, end + size // 2)
+        if cut == -1:
+            cut = text.find("\n", end, end + size // 2)
+        cut = end if cut == -1 else cut + 1
+        bounds.append((start, cut))
+        start = cut
+    return bounds
+
+
+def _chunk_segment(text: str, chunk_tokens: int, overlap_tokens: int) -> List[Span]:
+    return list(chunk_spans(text, chunk_tokens, overlap_tokens))
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_chunk_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: never fork a process that is running an event loop and thread pools
+        _pool = ProcessPoolExecutor(max_workers=CHUNK_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_chunk_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def aiter_chunks(
+    docs: List[Document],
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+) -> AsyncIterator[List[Document]]:
+    """
+    Yields chunks in document order, a batch at a time, without blocking the event loop.
+    Small pages are chunked in a thread; large texts are fanned out to the process pool
+    by segment, with at most CHUNK_WINDOW_SEGMENTS segments in flight.
+    """
+    loop = asyncio.get_running_loop()
+    small: List[Document] = []
+    for doc in docs:
+        text = doc.page_content
+        if len(text) < CHUNK_PARALLEL_MIN_CHARS or CHUNK_WORKERS < 2:
+            small.append(doc)
+            continue
+        if small:
+            yield await asyncio.to_thread(chunk_documents, small, chunk_tokens, overlap_tokens)
+            small = []
+
+        pool = get_chunk_pool()
+        segments = _segments(text, CHUNK_SEGMENT_CHARS)
+        pending: List[Tuple[int, asyncio.Future]] = []
+        next_segment = 0
+        try:
+            while next_segment < len(segments) or pending:
+                while next_segment < len(segments) and len(pending) < CHUNK_WINDOW_SEGMENTS:
+                    start, end = segments[next_segment]
+                    pending.append((start, loop.run_in_executor(pool, _chunk_segment, text[start:end], chunk_tokens, overlap_tokens)))
+                    next_segment += 1
+                segment_start, future = pending.pop(0)
+                spans = await future
+                batch = []
+                for start, end, tokens, heading in spans:
+                    metadata: Dict = {
+                        **doc.metadata,
+                        "start_index": segment_start + start,
+                        "end_index": segment_start + end,
+                        "tokens": tokens,
+                    }
+                    if heading:
+                        metadata["heading"] = heading
+                    batch.append(Document(page_content=text[segment_start + start:segment_start + end], metadata=metadata))
+                yield batch
+        finally:
+            for _, future in pending:
+                future.cancel()
+    if small:
+        yield await asyncio.to_thread(chunk_documents, small, chunk_tokens, overlap_tokens)
@@ -0,0 +1,149 @@
+"""
+Token-budgeted prompt assembly for RAG chat.
+
+Retrieved chunks are deduplicated (the splitter's overlap makes neighbouring
+chunks repeat up to CHUNK_OVERLAP characters, and near-identical chunks are
+common across documents) and packed best-first into CONTEXT_TOKEN_BUDGET.
+Conversation history is kept newest-first within HISTORY_TOKEN_BUDGET; the
+oldest message that only partly fits is trimmed from the front.
+
+Token counts are estimated, not taken from the model's tokenizer: Gemini's
+count_tokens is a network round trip per call, too slow to run per chunk on
+every request. The estimate is the ~4 chars/token used for embedding batching,
+which holds for English prose but undercounts code, numbers and non-Latin
+scripts (denser tokenization). Every count is therefore scaled by
+TOKEN_ESTIMATE_MARGIN so the budgets stay upper bounds in practice. Gemini's
+own count (usage_metadata) is reported alongside when available, so the
+margin can be checked against real prompts.
+"""
+import os
+import math
+from typing import Any, Dict, List, Set, Tuple
+from embedding_scheduler import estimate_tokens
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1000"))
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "5"))
+# Chars/4 estimates are multiplied by this before being counted against a budget
+TOKEN_ESTIMATE_MARGIN = float(os.getenv("TOKEN_ESTIMATE_MARGIN", "1.25"))
+# Chunks whose shingles are this much contained in an already selected chunk are dropped
+DUPLICATE_CONTAINMENT = 0.8
+# Overlap produced by the chunker (CHUNK_OVERLAP_TOKENS=50, ~200 chars); a little slack for whitespace
+CHUNK_OVERLAP = 250
+MIN_OVERLAP = 40
+# Don't bother keeping a trimmed history message shorter than this
+MIN_TRIMMED_TOKENS = 50
+
+
+def count_tokens(text: str) -> int:
+    """Token estimate with the safety margin applied; what the budgets are charged."""
+    return math.ceil(estimate_tokens(text) * TOKEN_ESTIMATE_MARGIN)
+
+
+def _shingles(text: str, size: int = 5) -> Set[Tuple[str, ...]]:
+    words = text.lower().split()
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of `left` that is a prefix of `right`."""
+    for k in range(min(CHUNK_OVERLAP, len(left), len(right)), MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:k]):
+            return k
+    return 0
+
+
+def dedupe_chunks(matches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Drops near-duplicate chunks and strips text shared with an adjacent selected chunk.
+    Input is in ranking order; output keeps that order. Returns trimmed copies.
+    """
+    selected: List[Dict[str, Any]] = []
+    selected_shingles: List[Set[Tuple[str, ...]]] = []
+    for match in matches:
+        content = (match.get("content") or "").strip()
+        if not content:
+            continue
+        shingles = _shingles(content)
+        if any(shingles and len(shingles & other) / len(shingles) >= DUPLICATE_CONTAINMENT for other in selected_shingles):
+            continue
+
+        for other in selected:
+            if other.get("document_id") != match.get("document_id"):
+                continue
+            head = _overlap(other["content"], content)
+            if head:
+                content = content[head:].lstrip()
+            tail = _overlap(content, other["content"])
+            if tail:
+                content = content[:-tail].rstrip()
+        if not content:
+            continue
+
+        selected.append({**match, "content": content})
+        selected_shingles.append(shingles)
+    return selected
+
+
+def pack_context(matches: List[Dict[str, Any]], budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[List[Dict[str, Any]], int]:
+    """Best-first packing: keeps each chunk that still fits in the budget."""
+    packed, used = [], 0
+    for match in matches:
+        tokens = count_tokens(match["content"])
+        if used + tokens > budget:
+            continue
+        packed.append(match)
+        used += tokens
+    return packed, used
+
+
+def fit_history(
+    messages: List[Dict[str, str]],
+    budget: int = HISTORY_TOKEN_BUDGET,
+    max_messages: int = HISTORY_MAX_MESSAGES
+) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Keeps the most recent messages that fit the budget. The latest message (the question)
+    is always kept whole; the oldest message that only partly fits is trimmed from the front.
+    """
+    recent = [m for m in messages[-max_messages:] if m.get("role") in ("user", "assistant")]
+    if not recent:
+        return [], 0
+
+    kept = [recent[-1]]
+    used = count_tokens(recent[-1]["content"])
+    for msg in reversed(recent[:-1]):
+        tokens = count_tokens(msg["content"])
+        if used + tokens <= budget:
+            kept.append(msg)
+            used += tokens
+            continue
+        remaining = budget - used
+        if remaining >= MIN_TRIMMED_TOKENS:
+            # One token held back for count_tokens rounding up
+            content = "..." + msg["content"][-int((remaining - 1) * 4 / TOKEN_ESTIMATE_MARGIN):]
+            kept.append({**msg, "content": content})
+            used += count_tokens(content)
+        break
+    kept.reverse()
+    return kept, used
+
+
+def build_context(
+    matches: List[Dict[str, Any]],
+    messages: List[Dict[str, str]],
+    context_budget: int = CONTEXT_TOKEN_BUDGET,
+    history_budget: int = HISTORY_TOKEN_BUDGET
+) -> Dict[str, Any]:
+    """Returns the packed chunks, trimmed history and their token counts."""
+    chunks, context_tokens = pack_context(dedupe_chunks(matches or []), context_budget)
+    history, history_tokens = fit_history(messages, history_budget)
+    return {
+        "chunks": chunks,
+        "history": history,
+        "context_tokens": context_tokens,
+        "history_tokens": history_tokens,
+        "dropped_chunks": len(matches or []) - len(chunks),
+    }
@@ -0,0 +1,149 @@
+import os
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+from ttl_cache import TTLCache
+
+CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "50000"))
+CACHE_TTL_SECONDS = float(os.getenv("EMBED_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Optional persistent tier, e.g. EMBED_CACHE_SQLITE_PATH=./embedding_cache.db
+CACHE_SQLITE_PATH = os.getenv("EMBED_CACHE_SQLITE_PATH")
+
+
+def make_cache_key(model: str, task_type: str, dims: int, text: str) -> str:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{model}:{task_type}:{dims}:{digest}"
+
+
+def _pack(vector: np.ndarray) -> bytes:
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def _unpack(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=np.float32).copy()
+
+
+class SQLiteEmbeddingStore:
+    """
+    Persistent tier: survives restarts and is shared by workers on the same host.
+    Calls block on disk (and on other workers' write locks): run them off the event loop.
+    """
+
+    def __init__(self, path: str, ttl: float = CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        found: Dict[str, np.ndarray] = {}
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embedding_cache WHERE created_at > ? AND key IN ({placeholders})",
+                    [cutoff, *part],
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = _unpack(blob)
+        return found
+
+    def set_many(self, items: Dict[str, np.ndarray]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, vector, created_at) VALUES (?, ?, ?)",
+                [(key, _pack(vector), now) for key, vector in items.items()],
+            )
+            self.conn.commit()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache.
+    Tier 1 is an in-process TTLCache, tier 2 an optional persistent store that is
+    read and written in a worker thread so disk I/O never stalls the event loop.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        ttl: float = CACHE_TTL_SECONDS,
+        store: Optional[SQLiteEmbeddingStore] = None,
+    ):
+        self.store = store
+        self._memory: "TTLCache[np.ndarray]" = TTLCache(max_size=max_entries, ttl=ttl)
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    async def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        missing: List[str] = []
+        for key in keys:
+            vector = self._memory.get(key)
+            if vector is not None:
+                found[key] = vector
+            else:
+                missing.append(key)
+
+        if missing and self.store:
+            try:
+                persisted = await asyncio.to_thread(self.store.get_many, missing)
+            except Exception as e:
+                print(f"Embedding cache store error: {e}")
+                persisted = {}
+            for key, vector in persisted.items():
+                self._memory.set(key, vector)
+                found[key] = vector
+            self.persistent_hits += len(persisted)
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    async def set_many(self, items: Dict[str, np.ndarray]):
+        for key, vector in items.items():
+            self._memory.set(key, vector)
+        if self.store:
+            try:
+                await asyncio.to_thread(self.store.set_many, items)
+            except Exception as e:
+                print(f"Embedding cache store error: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._memory),
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    if _cache is None:
+        store = SQLiteEmbeddingStore(CACHE_SQLITE_PATH) if CACHE_SQLITE_PATH else None
+        _cache = EmbeddingCache(store=store)
+    return _cache
@@ -0,0 +1,234 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Dict, List, Optional
+from telemetry import span
+from admission import OverloadedError
+
+# Gemini embedding limits (gemini-embedding-001)
+MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", "100"))
+MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "20000"))
+DEFAULT_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+DEFAULT_RPM = float(os.getenv("EMBED_REQUESTS_PER_MIN", "100"))
+DEFAULT_TPM = float(os.getenv("EMBED_TOKENS_PER_MIN", "30000"))
+
+EmbedBatchFn = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+
+class RateLimitError(Exception):
+    """Raised by an embed function when the provider answers 429 / RESOURCE_EXHAUSTED."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(text: str) -> int:
+    # Rough heuristic (~4 chars per token) - good enough for budgeting
+    return max(1, len(text) // 4)
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    if isinstance(e, RateLimitError):
+        return True
+    error_str = str(e)
+    return "429" in error_str or "RESOURCE_EXHAUSTED" in error_str
+
+
+def parse_retry_after(e: Exception) -> Optional[float]:
+    """
+    Extracts the server-suggested delay from a rate limit error.
+    Understands RateLimitError.retry_after, a Retry-After response header,
+    and the "retry in 12.3s" / "retry_delay { seconds: 12 }" text Gemini returns.
+    """
+    retry_after = getattr(e, "retry_after", None)
+    if retry_after is not None:
+        return float(retry_after)
+
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("Retry-After") or headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+
+    error_str = str(e)
+    match = re.search(r"retry in ([\d.]+)\s*s", error_str, re.IGNORECASE)
+    if not match:
+        match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", error_str)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `rate_per_min`.
+    `pause()` lets a Retry-After hint block every waiter on the bucket.
+    """
+
+    def __init__(self, rate_per_min: float, capacity: Optional[float] = None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity or rate_per_min
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, amount: float = 1.0):
+        # A single request larger than the bucket would wait forever
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    # Backing off after a 429
+                    with span("embed_backoff"):
+                        await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                with span("embed_throttle"):
+                    await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class KeyRateLimiter:
+    """Requests/min and tokens/min budgets for a single API key."""
+
+    def __init__(self, requests_per_min: float = DEFAULT_RPM, tokens_per_min: float = DEFAULT_TPM):
+        self.requests = TokenBucket(requests_per_min)
+        self.tokens = TokenBucket(tokens_per_min)
+
+    async def acquire(self, token_count: int):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(token_count)
+
+    def pause(self, seconds: float):
+        self.requests.pause(seconds)
+        self.tokens.pause(seconds)
+
+
+_limiters: Dict[str, KeyRateLimiter] = {}
+
+
+def get_rate_limiter(api_key: str) -> KeyRateLimiter:
+    """Returns the process-wide limiter for an API key (keyed by hash, never the raw key)."""
+    key = hashlib.sha256(api_key.encode()).hexdigest()
+    limiter = _limiters.get(key)
+    if limiter is None:
+        limiter = KeyRateLimiter()
+        _limiters[key] = limiter
+    return limiter
+
+
+def make_batches(
+    texts: List[str],
+    max_batch_size: int = MAX_BATCH_SIZE,
+    max_batch_tokens: int = MAX_BATCH_TOKENS,
+) -> List[List[int]]:
+    """Greedily groups text indices into batches bounded by count and estimated tokens."""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= max_batch_size or current_tokens + tokens > max_batch_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class EmbeddingScheduler:
+    """
+    Runs embedding batches concurrently under a per-key rate limiter.
+    Results are returned in input order, so callers can zip them with their texts.
+    """
+
+    def __init__(
+        self,
+        embed_batch: EmbedBatchFn,
+        limiter: KeyRateLimiter,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_batch_tokens: int = MAX_BATCH_TOKENS,
+        max_retries: int = 5,
+        base_delay: float = 2.0,
+    ):
+        self.embed_batch = embed_batch
+        self.limiter = limiter
+        self.concurrency = max(1, concurrency)
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+
+    async def _run_batch(self, batch_texts: List[str]) -> List[List[float]]:
+        token_count = sum(estimate_tokens(t) for t in batch_texts)
+        for attempt in range(self.max_retries):
+            await self.limiter.acquire(token_count)
+            try:
+                return await self.embed_batch(batch_texts)
+            except Exception as e:
+                if isinstance(e, OverloadedError):
+                    # Shed by admission control (not a provider error)
+                    raise e
+                if not is_rate_limit_error(e):
+                    print(f"Embedding error: {e}")
+                    raise e
+                if attempt == self.max_retries - 1:
+                    print("Rate limit exhausted. Aborting.")
+                    raise Exception("Rate limit exhausted for embedding provider. Please try again later.")
+                wait_time = parse_retry_after(e)
+                if wait_time is None:
+                    wait_time = self.base_delay * (2 ** attempt)  # Exponential backoff
+                print(f"Rate limit hit. Retrying in {wait_time}s... (Attempt {attempt + 1}/{self.max_retries})")
+                # Pause the whole key so other in-flight batches back off too
+                self.limiter.pause(wait_time)
+
+    async def embed(
+        self,
+        texts: List[str],
+        on_progress: Optional[Callable[[int], None]] = None
+    ) -> List[List[float]]:
+        """Embeds all texts; `on_progress` receives the running count of embedded texts."""
+        if not texts:
+            return []
+
+        batches = make_batches(texts, self.max_batch_size, self.max_batch_tokens)
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        done = 0
+
+        async def worker(indices: List[int]):
+            nonlocal done
+            async with semaphore:
+                embeddings = await self._run_batch([texts[i] for i in indices])
+            if len(embeddings) != len(indices):
+                raise Exception(f"Embedding provider returned {len(embeddings)} vectors for {len(indices)} texts")
+            for i, emb in zip(indices, embeddings):
+                results[i] = emb
+            done += len(indices)
+            if on_progress:
+                on_progress(done)
+
+        await asyncio.gather(*(worker(indices) for indices in batches))
+        return results
@@ -0,0 +1,179 @@
+"""
+PDF / text extraction without temp files.
+
+PDFs are parsed from an in-memory buffer. Large PDFs are shared with a
+process pool through shared memory and extracted page-range by page-range,
+with only a bounded window of ranges in flight, so pages stream to the
+caller in order while memory stays proportional to the window.
+pypdf is imported on the first PDF, not at startup.
+"""
+import io
+import os
+import sys
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING, AsyncIterator, Iterator, List, Optional, Tuple
+from langchain_core.documents import Document
+
+if TYPE_CHECKING:
+    from pypdf import PdfReader
+
+# Every web worker has its own pool, so by default the CPUs are split between WEB_CONCURRENCY workers
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", "1"))))))
+# Below this many pages the pool overhead isn't worth it; extract in a thread
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# Page-range tasks in flight (bounds memory held by extracted-but-unconsumed pages)
+PDF_WINDOW_TASKS = int(os.getenv("PDF_WINDOW_TASKS", str(max(2, PDF_WORKERS * 2))))
+
+PageText = Tuple[int, str]
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+# Worker-side cache: the reader for the document currently being extracted
+_worker_reader: Optional[Tuple[str, "PdfReader"]] = None
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: never fork a process that is running an event loop and thread pools
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pdf_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def _extract_text(page) -> str:
+    try:
+        return page.extract_text() or ""
+    except Exception as e:
+        print(f"Error extracting PDF page: {e}")
+        return ""
+
+
+def open_pdf(content: bytes) -> "PdfReader":
+    from pypdf import PdfReader
+    return PdfReader(io.BytesIO(content))
+
+
+def _attach_reader(shm_name: str, size: int) -> "PdfReader":
+    global _worker_reader
+    if _worker_reader and _worker_reader[0] == shm_name:
+        return _worker_reader[1]
+
+    # Workers share the parent's resource tracker, which unlinks the segment when the parent is done
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=shm_name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+    reader = open_pdf(data)
+    _worker_reader = (shm_name, reader)
+    return reader
+
+
+def _extract_range(shm_name: str, size: int, start: int, end: int) -> List[PageText]:
+    """Process-pool task: extracts pages [start, end) of the shared PDF."""
+    reader = _attach_reader(shm_name, size)
+    return [(i, _extract_text(reader.pages[i])) for i in range(start, end)]
+
+
+def iter_pdf_pages(content: bytes, file_name: str) -> Iterator[Document]:
+    """Extracts pages one at a time from an in-memory PDF (single thread)."""
+    reader = open_pdf(content)
+    total = len(reader.pages)
+    for i, page in enumerate(reader.pages):
+        yield Document(page_content=_extract_text(page), metadata={"source": file_name, "page": i, "total_pages": total})
+
+
+async def aiter_pdf_pages(content: bytes, file_name: str) -> AsyncIterator[Document]:
+    """
+    Yields the pages of an in-memory PDF in order.
+    Large PDFs are extracted in parallel by the process pool; small ones in a thread.
+    """
+    loop = asyncio.get_running_loop()
+    reader = await asyncio.to_thread(open_pdf, content)
+    total = len(reader.pages)
+
+    if total < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS < 2:
+        pages = iter(reader.pages)
+        for i in range(total):
+            page = next(pages)
+            text = await asyncio.to_thread(_extract_text, page)
+            yield Document(page_content=text, metadata={"source": file_name, "page": i, "total_pages": total})
+        return
+
+    del reader
+    shm = shared_memory.SharedMemory(create=True, size=len(content))
+    pending: List[asyncio.Future] = []
+    try:
+        shm.buf[:len(content)] = content
+        pool = get_pdf_pool()
+        ranges = [(s, min(s + PDF_PAGES_PER_TASK, total)) for s in range(0, total, PDF_PAGES_PER_TASK)]
+        next_range = 0
+
+        def submit_next():
+            nonlocal next_range
+            start, end = ranges[next_range]
+            pending.append(loop.run_in_executor(pool, _extract_range, shm.name, len(content), start, end))
+            next_range += 1
+
+        while next_range < len(ranges) and len(pending) < PDF_WINDOW_TASKS:
+            submit_next()
+
+        while pending:
+            pages = await pending.pop(0)
+            if next_range < len(ranges):
+                submit_next()
+            for i, text in pages:
+                yield Document(page_content=text, metadata={"source": file_name, "page": i, "total_pages": total})
+    finally:
+        for future in pending:
+            future.cancel()
+        shm.close()
+        shm.unlink()
+
+
+def decode_text_file(content: bytes, file_name: str) -> List[Document]:
+    # Assume text-based
+    try:
+        text = content.decode('utf-8', errors='ignore')
+        # Check if text is empty or whitespace
+        if not text.strip():
+            print("Warning: Extracted text is empty")
+            return []
+        print(f"Extracted text length: {len(text)} chars")
+        return [Document(page_content=text, metadata={"source": file_name})]
+    except Exception as e:
+        print(f"Error decoding text file: {e}")
+        return []
+
+
+def is_pdf(file_name: str) -> bool:
+    return os.path.splitext(file_name)[1].lower() == '.pdf'
+
+
+async def aiter_pages(content: bytes, file_name: str) -> AsyncIterator[Document]:
+    """Streams the pages (or the single text document) of an upload."""
+    if is_pdf(file_name):
+        try:
+            async for page in aiter_pdf_pages(content, file_name):
+                yield page
+        except Exception as e:
+            print(f"Error loading PDF: {e}")
+            raise Exception(f"Error loading PDF: {e}")
+        return
+    for doc in decode_text_file(content, file_name):
+        yield doc
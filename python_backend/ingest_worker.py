@@ -0,0 +1,75 @@
+"""
+Standalone ingestion worker for INGEST_MODE=external.
+
+The API parks uploads in Storage and marks documents "queued"; this process
+claims them, runs the same IngestionQueue pipeline and writes status/progress
+back to knowledge_documents. The parked upload is removed from Storage once
+its document is indexed or fails. Documents a crashed worker left "processing"
+go back to "queued" once their lease (INGEST_LEASE_SECONDS) runs out. Run as
+many as you like:
+
+    python ingest_worker.py
+"""
+import os
+import sys
+import asyncio
+from dotenv import load_dotenv
+
+load_dotenv()
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from auth import get_service_client, UserContext
+from services.ingestion_queue import IngestionQueue, STORAGE_BUCKET, spool_bytes
+from utils import close_http_client
+
+POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "2.0"))
+
+async def claim_jobs(queue: IngestionQueue, limit: int) -> int:
+    client = get_service_client()
+    res = await client.table("knowledge_documents").select("id, name, company_id, metadata").eq("status", "queued").order("created_at").limit(limit).execute()
+
+    claimed = 0
+    for doc in res.data or []:
+        # Conditional update: only one worker wins the queued -> processing transition
+        claim = await client.table("knowledge_documents").update({"status": "processing"}).eq("id", doc["id"]).eq("status", "queued").execute()
+        if not claim.data:
+            continue
+
+        metadata = doc.get("metadata") or {}
+        try:
+            content = await client.storage.from_(STORAGE_BUCKET).download(metadata["storage_path"])
+        except Exception as e:
+            print(f"Failed to download upload for {doc['id']}: {e}")
+            await client.table("knowledge_documents").update({
+                "status": "error",
+                "metadata": {**metadata, "error": f"Upload missing: {e}"}
+            }).eq("id", doc["id"]).execute()
+            continue
+
+        user = UserContext(
+            user_id=metadata.get("uploaded_by") or "ingest_worker",
+            company_id=doc["company_id"],
+            role="admin"
+        )
+        # BYO keys are not persisted with the upload; workers embed with GEMINI_API_KEY from env
+        upload_path = await spool_bytes(content)
+        queue.submit(doc["id"], doc["name"], upload_path, {}, user, storage_path=metadata["storage_path"])
+        claimed += 1
+    return claimed
+
+async def main():
+    queue = IngestionQueue()
+    queue.start()
+    print(f"Ingest worker started ({queue.workers} workers, queue depth {queue.max_depth})")
+    try:
+        while True:
+            free = queue.max_depth - queue.depth()
+            claimed = await claim_jobs(queue, free) if free > 0 else 0
+            if not claimed:
+                await asyncio.sleep(POLL_INTERVAL)
+    finally:
+        await queue.stop()
+        await close_http_client()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""
+In-process BM25 keyword index over chunk text.
+
+Used by the local retrieval backend (the Postgres path uses the tsvector
+index behind match_documents_keyword) and by the offline retrieval eval.
+Tokens keep codes like "E-1042", "SKU_778" or "/video/create" whole and
+also index their parts, so exact identifiers match as well as words.
+"""
+import re
+import math
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_SPLIT_RE = re.compile(r"[-_./]")
+
+# Too common to help ranking (kept short; BM25's idf handles the rest)
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i",
+    "in", "is", "it", "me", "my", "of", "on", "or", "the", "to", "what", "when", "where", "which",
+    "who", "why", "with", "you", "your",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        parts = _SPLIT_RE.split(token)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p and p not in STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of texts; positions in the list are the result ids."""
+
+    def __init__(self, texts: List[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.lengths: List[int] = []
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((doc_id, tf))
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.lengths) - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """Returns up to k (position, score) pairs, best first."""
+        if not self.lengths:
+            return []
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc_id, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / self.avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
@@ -1,7 +1,9 @@
 import os
 import json
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Body
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Body, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from typing import List, Dict, Optional, Any
 from pydantic import BaseModel
 import uvicorn
@@ -14,38 +16,76 @@ load_dotenv()
 import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from auth import get_current_user, UserContext, supabase, supabase_url, supabase_key
-from services.ingestion import IngestionService
-from services.rag import RAGService
-from utils import get_supabase_client
+from auth import get_current_user, get_service_client, invalidate_api_key, UserContext, supabase_url, supabase_key
+from services.ingestion import IngestionService, is_missing_column_error
+from services.ingestion_queue import get_ingestion_queue, stage_for_external_worker, spool_upload, discard_upload, QueueFullError, INGEST_MODE
+from services.rag import RAGService, ConversationNotFoundError, BATCH_CHAT_CONCURRENCY
+from services.persistence import get_persistence_writer
+from utils import get_supabase_client, close_http_client
+from embedding_cache import get_embedding_cache
+from vector_index import get_vector_index
+from answer_cache import get_answer_cache
+from model_registry import get_model_registry
+from admission import get_admission_controller, OverloadedError
+from telemetry import TimingMiddleware, render_metrics, METRICS_ENABLED, METRICS_TOKEN
+from postgrest.exceptions import APIError
 
-app = FastAPI()
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if INGEST_MODE != "external":
+        # Workers, plus the heartbeat/recovery sweep for documents of crashed processes
+        get_ingestion_queue().start()
+    yield
+    # Stop ingestion workers; documents of jobs that did not finish are marked failed
+    await get_ingestion_queue().stop()
+    # Write out queued conversations/messages before the process exits
+    await get_persistence_writer().stop()
+    # Close pooled Supabase connections while their loop is still running
+    await close_http_client()
+
+app = FastAPI(lifespan=lifespan)
 
 # Helper to get authenticated client
 def get_auth_client(user: UserContext):
     if user.token:
         return get_supabase_client(supabase_url, supabase_key, user.token)
-    return supabase
+    return get_service_client()
 
 # CORS
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173", "http://127.0.0.1:5173", "http://localhost:3000", "http://localhost:8080", "http://0.0.0.0:8080" , "https://customersupport-woyk.onrender.com"],
     allow_credentials=True,
-    allow_methods=["GET", "POST", "OPTIONS"],
-    allow_headers=["Authorization", "Content-Type", "x-api-key"],
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
+    allow_headers=["Authorization", "Content-Type", "x-api-key", "x-debug-timings"],
+    expose_headers=["Server-Timing"],
 )
 
+# Per-route latency, per-stage breakdown (Server-Timing with X-Debug-Timings: 1)
+app.add_middleware(TimingMiddleware)
+
 class ChatRequest(BaseModel):
     messages: List[Dict[str, str]]
     provider_config: Optional[Dict[str, str]] = None
     conversation_id: Optional[str] = None
 
+class BatchChatItem(BaseModel):
+    id: Optional[str] = None
+    messages: List[Dict[str, str]]
+
+class BatchChatRequest(BaseModel):
+    conversations: List[BatchChatItem]
+    provider_config: Optional[Dict[str, str]] = None
+    concurrency: Optional[int] = None
+
 @app.get("/")
 def health_check():
     return {"status": "ok", "service": "Enterprise RAG Platform (Simplified)"}
 
-@app.post("/ingest")
+@app.post("/ingest", status_code=202)
 async def ingest(
     file: UploadFile = File(...),
     provider_config: Optional[str] = Form(None), # JSON string
@@ -53,29 +93,87 @@ async def ingest(
     user: UserContext = Depends(get_current_user)
 ):
     """
-    Ingest a document into the RAG system.
+    Queue a document for ingestion into the RAG system.
+    Returns a job id immediately; poll GET /ingest/{job_id} for progress.
     Only Admins/Owners can perform this action.
     """
     if user.role not in ["admin", "owner"]:
         raise HTTPException(status_code=403, detail="Only admins or owners can ingest documents")
-        
+
+    queue = get_ingestion_queue()
+    # Take the queue slot before the document record exists, so a full queue never leaves it "queued"
+    try:
+        reservation = queue.reserve() if INGEST_MODE != "external" else None
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+    # Use authenticated client if available to satisfy RLS
+    client = get_auth_client(user)
+    service = IngestionService(client)
+    created_id = None
+    upload_path = None
     try:
         user_config_dict = json.loads(provider_config) if provider_config else {}
-        
-        # Use authenticated client if available to satisfy RLS
-        client = get_auth_client(user)
-        service = IngestionService(client)
-        result = await service.ingest_file(
-            file, 
-            user_config_dict, 
-            user,
-            document_id
-        )
-        
-        return result
+        # Spool to disk: queued jobs hold a file path, not the upload's bytes
+        upload_path = await spool_upload(file)
+
+        created_id = await service.prepare_document(file.filename, user, document_id, status="queued")
+
+        if INGEST_MODE == "external":
+            await stage_for_external_worker(client, created_id, file.filename, upload_path, user)
+        else:
+            queue.submit(created_id, file.filename, upload_path, user_config_dict, user, reservation=reservation)
+            # The job deletes the file when it ends
+            upload_path = None
+
+        return {"status": "queued", "job_id": created_id, "document_id": created_id}
     except Exception as e:
         print(f"Ingestion error: {e}")
+        if created_id:
+            try:
+                await service.mark_failed(created_id, str(e))
+            except Exception as mark_error:
+                print(f"Failed to mark document {created_id} as failed: {mark_error}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if reservation is not None:
+            reservation.release()
+        if upload_path:
+            discard_upload(upload_path)
+
+@app.get("/ingest/{job_id}")
+async def ingest_status(
+    job_id: str,
+    user: UserContext = Depends(get_current_user)
+):
+    """
+    Status and progress (pages_parsed, chunks_total, chunks_embedded, chunks_stored and, for
+    re-ingests, chunks_added / chunks_removed / chunks_unchanged) of an ingestion job.
+    Falls back to the knowledge_documents row for jobs run by another worker process.
+    """
+    job = get_ingestion_queue().get(job_id)
+    if job and job.company_id == user.company_id:
+        return job.model_dump()
+
+    client = get_auth_client(user)
+    try:
+        res = await client.table("knowledge_documents").select("id, status, chunk_count, progress, metadata").eq("id", job_id).eq("company_id", user.company_id).execute()
+    except APIError as e:
+        if not is_missing_column_error(e):
+            raise HTTPException(status_code=500, detail=str(e))
+        res = await client.table("knowledge_documents").select("id, status, chunk_count, metadata").eq("id", job_id).execute()
+    if not res.data:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+
+    doc = res.data[0]
+    return {
+        "job_id": doc["id"],
+        "document_id": doc["id"],
+        "status": doc["status"],
+        "progress": doc.get("progress") or {},
+        "chunks": doc.get("chunk_count"),
+        "error": (doc.get("metadata") or {}).get("error")
+    }
 
 @app.post("/chat")
 async def chat(
@@ -98,9 +196,192 @@ async def chat(
         )
         
         return response
+    except ConversationNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except OverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         print(f"Chat error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/batch")
+async def chat_batch(
+    request: BatchChatRequest,
+    user: UserContext = Depends(get_current_user)
+):
+    """
+    Classify/answer many conversations in one request (e.g. offline ticket triage).
+    Streams NDJSON, one line per conversation as it completes:
+    {"index", "id", "response", "cached", "usage"} or {"index", "id", "error"}.
+    Batch items are not saved as conversations. Only admins/owners can run batches.
+    """
+    if user.role not in ["admin", "owner"]:
+        raise HTTPException(status_code=403, detail="Only admins or owners can run batch chat")
+
+    if len(request.conversations) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} conversations per batch")
+
+    client = get_auth_client(user)
+    service = RAGService(client)
+    config = request.provider_config or {}
+    concurrency = min(request.concurrency or BATCH_CHAT_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+
+    async def lines():
+        try:
+            async for result in service.chat_batch(
+                [item.model_dump() for item in request.conversations],
+                config,
+                user,
+                concurrency
+            ):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            print(f"Batch chat error: {e}")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    user: UserContext = Depends(get_current_user)
+):
+    """
+    Server-Sent Events variant of /chat.
+    Emits `token` events with answer text as it is generated, then a `done` event
+    with the structured response (intent, confidence, sentiment, action), conversation_id and timings.
+    A company over its admission budget gets a 503 before the stream starts (or an
+    `error` event with retry_after if it tips over mid-request); a conversation_id
+    of another company gets a 404.
+    """
+    try:
+        get_admission_controller().check(user.company_id)
+    except OverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    client = get_auth_client(user)
+    service = RAGService(client)
+    config = request.provider_config or {}
+    try:
+        await service.check_conversation(user, request.conversation_id)
+    except ConversationNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    async def event_stream():
+        try:
+            async for event, data in service.chat_stream(
+                request.messages,
+                config,
+                user,
+                request.conversation_id
+            ):
+                yield format_sse(event, data)
+        except OverloadedError as e:
+            yield format_sse("error", {"detail": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            yield format_sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.delete("/api-keys/{key_id}")
+async def revoke_api_key(
+    key_id: str,
+    user: UserContext = Depends(get_current_user)
+):
+    """
+    Revoke an API key and drop it from the auth cache immediately.
+    Only Admins/Owners can perform this action.
+    """
+    if user.role not in ["admin", "owner"]:
+        raise HTTPException(status_code=403, detail="Only admins or owners can revoke API keys")
+
+    client = get_auth_client(user)
+    res = await client.table("api_keys").select("key_hash").eq("id", key_id).eq("company_id", user.company_id).execute()
+    if not res.data:
+        raise HTTPException(status_code=404, detail="API key not found")
+
+    await client.table("api_keys").delete().eq("id", key_id).execute()
+    invalidate_api_key(res.data[0]["key_hash"])
+    return {"status": "revoked", "id": key_id}
+
+def get_admin_user(user: UserContext = Depends(get_current_user)) -> UserContext:
+    """
+    Process-wide stats cover every company on this worker: admins and owners only.
+    """
+    if user.role not in ["admin", "owner"]:
+        raise HTTPException(status_code=403, detail="Only admins or owners can view service stats")
+    return user
+
+@app.get("/stats/embedding-cache")
+def embedding_cache_stats(user: UserContext = Depends(get_admin_user)):
+    """
+    Hit/miss counters for the shared embedding cache (process-local).
+    """
+    return get_embedding_cache().stats()
+
+@app.get("/stats/vector-index")
+def vector_index_stats(user: UserContext = Depends(get_admin_user)):
+    """
+    Tenants, vectors, memory and hit rate of the local retrieval index (process-local).
+    """
+    return get_vector_index().stats()
+
+@app.get("/stats/answer-cache")
+def answer_cache_stats(user: UserContext = Depends(get_current_user)):
+    """
+    Semantic answer cache hit rate and generation time saved for the caller's company (process-local).
+    """
+    return get_answer_cache().stats(user.company_id)
+
+@app.get("/stats/models")
+def model_registry_stats(user: UserContext = Depends(get_admin_user)):
+    """
+    Size, hit rate and evictions of the shared LLM / embedding model registry (process-local).
+    """
+    return get_model_registry().stats()
+
+@app.get("/stats/ingestion")
+def ingestion_stats(user: UserContext = Depends(get_admin_user)):
+    """
+    Queue depth, worker count and job counts for this process's ingestion workers.
+    """
+    return get_ingestion_queue().stats()
+
+@app.get("/stats/admission")
+def admission_stats(user: UserContext = Depends(get_admin_user)):
+    """
+    Provider call slots in use, waiting and shed calls overall and for the caller's company (process-local).
+    """
+    controller = get_admission_controller()
+    return {**controller.stats(), "company": controller.tenant_stats(user.company_id)}
+
+@app.get("/stats/persistence")
+def persistence_stats(user: UserContext = Depends(get_admin_user)):
+    """
+    Queue depth and written / dropped / failed row counts of the conversation write-behind queue (process-local).
+    """
+    return get_persistence_writer().stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics(authorization: Optional[str] = Header(None)):
+    """
+    Prometheus exposition: request latency per route and per-stage histograms
+    (auth, embed, admission_wait, vector_search, llm, persist_flush, ingest_*) for this process.
+    """
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
+    # Development server (single auto-reloading process); production uses serve.py
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
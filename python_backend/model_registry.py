@@ -0,0 +1,105 @@
+"""
+Process-wide registry of LLM / embedding model objects.
+
+Building a ChatGoogleGenerativeAI or GoogleGenerativeAIEmbeddings sets up a
+google-genai client (auth, HTTP/gRPC transport) and costs ~150ms, so models
+are built once per (provider, model, api key hash, params) and shared by
+concurrent requests. BYO keys from provider_config make the key space
+open-ended, so the registry is bounded and entries idle for longer than
+MODEL_REGISTRY_IDLE_TTL are evicted. Evicted models are not closed
+explicitly: a request may still be using one, and its transport is released
+when the last reference goes away.
+
+langchain_google_genai (and the google-genai SDK under it) takes over a second
+to import, so it is imported on the first model build, not at startup. Tests
+and benchmarks can still replace the classes by assigning the module attributes.
+"""
+import os
+import hashlib
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, Hashable, Tuple
+from ttl_cache import TTLCache
+
+if TYPE_CHECKING:
+    from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+else:
+    # Resolved by _provider_classes() on first use
+    ChatGoogleGenerativeAI = None
+    GoogleGenerativeAIEmbeddings = None
+
+MODEL_REGISTRY_MAX_SIZE = int(os.getenv("MODEL_REGISTRY_MAX_SIZE", "64"))
+MODEL_REGISTRY_IDLE_TTL = float(os.getenv("MODEL_REGISTRY_IDLE_TTL", "900"))
+
+
+class ModelRegistry:
+    def __init__(self, max_size: int = MODEL_REGISTRY_MAX_SIZE, idle_ttl: float = MODEL_REGISTRY_IDLE_TTL):
+        self._models: "TTLCache[Any]" = TTLCache(max_size=max_size, ttl=idle_ttl, on_evict=self._on_evict)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _on_evict(self, key: Hashable, model: Any):
+        self.evictions += 1
+
+    @staticmethod
+    def make_key(provider: str, model: str, api_key: str, params: Dict[str, Any]) -> Tuple:
+        # Never keep the raw key in the registry key
+        key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+        return (provider, model, key_hash, tuple(sorted(params.items())))
+
+    def get_or_create(self, key: Tuple, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                self.misses += 1
+                model = factory()
+            else:
+                self.hits += 1
+            # Re-setting on every use makes the TTL an idle timeout
+            self._models.set(key, model)
+            return model
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "models": len(self._models),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+_registry = ModelRegistry()
+
+
+def get_model_registry() -> ModelRegistry:
+    return _registry
+
+
+def _provider_classes():
+    global ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+    if ChatGoogleGenerativeAI is None or GoogleGenerativeAIEmbeddings is None:
+        import langchain_google_genai
+        ChatGoogleGenerativeAI = ChatGoogleGenerativeAI or langchain_google_genai.ChatGoogleGenerativeAI
+        GoogleGenerativeAIEmbeddings = GoogleGenerativeAIEmbeddings or langchain_google_genai.GoogleGenerativeAIEmbeddings
+    return ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+
+
+def get_chat_model(model: str, api_key: str, temperature: float = 0.3) -> "ChatGoogleGenerativeAI":
+    key = ModelRegistry.make_key("google", model, api_key, {"temperature": temperature})
+    return _registry.get_or_create(key, lambda: _provider_classes()[0](
+        model=model,
+        google_api_key=api_key,
+        temperature=temperature
+    ))
+
+
+def get_embeddings_model(model: str, api_key: str, task_type: str) -> "GoogleGenerativeAIEmbeddings":
+    key = ModelRegistry.make_key("google", model, api_key, {"task_type": task_type})
+    return _registry.get_or_create(key, lambda: _provider_classes()[1](
+        model=model,
+        google_api_key=api_key,
+        task_type=task_type
+    ))
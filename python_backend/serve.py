@@ -0,0 +1,143 @@
+"""
+Production entry point: several uvicorn worker processes on one listening socket.
+
+    python serve.py
+
+The supervisor binds HOST:PORT, imports the app once (SERVE_PRELOAD) and forks
+WEB_CONCURRENCY workers, so workers start from the already imported app instead
+of each paying the import. SERVE_PRELOAD_MODULES are imported too; the app
+loads these lazily, and importing them before the fork means no worker stalls
+on them at its first chat / PDF.
+
+SIGTERM or SIGINT to the supervisor is passed on to the workers once: each stops
+accepting connections, lets in-flight requests finish for up to GRACEFUL_TIMEOUT
+seconds and runs the app's shutdown (ingestion workers stop, queued conversation
+rows are written). Workers that die unexpectedly are replaced.
+
+main.py's own __main__ runs a single auto-reloading process for development.
+"""
+import os
+import sys
+import time
+import signal
+import importlib
+from typing import Any, Dict
+
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+# Exported so the app sizes its per-worker process pools (PDF_WORKERS, CHUNK_WORKERS) to match
+os.environ["WEB_CONCURRENCY"] = str(WEB_CONCURRENCY)
+SERVE_PRELOAD = os.getenv("SERVE_PRELOAD", "true").lower() == "true"
+SERVE_PRELOAD_MODULES = [m.strip() for m in os.getenv("SERVE_PRELOAD_MODULES", "langchain_google_genai,langchain_core.messages,pypdf").split(",") if m.strip()]
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+KEEPALIVE_TIMEOUT = int(os.getenv("KEEPALIVE_TIMEOUT", "5"))
+# Proxies whose X-Forwarded-For / -Proto headers are trusted
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+ACCESS_LOG = os.getenv("ACCESS_LOG", "false").lower() == "true"
+# A worker dying sooner than this after starting is restarted with a delay (crash loop)
+MIN_WORKER_UPTIME = 5.0
+
+APP = "main:app"
+
+
+def load_app() -> Any:
+    for module in SERVE_PRELOAD_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            print(f"Could not preload {module}: {e}")
+    module_name, _, attr = APP.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def make_config(app: Any) -> uvicorn.Config:
+    return uvicorn.Config(
+        app,
+        host=HOST,
+        port=PORT,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        timeout_keep_alive=KEEPALIVE_TIMEOUT,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+        access_log=ACCESS_LOG,
+    )
+
+
+def run_worker(app: Any, sock) -> None:
+    # Own process group: a terminal Ctrl-C reaches only the supervisor, which
+    # forwards a single SIGTERM (a second signal would make uvicorn skip the drain)
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if not SERVE_PRELOAD:
+        app = load_app()
+    server = uvicorn.Server(make_config(app))
+    server.run(sockets=[sock])
+
+
+def main():
+    app = load_app() if SERVE_PRELOAD else APP
+    config = make_config(app)
+    sock = config.bind_socket()
+    workers: Dict[int, float] = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(app, sock)
+            except BaseException as e:
+                print(f"Worker {os.getpid()} failed: {e}")
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        workers[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        print(f"Shutting down {len(workers)} workers (up to {GRACEFUL_TIMEOUT:g}s for in-flight requests)")
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"Serving {APP} on {HOST}:{PORT} with {WEB_CONCURRENCY} workers (preload={SERVE_PRELOAD})")
+    for _ in range(max(1, WEB_CONCURRENCY)):
+        spawn()
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}; restarting")
+        if time.monotonic() - started < MIN_WORKER_UPTIME:
+            time.sleep(1)
+        if not stopping:
+            spawn()
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
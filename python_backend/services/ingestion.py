@@ -1,126 +1,493 @@
 import os
+import asyncio
+import hashlib
 from fastapi import UploadFile
-from typing import Optional, List
+from typing import Optional, List, Dict, Any, Callable, Awaitable, Tuple, AsyncIterator
 from auth import UserContext
-from utils import process_file, generate_embeddings
-from supabase import Client
+from utils import generate_embeddings
+from admission import BULK
+from chunker import aiter_chunks
+from vector_codec import format_vector
+from telemetry import span, timed
+from extraction import aiter_pages
+from vector_index import get_vector_index, RETRIEVAL_BACKEND
+from answer_cache import get_answer_cache
+from langchain_core.documents import Document
+from supabase import AsyncClient
 from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+
+ProgressCallback = Callable[[Dict[str, int]], Awaitable[None]]
+# (content, content_hash, chunk metadata) waiting to be embedded
+PendingChunk = Tuple[str, str, Dict[str, Any]]
+
+# Pages split together before their chunks enter the pipeline
+INGEST_PAGE_WINDOW = int(os.getenv("INGEST_PAGE_WINDOW", "32"))
+# Chunks per generate_embeddings call (the scheduler fans each call out into provider batches)
+INGEST_EMBED_GROUP = int(os.getenv("INGEST_EMBED_GROUP", "200"))
+# Groups allowed to wait between stages; with the group size this bounds pipeline memory
+INGEST_QUEUE_DEPTH = int(os.getenv("INGEST_QUEUE_DEPTH", "2"))
+# Insert batches are cut by serialized size rather than a fixed row count
+INGEST_INSERT_MAX_BYTES = int(os.getenv("INGEST_INSERT_MAX_BYTES", str(512 * 1024)))
+INGEST_INSERT_MAX_ROWS = int(os.getenv("INGEST_INSERT_MAX_ROWS", "500"))
+JSON_ROW_OVERHEAD = 128
+# Page size when reading a document's existing chunk hashes (PostgREST caps rows per request)
+EXISTING_CHUNKS_PAGE_SIZE = 1000
+# Rows per upsert when refreshing the metadata of unchanged chunks that moved
+METADATA_UPDATE_BATCH_SIZE = 500
+# Columns dropped from chunk inserts on legacy schemas that lack them
+OPTIONAL_CHUNK_COLUMNS = ["company_id", "content_hash", "metadata"]
+
+def is_missing_column_error(e: Exception) -> bool:
+    # Column missing error (42703 or PGRST204) on legacy schemas
+    return '42703' in str(e) or 'PGRST204' in str(e) or "Could not find the" in str(e)
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class ChunkDiff:
+    """
+    The chunks a document already has, keyed by content hash.
+    New chunks claim matching rows as they are split; whatever is left
+    unclaimed at the end is orphaned and gets deleted. A claimed row whose
+    page / offsets / heading changed (text edited earlier in the document)
+    is recorded in `moved` so its metadata can be rewritten without re-embedding.
+    """
+
+    def __init__(
+        self,
+        existing: Optional[Dict[str, List[str]]] = None,
+        unhashed: Optional[List[str]] = None,
+        metadata: Optional[Dict[str, Dict[str, Any]]] = None
+    ):
+        self.existing = existing or {}
+        # Rows written before content_hash existed can't be matched, so they are always replaced
+        self.unhashed = unhashed or []
+        # Stored metadata by row id; None on schemas without the metadata column
+        self.metadata = metadata
+        self.moved: Dict[str, Dict[str, Any]] = {}
+
+    def claim(self, content_hash: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        ids = self.existing.get(content_hash)
+        if not ids:
+            return False
+        row_id = ids.pop()
+        if self.metadata is not None and metadata is not None and self.metadata.get(row_id) != metadata:
+            self.moved[row_id] = metadata
+        return True
+
+    def orphans(self) -> List[str]:
+        return [i for ids in self.existing.values() for i in ids] + self.unhashed
+
+def row_payload_bytes(row: dict) -> int:
+    """Approximate JSON size of a chunk row (the embedding is already a pgvector string)."""
+    return sum(len(str(v)) for v in row.values()) + JSON_ROW_OVERHEAD
+
+class IngestPipeline:
+    """
+    Split -> embed -> insert for one document, as three concurrent stages joined by
+    bounded asyncio queues. Inserting one group overlaps with embedding the next, and
+    at most INGEST_QUEUE_DEPTH groups wait between stages. A failure in any stage
+    cancels the others and is re-raised.
+    """
+
+    def __init__(
+        self,
+        service: "IngestionService",
+        document_id: str,
+        gemini_key: str,
+        user: UserContext,
+        progress: Dict[str, int],
+        report: Callable[..., Awaitable[None]],
+        diff: ChunkDiff
+    ):
+        self.service = service
+        self.document_id = document_id
+        self.gemini_key = gemini_key
+        self.user = user
+        self.progress = progress
+        self.report = report
+        self.diff = diff
+        self.chunk_queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_DEPTH)
+        self.row_queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_DEPTH)
+
+    async def _split_window(self, pages: List[Document], pending: List[PendingChunk]):
+        # Chunking is CPU bound: it runs in a thread, or in the process pool for large texts,
+        # and its batches stream in so a huge single-page text doesn't wait to be fully split
+        batches = aiter_chunks(pages)
+        while True:
+            with span("ingest_split"):
+                chunks = await anext(batches, None)
+            if chunks is None:
+                return
+            await self._queue_chunks(chunks, pending)
+
+    async def _queue_chunks(self, chunks: List[Document], pending: List[PendingChunk]):
+        if not chunks:
+            return
+
+        # Chunks whose content is already stored for this document are kept (not re-embedded)
+        new_count = 0
+        for chunk in chunks:
+            h = chunk_hash(chunk.page_content)
+            if not self.diff.claim(h, chunk.metadata):
+                pending.append((chunk.page_content, h, chunk.metadata))
+                new_count += 1
+        unchanged = len(chunks) - new_count
+        await self.report(
+            chunks_total=self.progress["chunks_total"] + len(chunks),
+            chunks_unchanged=self.progress["chunks_unchanged"] + unchanged,
+            chunks_embedded=self.progress["chunks_embedded"] + unchanged,
+            chunks_stored=self.progress["chunks_stored"] + unchanged
+        )
+        while len(pending) >= INGEST_EMBED_GROUP:
+            await self.chunk_queue.put(pending[:INGEST_EMBED_GROUP])
+            del pending[:INGEST_EMBED_GROUP]
+
+    async def split_stage(self, pages: AsyncIterator[Document]):
+        window: List[Document] = []
+        pending: List[PendingChunk] = []
+        async for page in pages:
+            window.append(page)
+            self.progress["pages_parsed"] += 1
+            if len(window) >= INGEST_PAGE_WINDOW:
+                await self._split_window(window, pending)
+                window = []
+        if window:
+            await self._split_window(window, pending)
+        if pending:
+            await self.chunk_queue.put(pending)
+        await self.chunk_queue.put(None)
+
+    async def embed_stage(self):
+        while True:
+            group = await self.chunk_queue.get()
+            if group is None:
+                await self.row_queue.put(None)
+                return
+
+            # 3. Embed (Using Gemini)
+            embedded_before = self.progress["chunks_embedded"]
+
+            def on_embedded(done: int):
+                self.progress["chunks_embedded"] = embedded_before + done
+
+            with span("ingest_embed"):
+                embeddings = await generate_embeddings(
+                    [text for text, _, _ in group],
+                    self.gemini_key,
+                    on_progress=on_embedded,
+                    tenant=self.user.company_id,
+                    priority=BULK
+                )
+            await self.report(chunks_embedded=embedded_before + len(embeddings))
+
+            await self.row_queue.put([
+                {
+                    "document_id": self.document_id,
+                    "content": text,
+                    "content_hash": h,
+                    "embedding": format_vector(emb),
+                    "company_id": self.user.company_id,
+                    # Source page, start_index / end_index and heading, for citations
+                    "metadata": metadata
+                }
+                for (text, h, metadata), emb in zip(group, embeddings)
+            ])
+
+    async def _flush(self, batch: List[dict]):
+        with span("ingest_insert"):
+            await self.service._insert_chunks(batch)
+        await self.report(
+            chunks_stored=self.progress["chunks_stored"] + len(batch),
+            chunks_added=self.progress["chunks_added"] + len(batch)
+        )
+
+    async def insert_stage(self):
+        # 4. Store Vectors in Supabase, in batches cut by payload size
+        batch: List[dict] = []
+        batch_bytes = 0
+        while True:
+            rows = await self.row_queue.get()
+            if rows is None:
+                break
+            for row in rows:
+                size = row_payload_bytes(row)
+                if batch and (batch_bytes + size > INGEST_INSERT_MAX_BYTES or len(batch) >= INGEST_INSERT_MAX_ROWS):
+                    await self._flush(batch)
+                    batch, batch_bytes = [], 0
+                batch.append(row)
+                batch_bytes += size
+        if batch:
+            await self._flush(batch)
+
+    async def run(self, pages: AsyncIterator[Document]):
+        tasks = [
+            asyncio.create_task(self.split_stage(pages)),
+            asyncio.create_task(self.embed_stage()),
+            asyncio.create_task(self.insert_stage())
+        ]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception():
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
 class IngestionService:
-    def __init__(self, supabase_client: Client):
+    def __init__(self, supabase_client: AsyncClient):
         self.supabase = supabase_client
 
     async def ingest_file(
-        self, 
-        file: UploadFile, 
-        provider_config: dict, 
+        self,
+        file: UploadFile,
+        provider_config: dict,
         user: UserContext,
         document_id: Optional[str] = None
     ):
+        """
+        Synchronous ingest: create/reset the record, then process the whole file in this request.
+        """
+        document_id = await self.prepare_document(file.filename, user, document_id)
+        content = await file.read()
+        return await self.process_document(document_id, file.filename, content, provider_config, user)
+
+    async def prepare_document(
+        self,
+        file_name: str,
+        user: UserContext,
+        document_id: Optional[str] = None,
+        status: str = "pending"
+    ) -> str:
+        """
+        Creates the knowledge_documents record (or resets an existing one) and returns its id.
+        """
         # 1. Create or Get Document Record
         if document_id:
             try:
                 # Check ownership
                 try:
-                    res = self.supabase.table("knowledge_documents").select("id").eq("id", document_id).eq("company_id", user.company_id).execute()
+                    res = await self.supabase.table("knowledge_documents").select("id").eq("id", document_id).eq("company_id", user.company_id).execute()
                 except APIError as e:
                     if '42703' in str(e): # column does not exist
-                        res = self.supabase.table("knowledge_documents").select("id").eq("id", document_id).execute()
+                        res = await self.supabase.table("knowledge_documents").select("id").eq("id", document_id).execute()
                     else:
                         raise e
 
                 if not res.data:
                     raise Exception("Document not found or access denied")
-                
-                self.supabase.table("knowledge_documents").update({
-                    "status": "pending",
+
+                await self.supabase.table("knowledge_documents").update({
+                    "status": status,
                     "metadata": {"uploaded_by": user.user_id, "retry": True}
                 }).eq("id", document_id).execute()
             except APIError as e:
                 raise Exception(f"Database error: {str(e)}")
         else:
             doc_entry = {
-                "name": file.filename,
-                "file_type": file.filename.split('.')[-1] if '.' in file.filename else "txt",
-                "status": "pending",
+                "name": file_name,
+                "file_type": file_name.split('.')[-1] if '.' in file_name else "txt",
+                "status": status,
                 "metadata": {"uploaded_by": user.user_id},
                 "company_id": user.company_id
             }
             try:
-                res = self.supabase.table("knowledge_documents").insert(doc_entry).execute()
+                res = await self.supabase.table("knowledge_documents").insert(doc_entry).execute()
                 if not res.data:
                     raise Exception("Failed to create document record")
                 document_id = res.data[0]['id']
             except APIError as e:
                 if '42703' in str(e): # column does not exist
                      doc_entry.pop("company_id")
-                     res = self.supabase.table("knowledge_documents").insert(doc_entry).execute()
+                     res = await self.supabase.table("knowledge_documents").insert(doc_entry).execute()
                      if not res.data:
                         raise Exception("Failed to create document record (legacy)")
                      document_id = res.data[0]['id']
                 else:
                     raise Exception(f"Database error creating document: {str(e)}")
+        return document_id
 
+    async def update_progress(self, document_id: str, status: str, progress: Dict[str, int]):
+        """
+        Writes status and the progress counters to knowledge_documents.
+        Legacy schemas without the progress column only get the status.
+        """
         try:
-            # 2. Process File
-            content = await file.read()
-            chunks = process_file(content, file.filename)
-            texts = [c.page_content for c in chunks]
-            
-            if not texts:
-                raise Exception("No text extracted")
+            await self.supabase.table("knowledge_documents").update({
+                "status": status,
+                "progress": progress
+            }).eq("id", document_id).execute()
+        except APIError as e:
+            if not is_missing_column_error(e):
+                raise e
+            await self.supabase.table("knowledge_documents").update({
+                "status": status
+            }).eq("id", document_id).execute()
 
-            # 3. Embed (Using Gemini)
+    async def mark_failed(self, document_id: str, error: str):
+        await self.supabase.table("knowledge_documents").update({
+            "status": "error",
+            "metadata": {"error": error}
+        }).eq("id", document_id).execute()
+
+    async def _load_existing_chunks(self, document_id: str) -> ChunkDiff:
+        """
+        Reads the ids, content hashes and metadata of a document's current chunks.
+        On schemas without content_hash every existing row is treated as unhashed (replaced);
+        without metadata, moved chunks are not tracked.
+        """
+        existing: Dict[str, List[str]] = {}
+        unhashed: List[str] = []
+        metadata: Dict[str, Dict[str, Any]] = {}
+        # Narrowed on legacy schemas that lack a column
+        column_sets = ["id, content_hash, metadata", "id, content_hash", "id"]
+        start = 0
+        while True:
+            try:
+                res = await self.supabase.table("document_chunks").select(column_sets[0]).eq("document_id", document_id).order("id").range(start, start + EXISTING_CHUNKS_PAGE_SIZE - 1).execute()
+            except APIError as e:
+                if len(column_sets) == 1 or not is_missing_column_error(e):
+                    raise e
+                column_sets.pop(0)
+                continue
+            rows = res.data or []
+            for row in rows:
+                if row.get("content_hash"):
+                    existing.setdefault(row["content_hash"], []).append(row["id"])
+                    metadata[row["id"]] = row.get("metadata") or {}
+                else:
+                    unhashed.append(row["id"])
+            if len(rows) < EXISTING_CHUNKS_PAGE_SIZE:
+                break
+            start += EXISTING_CHUNKS_PAGE_SIZE
+        return ChunkDiff(existing, unhashed, metadata if "metadata" in column_sets[0] else None)
+
+    async def _update_chunk_metadata(self, document_id: str, company_id: str, moved: Dict[str, Dict[str, Any]]):
+        """Rewrites the metadata of kept chunks by id, as batched upserts."""
+        rows = [
+            {"id": row_id, "document_id": document_id, "company_id": company_id, "metadata": metadata}
+            for row_id, metadata in moved.items()
+        ]
+        with span("ingest_update_metadata"):
+            for i in range(0, len(rows), METADATA_UPDATE_BATCH_SIZE):
+                await self.supabase.table("document_chunks").upsert(
+                    rows[i:i + METADATA_UPDATE_BATCH_SIZE], on_conflict="id", returning=ReturnMethod.minimal
+                ).execute()
+
+    async def _insert_chunks(self, batch: List[dict]):
+        while True:
+            try:
+                await self.supabase.table("document_chunks").insert(batch).execute()
+                return
+            except APIError as e:
+                if not is_missing_column_error(e):
+                    raise e
+                # Retry batch without the column(s) the legacy schema is missing
+                present = [c for c in OPTIONAL_CHUNK_COLUMNS if c in batch[0]]
+                missing = [c for c in present if c in str(e)] or present
+                if not missing:
+                    raise e
+                for item in batch:
+                    for column in missing:
+                        item.pop(column, None)
+
+    async def _delete_chunks(self, ids: List[str]):
+        batch_size = 100
+        with span("ingest_delete"):
+            for i in range(0, len(ids), batch_size):
+                await self.supabase.table("document_chunks").delete().in_("id", ids[i:i + batch_size]).execute()
+
+    @timed("ingest_document")
+    async def process_document(
+        self,
+        document_id: str,
+        file_name: str,
+        content: bytes,
+        provider_config: dict,
+        user: UserContext,
+        progress: Optional[Dict[str, int]] = None,
+        on_progress: Optional[ProgressCallback] = None
+    ):
+        """
+        Extracts, embeds and stores a document that already has a record.
+        Re-ingesting is incremental: chunks are diffed against the stored ones by content
+        hash, only new chunks are embedded and inserted, and orphaned rows are deleted.
+        `progress` is updated live with pages_parsed, chunks_total, chunks_embedded,
+        chunks_stored and the chunks_added / chunks_removed / chunks_unchanged counts;
+        the async `on_progress` hook is awaited after each stage.
+        """
+        if progress is None:
+            progress = {}
+        progress.update({
+            "pages_parsed": 0, "chunks_total": 0, "chunks_embedded": 0, "chunks_stored": 0,
+            "chunks_added": 0, "chunks_removed": 0, "chunks_unchanged": 0
+        })
+
+        async def report(**updates):
+            progress.update(updates)
+            if on_progress:
+                await on_progress(progress)
+
+        try:
             gemini_key = provider_config.get("gemini_api_key") or os.getenv("GEMINI_API_KEY") or os.getenv("VITE_GEMINI_API_KEY")
-            
+
             if not gemini_key:
                 # Fallback to provider_config if key is there (legacy format)
                 gemini_key = provider_config.get("embedding_api_key")
-                
+
             if not gemini_key:
                 raise Exception("Gemini API Key is required. Please set VITE_GEMINI_API_KEY env var.")
 
-            embeddings = await generate_embeddings(texts, gemini_key)
-            
-            # 4. Store Vectors in Supabase
-            vectors_data = []
-            for i, (text, emb) in enumerate(zip(texts, embeddings)):
-                vectors_data.append({
-                    "document_id": document_id,
-                    "content": text,
-                    "embedding": emb,
-                    "company_id": user.company_id
-                })
-            
-            # Insert in batches to avoid payload limit
-            batch_size = 50
-            for i in range(0, len(vectors_data), batch_size):
-                batch = vectors_data[i:i + batch_size]
-                try:
-                    self.supabase.table("document_chunks").insert(batch).execute()
-                except APIError as e:
-                    # Check for column missing error (42703 or PGRST204)
-                    if '42703' in str(e) or 'PGRST204' in str(e) or "Could not find the 'company_id' column" in str(e):
-                         # Retry batch without company_id
-                         for item in batch:
-                             item.pop("company_id")
-                         self.supabase.table("document_chunks").insert(batch).execute()
-                    else:
-                        raise e
+            diff = await self._load_existing_chunks(document_id)
+
+            # 2. Process File
+            # Pages stream through split -> embed -> insert stages joined by bounded queues,
+            # so memory stays bounded and inserts overlap with the next embedding call
+            pipeline = IngestPipeline(self, document_id, gemini_key, user, progress, report, diff)
+            await pipeline.run(aiter_pages(content, file_name))
+
+            if not progress["chunks_total"]:
+                raise Exception("No text extracted")
+
+            # Unchanged chunks that moved get their page / offsets / heading rewritten
+            if diff.moved:
+                await self._update_chunk_metadata(document_id, user.company_id, diff.moved)
+
+            # Orphans go last, so the old version stays searchable until the new one is stored.
+            # If anything above fails they are kept and a retry will match and clean them up.
+            orphans = diff.orphans()
+            await self._delete_chunks(orphans)
+            await report(chunks_removed=len(orphans))
 
             # 5. Update Document Status
-            self.supabase.table("knowledge_documents").update({
+            await self.supabase.table("knowledge_documents").update({
                 "status": "indexed",
-                "chunk_count": len(texts)
+                "chunk_count": progress["chunks_total"]
             }).eq("id", document_id).execute()
-            
-            return {"status": "success", "document_id": document_id, "chunks": len(texts)}
+
+            if RETRIEVAL_BACKEND == "local":
+                try:
+                    await get_vector_index().refresh_document(self.supabase, user.company_id, document_id)
+                except Exception as e:
+                    # The index falls back to a full reload once its TTL expires
+                    print(f"Vector index refresh failed for {document_id}: {e}")
+            # Cached answers may quote chunks that just changed
+            get_answer_cache().invalidate_tenant(user.company_id)
+
+            return {
+                "status": "success",
+                "document_id": document_id,
+                "chunks": progress["chunks_total"],
+                "added": progress["chunks_added"],
+                "removed": progress["chunks_removed"],
+                "unchanged": progress["chunks_unchanged"]
+            }
 
         except Exception as e:
             # Mark as error
             if document_id:
-                self.supabase.table("knowledge_documents").update({
-                    "status": "error",
-                    "metadata": {"error": str(e)}
-                }).eq("id", document_id).execute()
+                await self.mark_failed(document_id, str(e))
             raise e
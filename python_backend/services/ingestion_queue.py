@@ -0,0 +1,332 @@
+import os
+import time
+import asyncio
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List
+from fastapi import UploadFile
+from pydantic import BaseModel, Field
+from supabase import AsyncClient
+from postgrest.exceptions import APIError
+from auth import UserContext, get_service_client
+from services.ingestion import IngestionService, is_missing_column_error
+from ttl_cache import TTLCache
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_QUEUE_MAX_DEPTH = int(os.getenv("INGEST_QUEUE_MAX_DEPTH", "20"))
+# Minimum seconds between progress writes to knowledge_documents
+INGEST_PROGRESS_INTERVAL = float(os.getenv("INGEST_PROGRESS_INTERVAL", "1.0"))
+# "inline" runs jobs on in-process workers, "external" leaves them for ingest_worker.py
+INGEST_MODE = os.getenv("INGEST_MODE", "inline")
+STORAGE_BUCKET = "documents"
+# A queued/processing document whose updated_at is older than this has lost its worker.
+# Live queues touch their documents every third of the lease.
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "300"))
+ACTIVE_STATUSES = ["queued", "processing"]
+# Uploads wait on disk here (default: the system temp dir), not in memory
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR") or None
+SPOOL_CHUNK_BYTES = 1024 * 1024
+INTERRUPTED_ERROR = "Ingestion was interrupted by a restart; upload the document again"
+
+class QueueFullError(Exception):
+    pass
+
+class IngestionJob(BaseModel):
+    job_id: str
+    document_id: str
+    file_name: str
+    company_id: str
+    status: str = "queued" # queued, processing, indexed, error
+    progress: Dict[str, int] = Field(default_factory=dict)
+    chunks: Optional[int] = None
+    error: Optional[str] = None
+    created_at: float = Field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    # External mode: the upload in Storage, so an interrupted job can go back to "queued"
+    storage_path: Optional[str] = None
+
+class Reservation:
+    """A queue slot taken before the document record exists; `release()` is a no-op once submitted."""
+
+    def __init__(self, queue: "IngestionQueue"):
+        self._queue = queue
+        self.active = True
+
+    def release(self):
+        if self.active:
+            self.active = False
+            self._queue._reserved -= 1
+
+class _QueuedWork:
+    def __init__(self, job: IngestionJob, upload_path: str, provider_config: dict, user: UserContext):
+        self.job = job
+        self.upload_path = upload_path
+        self.provider_config = provider_config
+        self.user = user
+
+async def spool_upload(file: UploadFile) -> str:
+    """Copies an upload to a temp file in chunks and returns its path (the job deletes it)."""
+    fd, path = tempfile.mkstemp(prefix="ingest-", dir=INGEST_SPOOL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await file.read(SPOOL_CHUNK_BYTES):
+                await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        discard_upload(path)
+        raise
+    return path
+
+async def spool_bytes(content: bytes) -> str:
+    fd, path = tempfile.mkstemp(prefix="ingest-", dir=INGEST_SPOOL_DIR)
+    with os.fdopen(fd, "wb") as out:
+        await asyncio.to_thread(out.write, content)
+    return path
+
+def discard_upload(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+class IngestionQueue:
+    """
+    Bounded queue of ingestion jobs drained by a fixed number of asyncio workers.
+    Queue depth and worker count cap how much ingest work can compete with /chat.
+    """
+
+    def __init__(self, workers: int = INGEST_WORKERS, max_depth: int = INGEST_QUEUE_MAX_DEPTH):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.jobs: "TTLCache[IngestionJob]" = TTLCache(max_size=5000, ttl=24 * 3600)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._reserved = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_depth)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintain()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._drain()
+        await self._release_unfinished()
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def reserve(self) -> Reservation:
+        """Takes a queue slot for a job about to be submitted. Raises QueueFullError when saturated."""
+        if self.depth() + self._reserved >= self.max_depth:
+            raise QueueFullError(f"Ingestion queue is full ({self.max_depth} jobs waiting)")
+        self._reserved += 1
+        return Reservation(self)
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self.jobs.get(job_id)
+
+    def submit(
+        self,
+        document_id: str,
+        file_name: str,
+        upload_path: str,
+        provider_config: dict,
+        user: UserContext,
+        reservation: Optional[Reservation] = None,
+        storage_path: Optional[str] = None
+    ) -> IngestionJob:
+        """
+        Enqueues a job for a document whose record already exists, with its upload spooled
+        to `upload_path` (deleted when the job ends). Raises QueueFullError when saturated,
+        unless a slot was reserved for it.
+        Jobs run on the service client, not the uploader's (their JWT can expire while the
+        job waits); `run_job` checks the document belongs to `user.company_id` first.
+        """
+        self.start()
+        if reservation is not None:
+            reservation.release()
+        job = IngestionJob(job_id=document_id, document_id=document_id, file_name=file_name,
+                           company_id=user.company_id, storage_path=storage_path)
+        try:
+            self._queue.put_nowait(_QueuedWork(job, upload_path, provider_config, user.model_copy(update={"token": None})))
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Ingestion queue is full ({self.max_depth} jobs waiting)")
+        self.jobs.set(job.job_id, job)
+        return job
+
+    async def run_job(self, work: _QueuedWork):
+        job = work.job
+        service = IngestionService(get_service_client())
+        job.status = "processing"
+        job.started_at = time.time()
+        last_write = 0.0
+
+        async def persist_progress(progress: Dict[str, int]):
+            nonlocal last_write
+            now = time.monotonic()
+            if now - last_write < INGEST_PROGRESS_INTERVAL:
+                return
+            last_write = now
+            try:
+                await service.update_progress(job.document_id, "processing", progress)
+            except Exception as e:
+                print(f"Failed to write ingestion progress for {job.document_id}: {e}")
+
+        try:
+            await check_document_company(service.supabase, job.document_id, job.company_id)
+            await persist_progress(job.progress)
+            content = await asyncio.to_thread(read_upload, work.upload_path)
+            result = await service.process_document(
+                job.document_id,
+                job.file_name,
+                content,
+                work.provider_config,
+                work.user,
+                progress=job.progress,
+                on_progress=persist_progress
+            )
+            job.status = "indexed"
+            job.chunks = result["chunks"]
+            # Final counters (intermediate writes are throttled)
+            await service.update_progress(job.document_id, "indexed", job.progress)
+        except Exception as e:
+            print(f"Ingestion job {job.job_id} failed: {e}")
+            job.status = "error"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            # Release the upload as soon as the job is done
+            discard_upload(work.upload_path)
+            # Indexed or failed for good (a retry uploads the file again): the parked copy is no longer needed.
+            # A job cut short by shutdown keeps it, its document goes back to "queued".
+            if job.storage_path and job.status in ("indexed", "error"):
+                await remove_staged_upload(service.supabase, job.storage_path)
+
+    async def _worker(self, index: int):
+        while True:
+            work = await self._queue.get()
+            try:
+                await self.run_job(work)
+            finally:
+                self._queue.task_done()
+
+    def _drain(self):
+        """Deletes the spooled uploads of jobs that never started."""
+        while self._queue is not None and not self._queue.empty():
+            discard_upload(self._queue.get_nowait().upload_path)
+
+    def _unfinished(self) -> List[IngestionJob]:
+        return [job for _, job in self.jobs.items() if job.status in ACTIVE_STATUSES]
+
+    async def _maintain(self):
+        """Heartbeat for this queue's documents, and recovery of documents other processes abandoned."""
+        while True:
+            client = get_service_client()
+            ids = [job.document_id for job in self._unfinished()]
+            try:
+                for i in range(0, len(ids), 100):
+                    await client.table("knowledge_documents").update({
+                        "updated_at": datetime.now(timezone.utc).isoformat()
+                    }).in_("id", ids[i:i + 100]).execute()
+                await recover_stale_documents(client)
+            except Exception as e:
+                print(f"Ingestion lease maintenance failed: {e}")
+            await asyncio.sleep(INGEST_LEASE_SECONDS / 3)
+
+    async def _release_unfinished(self):
+        """On shutdown: external jobs go back to "queued" for another worker, inline ones (upload lost) fail."""
+        client = get_service_client()
+        for job in self._unfinished():
+            try:
+                query = client.table("knowledge_documents")
+                if job.storage_path:
+                    await query.update({"status": "queued"}).eq("id", job.document_id).execute()
+                else:
+                    await query.update({"status": "error", "metadata": {"error": INTERRUPTED_ERROR}}).eq("id", job.document_id).execute()
+                job.status = "queued" if job.storage_path else "error"
+            except Exception as e:
+                print(f"Failed to release ingestion job {job.job_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for _, job in self.jobs.items():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"workers": self.workers, "max_depth": self.max_depth, "depth": self.depth(),
+                "reserved": self._reserved, "jobs": counts}
+
+async def recover_stale_documents(client: AsyncClient, limit: int = 100) -> int:
+    """
+    Finds queued/processing documents whose worker stopped heartbeating (crash, kill -9)
+    and puts them back in "queued" when the upload is in Storage (external mode), or
+    fails them when it only existed in the dead process. Returns the number recovered.
+    The updates are conditional, so concurrent sweeps and late heartbeats are safe.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=INGEST_LEASE_SECONDS)).isoformat()
+    res = await client.table("knowledge_documents").select("id, status, metadata").in_("status", ACTIVE_STATUSES).lt("updated_at", cutoff).limit(limit).execute()
+    recovered = 0
+    for doc in res.data or []:
+        metadata = doc.get("metadata") or {}
+        if metadata.get("storage_path"):
+            if doc["status"] == "queued":
+                # Still claimable by an ingest worker
+                continue
+            update = {"status": "queued"}
+        else:
+            update = {"status": "error", "metadata": {**metadata, "error": INTERRUPTED_ERROR}}
+        claim = await client.table("knowledge_documents").update(update).eq("id", doc["id"]).eq("status", doc["status"]).lt("updated_at", cutoff).execute()
+        if claim.data:
+            print(f"Recovered stale ingestion of {doc['id']} ({doc['status']} -> {update['status']})")
+            recovered += 1
+    return recovered
+
+_queue: Optional[IngestionQueue] = None
+
+def get_ingestion_queue() -> IngestionQueue:
+    global _queue
+    if _queue is None:
+        _queue = IngestionQueue()
+    return _queue
+
+def read_upload(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+async def check_document_company(client: AsyncClient, document_id: str, company_id: str):
+    """The service client bypasses RLS: only process documents of the job's company."""
+    try:
+        res = await client.table("knowledge_documents").select("id").eq("id", document_id).eq("company_id", company_id).execute()
+    except APIError as e:
+        # Legacy single-tenant schema without company_id
+        if is_missing_column_error(e):
+            return
+        raise e
+    if not res.data:
+        raise Exception("Document not found for this company")
+
+def storage_path_for(document_id: str, file_name: str) -> str:
+    return f"ingest/{document_id}/{file_name}"
+
+async def remove_staged_upload(client: AsyncClient, storage_path: str):
+    try:
+        await client.storage.from_(STORAGE_BUCKET).remove([storage_path])
+    except Exception as e:
+        print(f"Failed to remove staged upload {storage_path}: {e}")
+
+async def stage_for_external_worker(client: AsyncClient, document_id: str, file_name: str, upload_path: str, user: UserContext):
+    """
+    External mode: park the spooled upload in Storage (streamed from disk) and mark
+    the document queued so a separate ingest_worker.py process can claim it.
+    """
+    path = storage_path_for(document_id, file_name)
+    with open(upload_path, "rb") as f:
+        await client.storage.from_(STORAGE_BUCKET).upload(path, f, {"upsert": "true"})
+    await client.table("knowledge_documents").update({
+        "status": "queued",
+        "metadata": {"uploaded_by": user.user_id, "storage_path": path}
+    }).eq("id", document_id).execute()
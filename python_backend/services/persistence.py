@@ -0,0 +1,183 @@
+import os
+import random
+import asyncio
+import contextvars
+from typing import Optional, Dict, Any, List, Tuple
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+from auth import get_service_client
+from services.ingestion import is_missing_column_error
+from telemetry import span
+
+PERSIST_CONVERSATIONS = os.getenv("PERSIST_CONVERSATIONS", "true").lower() == "true"
+# A batch is flushed when it reaches PERSIST_BATCH_SIZE rows or PERSIST_FLUSH_INTERVAL seconds after its first row
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "200"))
+PERSIST_FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL", "0.5"))
+# Rows waiting to be written; beyond this new rows are dropped (and counted) rather than holding memory
+PERSIST_QUEUE_MAX_ROWS = int(os.getenv("PERSIST_QUEUE_MAX_ROWS", "20000"))
+PERSIST_MAX_RETRIES = int(os.getenv("PERSIST_MAX_RETRIES", "5"))
+PERSIST_RETRY_BASE_DELAY = float(os.getenv("PERSIST_RETRY_BASE_DELAY", "0.5"))
+# How long shutdown waits for queued rows to be written
+PERSIST_SHUTDOWN_TIMEOUT = float(os.getenv("PERSIST_SHUTDOWN_TIMEOUT", "10"))
+
+# Parents first so messages never reference a conversation that is not written yet
+TABLE_ORDER = ["conversations", "messages"]
+# Columns dropped from inserts on legacy schemas that lack them
+OPTIONAL_COLUMNS = {"conversations": ["company_id"], "messages": ["metadata"]}
+
+def is_permanent_error(e: Exception) -> bool:
+    # Postgres rejected the rows themselves (bad value, constraint, FK); retrying will not help
+    if not isinstance(e, APIError):
+        return False
+    code = str(e.code or "")
+    return code[:2] in ("22", "23", "42") or code.startswith("PGRST")
+
+class PersistenceWriter:
+    """
+    Write-behind queue for conversation and message rows.
+    /chat enqueues rows (with client-generated ids) and returns; a background task
+    writes them in batches, parents before children, retrying transient failures
+    with exponential backoff. Rows are idempotent upserts on id, so a retry after
+    a write that did land is harmless.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = PERSIST_BATCH_SIZE,
+        flush_interval: float = PERSIST_FLUSH_INTERVAL,
+        max_rows: int = PERSIST_QUEUE_MAX_ROWS
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.counters = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "retries": 0, "batches": 0}
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._missing_columns: Dict[str, set] = {table: set() for table in TABLE_ORDER}
+
+    def start(self):
+        if self._task:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_rows)
+        # Fresh context: the task must not inherit the per-request timing breakdown of whoever enqueued first
+        self._task = asyncio.create_task(self._run(), context=contextvars.Context())
+
+    def enqueue(self, table: str, row: Dict[str, Any]):
+        self.start()
+        try:
+            self._queue.put_nowait((table, row))
+            self.counters["enqueued"] += 1
+        except asyncio.QueueFull:
+            self.counters["dropped"] += 1
+            if self.counters["dropped"] % 1000 == 1:
+                print(f"Persistence queue full ({self.max_rows} rows); dropped {self.counters['dropped']} rows so far")
+
+    async def stop(self, timeout: float = PERSIST_SHUTDOWN_TIMEOUT):
+        """Waits (up to timeout) for queued rows to be written, then stops the writer."""
+        if not self._task:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Persistence writer did not drain within {timeout}s; {self.depth()} rows not written")
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                print(f"Persistence flush failed: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: List[Tuple[str, Dict[str, Any]]]):
+        by_table: Dict[str, List[Dict[str, Any]]] = {}
+        for table, row in batch:
+            by_table.setdefault(table, []).append(row)
+        self.counters["batches"] += 1
+        with span("persist_flush"):
+            for table in sorted(by_table, key=lambda t: TABLE_ORDER.index(t) if t in TABLE_ORDER else len(TABLE_ORDER)):
+                await self._write(table, by_table[table])
+
+    async def _write(self, table: str, rows: List[Dict[str, Any]]):
+        try:
+            await self._insert_with_retry(table, rows)
+            self.counters["written"] += len(rows)
+        except Exception as e:
+            if not is_permanent_error(e) or len(rows) == 1:
+                print(f"Dropping {len(rows)} {table} rows after write failure: {e}")
+                self.counters["failed"] += len(rows)
+                return
+            # One bad row (e.g. an unknown conversation id) should not sink the whole batch
+            for row in rows:
+                await self._write(table, [row])
+
+    async def _insert_with_retry(self, table: str, rows: List[Dict[str, Any]]):
+        attempt = 0
+        while True:
+            missing = self._missing_columns[table]
+            payload = [{k: v for k, v in row.items() if k not in missing} for row in rows] if missing else rows
+            try:
+                await get_service_client().table(table).upsert(
+                    payload, on_conflict="id", ignore_duplicates=True, returning=ReturnMethod.minimal
+                ).execute()
+                return
+            except APIError as e:
+                if is_missing_column_error(e):
+                    # Retry without the column(s) the legacy schema is missing
+                    present = [c for c in OPTIONAL_COLUMNS.get(table, []) if c in rows[0] and c not in missing]
+                    dropped = [c for c in present if c in str(e)] or present
+                    if dropped:
+                        missing.update(dropped)
+                        continue
+                if is_permanent_error(e) or attempt >= PERSIST_MAX_RETRIES:
+                    raise e
+            except Exception as e:
+                if attempt >= PERSIST_MAX_RETRIES:
+                    raise e
+            # Exponential backoff with jitter
+            delay = PERSIST_RETRY_BASE_DELAY * (2 ** attempt)
+            attempt += 1
+            self.counters["retries"] += 1
+            await asyncio.sleep(delay * (0.5 + random.random()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": PERSIST_CONVERSATIONS,
+            "depth": self.depth(),
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "missing_columns": {t: sorted(c) for t, c in self._missing_columns.items() if c},
+            **self.counters
+        }
+
+_writer: Optional[PersistenceWriter] = None
+
+def get_persistence_writer() -> PersistenceWriter:
+    global _writer
+    if _writer is None:
+        _writer = PersistenceWriter()
+    return _writer
@@ -1,70 +1,52 @@
 import os
 import uuid
 import json
-from typing import List, Dict, Any, Optional
-from auth import UserContext
-from supabase import Client
+import time
+import asyncio
+import numpy as np
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, AsyncIterator, Tuple
+from auth import UserContext, get_service_client
+from supabase import AsyncClient
+from postgrest.exceptions import APIError
 from utils import generate_embeddings
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+from vector_codec import format_vector
+from telemetry import span
+from vector_index import get_vector_index, RETRIEVAL_BACKEND
+from answer_cache import get_answer_cache, ANSWER_CACHE_ENABLED
+from model_registry import get_chat_model
+from context_builder import build_context, count_tokens
+from admission import get_admission_controller, INTERACTIVE, BULK
+from services.persistence import get_persistence_writer, PERSIST_CONVERSATIONS
+from services.ingestion import is_missing_column_error
+from ttl_cache import TTLCache
 
-class RAGService:
-    def __init__(self, supabase_client: Client = None):
-        self.supabase = supabase_client
+# "dense" (match_documents only) or "hybrid" (dense + keyword, fused by reciprocal rank)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+# Candidates taken from each retriever before fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Batch chat: concurrent LLM generations / retrievals per batch
+BATCH_CHAT_CONCURRENCY = int(os.getenv("BATCH_CHAT_CONCURRENCY", "8"))
+BATCH_RETRIEVAL_CONCURRENCY = int(os.getenv("BATCH_RETRIEVAL_CONCURRENCY", "16"))
+# Streamed answer chunks buffered between the LLM and a slow client
+STREAM_BUFFER_CHUNKS = int(os.getenv("STREAM_BUFFER_CHUNKS", "256"))
 
-    async def chat(
-        self,
-        messages: List[Dict[str, str]],
-        provider_config: dict,
-        user: UserContext,
-        conversation_id: Optional[str] = None
-    ) -> Dict[str, Any]:
-        
-        gemini_key = provider_config.get("gemini_api_key") or os.getenv("GEMINI_API_KEY") or os.getenv("VITE_GEMINI_API_KEY")
-        if not gemini_key:
-             # Fallback
-             gemini_key = provider_config.get("llm_api_key") or provider_config.get("embedding_api_key")
-        
-        if not gemini_key:
-             raise Exception("Gemini API Key is required. Please set VITE_GEMINI_API_KEY.")
+# How long a conversation stays known to belong to a company before it is re-checked
+CONVERSATION_OWNER_CACHE_TTL = float(os.getenv("CONVERSATION_OWNER_CACHE_TTL", "600"))
 
-        # 1. Embed Last Message
-        last_message = messages[-1]["content"]
-        
-        # Use our utility which handles truncation to 384 dims
-        # Note: generate_embeddings returns a list of lists, we take the first one
-        query_vectors = await generate_embeddings([last_message], gemini_key, task_type="retrieval_query")
-        query_vector = query_vectors[0]
-        
-        # 2. Retrieve Context (Supabase Vector)
-        # Using the match_documents RPC
-        rpc_params = {
-            "query_embedding": query_vector,
-            "match_threshold": 0.5, # Adjust as needed
-            "match_count": 5,
-            "filter_company_id": user.company_id
-        }
-        
-        try:
-            res = self.supabase.rpc("match_documents", rpc_params).execute()
-            matches = res.data
-        except Exception as e:
-            # Fallback for legacy schema (without filter_company_id)
-            print(f"RPC Error with company_id: {e}. Retrying without filter...")
-            rpc_params.pop("filter_company_id")
-            res = self.supabase.rpc("match_documents", rpc_params).execute()
-            matches = res.data
+# Flipped off the first time the keyword RPC turns out not to exist
+_keyword_rpc_available = True
 
-        context_str = "\n\n".join([m["content"] for m in matches]) if matches else "No relevant context found."
-        
-        # 3. Generate Response
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            google_api_key=gemini_key,
-            temperature=0.3
-        )
-        
-        system_prompt = f"""
+# (company_id, conversation_id) pairs already checked or created here; only hits are cached
+_conversation_owners: "TTLCache[bool]" = TTLCache(max_size=10000, ttl=CONVERSATION_OWNER_CACHE_TTL)
+
+if TYPE_CHECKING:
+    # Imported on first prompt build (see _build_prompt); the LLM SDKs are slow to import
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from langchain_core.messages import BaseMessage
+
+SYSTEM_PROMPT_TEMPLATE = """
 You are a helpful and intelligent AI support agent.
 Your goal is to assist users with their questions accurately and efficiently.
 
@@ -88,21 +70,290 @@ Response Schema (JSON):
   "reasoning": "Brief explanation of your decision"
 }}
         """
-        
+
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+def message_text(message: "BaseMessage") -> str:
+    """Returns the text of an LLM message/chunk whether content is a string or a list of parts."""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(
+        part if isinstance(part, str) else part.get("text", "")
+        for part in content
+        if isinstance(part, str) or part.get("type") == "text"
+    )
+
+
+class ContentStreamExtractor:
+    """
+    Incrementally pulls the decoded value of the "content" field out of the
+    streamed JSON answer, so the answer text can be forwarded while the
+    structured fields are still being generated.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.started = False
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        if self.done:
+            return ""
+        if not self.started:
+            marker = self.buffer.find('"content"')
+            if marker == -1:
+                return ""
+            colon = self.buffer.find(":", marker + len('"content"'))
+            if colon == -1:
+                return ""
+            quote = self.buffer.find('"', colon + 1)
+            if quote == -1:
+                return ""
+            self.started = True
+            self.pos = quote + 1
+
+        out = []
+        while self.pos < len(self.buffer):
+            ch = self.buffer[self.pos]
+            if ch == '"':
+                self.done = True
+                break
+            if ch != "\\":
+                out.append(ch)
+                self.pos += 1
+                continue
+            # Escape sequence: wait until it is complete
+            if self.pos + 1 >= len(self.buffer):
+                break
+            esc = self.buffer[self.pos + 1]
+            if esc == "u":
+                if self.pos + 6 > len(self.buffer):
+                    break
+                try:
+                    out.append(chr(int(self.buffer[self.pos + 2:self.pos + 6], 16)))
+                except ValueError:
+                    pass
+                self.pos += 6
+            else:
+                out.append(_JSON_ESCAPES.get(esc, esc))
+                self.pos += 2
+        return "".join(out)
+
+
+def is_missing_function_error(e: Exception) -> bool:
+    # Function missing from the schema cache (PGRST202) or undefined in Postgres (42883)
+    return 'PGRST202' in str(e) or '42883' in str(e)
+
+
+def reciprocal_rank_fusion(rankings: List[List[Dict[str, Any]]], k: int = RRF_K) -> List[Dict[str, Any]]:
+    """
+    Merges ranked result lists: each row scores sum(1 / (k + rank)) over the lists it
+    appears in. Rows are matched by id (content for legacy rows without one).
+    """
+    scores: Dict[str, float] = {}
+    rows: Dict[str, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            key = str(row.get("id") or row.get("content"))
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            # Keep the first copy seen (dense rows carry similarity)
+            rows.setdefault(key, row)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [{**rows[key], "rrf_score": round(scores[key], 6)} for key in ordered]
+
+
+def prompt_tokens_used(message: "BaseMessage") -> Optional[int]:
+    """Gemini's own prompt token count, when the response carries usage metadata."""
+    usage = getattr(message, "usage_metadata", None)
+    return usage.get("input_tokens") if usage else None
+
+
+SENTIMENTS = {"positive", "neutral", "negative"}
+
+def message_row(
+    conversation_id: str,
+    role: str,
+    content: str,
+    created_at: datetime,
+    confidence: Any = None,
+    sentiment: Any = None,
+    rag_sources: Optional[List[str]] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+    **fields: Any
+) -> Dict[str, Any]:
+    """A messages row; model output is coerced to what the columns accept (sentiment enum, decimal confidence)."""
+    try:
+        confidence = min(max(float(confidence), 0.0), 1.0) if confidence is not None else None
+    except (TypeError, ValueError):
+        confidence = None
+    sentiment = str(sentiment).lower() if sentiment is not None else None
+    return {
+        "id": str(uuid.uuid4()),
+        "conversation_id": conversation_id,
+        "role": role,
+        "content": content,
+        "confidence": confidence,
+        "intent": fields.get("intent"),
+        "sentiment": sentiment if sentiment in SENTIMENTS else None,
+        "action": fields.get("action"),
+        "rag_sources": rag_sources or [],
+        "metadata": metadata or {},
+        # Set here so question and answer keep their order however the batch is written
+        "created_at": created_at.isoformat()
+    }
+
+
+class ConversationNotFoundError(Exception):
+    """The conversation does not exist or belongs to another company."""
+
+
+class RAGService:
+    def __init__(self, supabase_client: AsyncClient = None):
+        self.supabase = supabase_client
+
+    def _resolve_gemini_key(self, provider_config: dict) -> str:
+        gemini_key = provider_config.get("gemini_api_key") or os.getenv("GEMINI_API_KEY") or os.getenv("VITE_GEMINI_API_KEY")
+        if not gemini_key:
+             # Fallback
+             gemini_key = provider_config.get("llm_api_key") or provider_config.get("embedding_api_key")
+
+        if not gemini_key:
+             raise Exception("Gemini API Key is required. Please set VITE_GEMINI_API_KEY.")
+        return gemini_key
+
+    async def _dense_search(self, query_vector: np.ndarray, user: UserContext, match_count: int, match_threshold: float) -> List[Dict[str, Any]]:
+        if RETRIEVAL_BACKEND == "local" and self.supabase:
+            with span("vector_search_local"):
+                matches = await get_vector_index().search(self.supabase, user.company_id, query_vector, match_count, match_threshold)
+            if matches is not None:
+                return matches
+
+        # Using the match_documents RPC
+        rpc_params = {
+            "query_embedding": format_vector(query_vector),
+            "match_threshold": match_threshold, # Adjust as needed
+            "match_count": match_count,
+            "filter_company_id": user.company_id
+        }
+
+        try:
+            with span("vector_search"):
+                res = await self.supabase.rpc("match_documents", rpc_params).execute()
+            matches = res.data
+        except Exception as e:
+            # Fallback for legacy schema (without filter_company_id)
+            print(f"RPC Error with company_id: {e}. Retrying without filter...")
+            rpc_params.pop("filter_company_id")
+            with span("vector_search"):
+                res = await self.supabase.rpc("match_documents", rpc_params).execute()
+            matches = res.data
+        return matches or []
+
+    async def _keyword_search(self, query_text: str, user: UserContext, match_count: int) -> List[Dict[str, Any]]:
+        global _keyword_rpc_available
+        if RETRIEVAL_BACKEND == "local":
+            with span("keyword_search_local"):
+                matches = await get_vector_index().keyword_search(user.company_id, query_text, match_count)
+            if matches is not None:
+                return matches
+        if not _keyword_rpc_available:
+            return []
+
+        try:
+            with span("keyword_search"):
+                res = await self.supabase.rpc("match_documents_keyword", {
+                    "query_text": query_text,
+                    "match_count": match_count,
+                    "filter_company_id": user.company_id
+                }).execute()
+            return res.data or []
+        except Exception as e:
+            # Schema without the full-text migration: stay dense-only
+            if is_missing_function_error(e):
+                _keyword_rpc_available = False
+            print(f"Keyword search failed, using dense results only: {e}")
+            return []
+
+    async def _retrieve(
+        self,
+        query_vector: np.ndarray,
+        query_text: str,
+        user: UserContext,
+        match_count: int = 5,
+        match_threshold: float = 0.5
+    ) -> List[Dict[str, Any]]:
+        if RETRIEVAL_MODE != "hybrid":
+            return await self._dense_search(query_vector, user, match_count, match_threshold)
+
+        # Hybrid: dense and keyword candidates side by side, fused by rank
+        dense, keyword = await asyncio.gather(
+            self._dense_search(query_vector, user, HYBRID_CANDIDATES, match_threshold),
+            self._keyword_search(query_text, user, HYBRID_CANDIDATES)
+        )
+        return reciprocal_rank_fusion([dense, keyword])[:match_count]
+
+    async def _retrieve_context(
+        self,
+        messages: List[Dict[str, str]],
+        gemini_key: str,
+        user: UserContext
+    ) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+        # 1. Embed Last Message
+        last_message = messages[-1]["content"]
+
+        # Use our utility which handles truncation to 384 dims
+        # Note: generate_embeddings returns a list of vectors, we take the first one
+        query_vectors = await generate_embeddings([last_message], gemini_key, task_type="retrieval_query", tenant=user.company_id)
+        query_vector = query_vectors[0]
+
+        # 2. Retrieve Context (local index for hot tenants, else Supabase Vector)
+        matches = await self._retrieve(query_vector, last_message, user)
+        return query_vector, matches
+
+    def _build_prompt(
+        self,
+        messages: List[Dict[str, str]],
+        matches: List[Dict[str, Any]],
+        gemini_key: str
+    ) -> Tuple["ChatGoogleGenerativeAI", List["BaseMessage"], Dict[str, Any]]:
+        from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+
+        # Pack deduplicated chunks and recent history into their token budgets
+        context = build_context(matches, messages)
+        chunks = context["chunks"]
+        context_str = "\n\n".join([m["content"] for m in chunks]) if chunks else "No relevant context found."
+
+        # 3. Build Prompt
+        # Shared across requests by the model registry
+        llm = get_chat_model("gemini-2.5-flash", gemini_key, temperature=0.3)
+
+        system_prompt = SYSTEM_PROMPT_TEMPLATE.format(context_str=context_str)
         chat_messages = [SystemMessage(content=system_prompt)]
-        
-        # Add conversation history (last 5 messages)
+
+        # Add conversation history (newest messages that fit the history budget)
         # messages list is [{"role": "user", "content": "..."}, ...]
-        for msg in messages[-5:]:
+        for msg in context["history"]:
             if msg["role"] == "user":
                 chat_messages.append(HumanMessage(content=msg["content"]))
             elif msg["role"] == "assistant":
                 chat_messages.append(AIMessage(content=msg["content"]))
-            # Handle 'system' if present, though usually not in this list
-        
-        response = await llm.ainvoke(chat_messages)
-        response_text = response.content
-        
+
+        usage = {
+            "prompt_tokens": None,
+            "estimated_prompt_tokens": count_tokens(system_prompt) + context["history_tokens"],
+            "context_tokens": context["context_tokens"],
+            "history_tokens": context["history_tokens"],
+            "context_chunks": len(chunks),
+            "dropped_chunks": context["dropped_chunks"],
+            "history_messages": len(context["history"])
+        }
+        return llm, chat_messages, usage
+
+    def _parse_response(self, response_text: str) -> Dict[str, Any]:
         # Clean up JSON if needed (sometimes LLMs add markdown)
         if "```json" in response_text:
             response_text = response_text.split("```json")[1].split("```")[0].strip()
@@ -110,10 +361,10 @@ Response Schema (JSON):
             response_text = response_text.split("```")[1].strip()
 
         try:
-            parsed_response = json.loads(response_text)
+            return json.loads(response_text)
         except json.JSONDecodeError:
             # Fallback if JSON fails
-            parsed_response = {
+            return {
                 "content": response_text,
                 "intent": "general_query",
                 "confidence": 1.0,
@@ -121,31 +372,315 @@ Response Schema (JSON):
                 "action": "resolve",
                 "reasoning": "Failed to parse JSON response"
             }
-        
-        # 4. Persist Conversation
-        new_conversation_id = conversation_id
-        if self.supabase:
+
+    async def check_conversation(self, user: UserContext, conversation_id: Optional[str]):
+        """
+        Messages are written with the service client, which bypasses RLS: never append
+        to a conversation of another company. An id with no row yet is allowed: the
+        write-behind queue may not have flushed it (possibly on another worker), or
+        dropped it; _record_exchange then (re)creates it for the caller.
+        """
+        if not conversation_id or not PERSIST_CONVERSATIONS:
+            return
+        key = (user.company_id, conversation_id)
+        if key in _conversation_owners:
+            return
+        try:
+            uuid.UUID(conversation_id)
+        except ValueError:
+            raise ConversationNotFoundError("Conversation not found")
+        try:
+            res = await get_service_client().table("conversations").select(
+                "id, company_id, metadata"
+            ).eq("id", conversation_id).limit(1).execute()
+        except APIError as e:
+            # Legacy single-tenant schema without company_id
+            if is_missing_column_error(e):
+                return
+            raise e
+        if not res.data:
+            return
+        row = res.data[0]
+        owned = (
+            row.get("company_id") == user.company_id
+            # Rows from before company_id was added carry only the creating user
+            or (row.get("company_id") is None and (row.get("metadata") or {}).get("user_id") == user.user_id)
+        )
+        if not owned:
+            raise ConversationNotFoundError("Conversation not found")
+        _conversation_owners.set(key, True)
+
+    def _record_exchange(
+        self,
+        user: UserContext,
+        conversation_id: Optional[str],
+        messages: List[Dict[str, str]],
+        response: Dict[str, Any],
+        matches: List[Dict[str, Any]],
+        metadata: Dict[str, Any],
+        asked_at: datetime
+    ) -> Optional[str]:
+        """
+        Queues the conversation (when new), the user's question and the agent's answer
+        for the background writer. Ids are generated here, so nothing waits on the DB.
+        """
+        if not PERSIST_CONVERSATIONS:
+            return conversation_id
+
+        writer = get_persistence_writer()
+        conversation_id = conversation_id or str(uuid.uuid4())
+        # New, or not stored (yet): the row is an upsert that ignores duplicates, so an
+        # existing or still queued conversation is left as it is
+        if (user.company_id, conversation_id) not in _conversation_owners:
+            _conversation_owners.set((user.company_id, conversation_id), True)
+            writer.enqueue("conversations", {
+                "id": conversation_id,
+                "session_id": str(uuid.uuid4()),
+                "status": "active",
+                "metadata": {"user_id": user.user_id},
+                "company_id": user.company_id
+            })
+
+        question = messages[-1] if messages else {}
+        if question.get("content"):
+            writer.enqueue("messages", message_row(conversation_id, "user", question["content"], asked_at))
+
+        sources = list(dict.fromkeys(str(m["document_id"]) for m in matches if m.get("document_id")))
+        writer.enqueue("messages", message_row(
+            conversation_id,
+            "agent",
+            str(response.get("content") or ""),
+            datetime.now(timezone.utc),
+            confidence=response.get("confidence"),
+            intent=response.get("intent"),
+            sentiment=response.get("sentiment"),
+            action=response.get("action"),
+            rag_sources=sources,
+            metadata=metadata
+        ))
+        return conversation_id
+
+    async def _answer(
+        self,
+        messages: List[Dict[str, str]],
+        query_vector: np.ndarray,
+        matches: List[Dict[str, Any]],
+        gemini_key: str,
+        user: UserContext,
+        priority: str = INTERACTIVE
+    ) -> Tuple[Dict[str, Any], bool, Dict[str, Any]]:
+        """
+        Generates (or reuses a cached) structured answer. Returns (response, cached, usage).
+        Generation waits for an admission slot at `priority` (may raise OverloadedError).
+        """
+        # Repeated question over the same context: skip generation
+        cached = get_answer_cache().get(user.company_id, query_vector, messages, matches) if ANSWER_CACHE_ENABLED else None
+        if cached is not None:
+            return dict(cached), True, {"prompt_tokens": 0}
+
+        llm, chat_messages, usage = self._build_prompt(messages, matches, gemini_key)
+        generation_start = time.perf_counter()
+        async with get_admission_controller().slot(user.company_id, priority):
+            with span("llm"):
+                response = await llm.ainvoke(chat_messages)
+        usage["prompt_tokens"] = prompt_tokens_used(response) or usage["estimated_prompt_tokens"]
+        parsed_response = self._parse_response(message_text(response))
+        if ANSWER_CACHE_ENABLED:
+            get_answer_cache().set(user.company_id, query_vector, messages, matches, parsed_response, (time.perf_counter() - generation_start) * 1000)
+        return parsed_response, False, usage
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        provider_config: dict,
+        user: UserContext,
+        conversation_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        start = time.perf_counter()
+        asked_at = datetime.now(timezone.utc)
+        await self.check_conversation(user, conversation_id)
+        gemini_key = self._resolve_gemini_key(provider_config)
+        query_vector, matches = await self._retrieve_context(messages, gemini_key, user)
+
+        generation_start = time.perf_counter()
+        parsed_response, cached, usage = await self._answer(messages, query_vector, matches, gemini_key, user)
+        end = time.perf_counter()
+
+        # 4. Persist Conversation (write-behind)
+        new_conversation_id = self._record_exchange(user, conversation_id, messages, parsed_response, matches, {
+            "cached": cached,
+            "usage": usage,
+            "timings": {
+                "retrieval_ms": round((generation_start - start) * 1000, 1),
+                "total_ms": round((end - start) * 1000, 1)
+            }
+        }, asked_at)
+
+        return {
+            "response": parsed_response,
+            "conversation_id": new_conversation_id,
+            "cached": cached,
+            "usage": usage
+        }
+
+    async def chat_batch(
+        self,
+        conversations: List[Dict[str, Any]],
+        provider_config: dict,
+        user: UserContext,
+        concurrency: int = BATCH_CHAT_CONCURRENCY
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Runs many conversations ({"id"?, "messages"}) through the chat pipeline and yields
+        one result per item as it completes, tagged with its index and id. All questions are
+        embedded in one batched call; retrieval and generation fan out under separate limits.
+        A failing item yields {"error": ...} without stopping the batch. Nothing is persisted.
+        """
+        gemini_key = self._resolve_gemini_key(provider_config)
+        results: asyncio.Queue = asyncio.Queue()
+
+        valid = []
+        for i, conversation in enumerate(conversations):
+            messages = conversation.get("messages")
+            if not messages:
+                error = "Conversation has no messages"
+            elif not isinstance(messages[-1].get("content"), str) or not messages[-1]["content"].strip():
+                error = "Last message has no content"
+            else:
+                valid.append(i)
+                continue
+            results.put_nowait({"index": i, "id": conversation.get("id"), "error": error})
+
+        questions = [conversations[i]["messages"][-1]["content"] for i in valid]
+        query_vectors = dict(zip(valid, await generate_embeddings(questions, gemini_key, task_type="retrieval_query", tenant=user.company_id, priority=BULK)))
+
+        retrieval_slots = asyncio.Semaphore(BATCH_RETRIEVAL_CONCURRENCY)
+        generation_slots = asyncio.Semaphore(max(1, concurrency))
+
+        async def run_item(index: int):
+            conversation = conversations[index]
+            messages = conversation["messages"]
+            item: Dict[str, Any] = {"index": index, "id": conversation.get("id")}
             try:
-                if not new_conversation_id:
-                    session_id = str(uuid.uuid4())
-                    conv_data = {
-                        "session_id": session_id,
-                        "status": "active",
-                        "metadata": {"user_id": user.user_id},
-                        "company_id": user.company_id
-                    }
-                    res = self.supabase.table("conversations").insert(conv_data).execute()
-                    if res.data:
-                        new_conversation_id = res.data[0]['id']
-                
-                # Store the message
-                # Assuming a messages table exists? Or maybe we just return the response
-                # The original code didn't show message storage logic fully, just conversation creation.
-                # I'll stick to returning the response.
+                async with retrieval_slots:
+                    matches = await self._retrieve(query_vectors[index], messages[-1]["content"], user)
+                async with generation_slots:
+                    parsed_response, cached, usage = await self._answer(messages, query_vectors[index], matches, gemini_key, user, BULK)
+                item.update({"response": parsed_response, "cached": cached, "usage": usage})
             except Exception as e:
-                print(f"Error persisting conversation: {e}")
-                
-        return {
+                print(f"Batch chat item {index} failed: {e}")
+                item["error"] = str(e)
+            await results.put(item)
+
+        tasks = [asyncio.create_task(run_item(i)) for i in valid]
+        try:
+            for _ in range(len(conversations)):
+                yield await results.get()
+        finally:
+            # Client went away: stop the remaining items
+            for task in tasks:
+                task.cancel()
+
+    async def _stream_answer(
+        self,
+        llm: "ChatGoogleGenerativeAI",
+        chat_messages: List["BaseMessage"],
+        user: UserContext,
+        usage: Dict[str, Any],
+        extractor: ContentStreamExtractor,
+        buffer: asyncio.Queue
+    ):
+        """
+        Streams the answer inside an admission slot, putting answer text on `buffer`,
+        then None when done (or the exception that ended the stream).
+        """
+        try:
+            async with get_admission_controller().slot(user.company_id):
+                with span("llm_stream"):
+                    async for chunk in llm.astream(chat_messages):
+                        usage["prompt_tokens"] = prompt_tokens_used(chunk) or usage["prompt_tokens"]
+                        text = extractor.feed(message_text(chunk))
+                        if text:
+                            await buffer.put(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await buffer.put(e)
+            return
+        await buffer.put(None)
+
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        provider_config: dict,
+        user: UserContext,
+        conversation_id: Optional[str] = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Same pipeline as chat(), but yields ("token", {"content": ...}) events as the
+        answer text streams from the LLM, then a final ("done", {...}) event carrying the
+        structured response, conversation_id, cache flag, token usage and timings.
+        """
+        start = time.perf_counter()
+        asked_at = datetime.now(timezone.utc)
+        await self.check_conversation(user, conversation_id)
+        gemini_key = self._resolve_gemini_key(provider_config)
+        query_vector, matches = await self._retrieve_context(messages, gemini_key, user)
+
+        generation_start = time.perf_counter()
+        cached = get_answer_cache().get(user.company_id, query_vector, messages, matches) if ANSWER_CACHE_ENABLED else None
+        usage = {"prompt_tokens": 0}
+        if cached is not None:
+            parsed_response = dict(cached)
+            first_token_at = time.perf_counter()
+            yield "token", {"content": parsed_response.get("content", "")}
+        else:
+            llm, chat_messages, usage = self._build_prompt(messages, matches, gemini_key)
+            first_token_at = None
+            extractor = ContentStreamExtractor()
+            # The slot is held by the producer only; a slow client does not keep it busy
+            buffer: asyncio.Queue = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+            producer = asyncio.create_task(self._stream_answer(llm, chat_messages, user, usage, extractor, buffer))
+            try:
+                while True:
+                    item = await buffer.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    yield "token", {"content": item}
+            finally:
+                if not producer.done():
+                    producer.cancel()
+
+            parsed_response = self._parse_response(extractor.buffer)
+            if not extractor.started:
+                # Model did not answer in JSON - send the whole text as one token
+                first_token_at = time.perf_counter()
+                yield "token", {"content": parsed_response.get("content", "")}
+            usage["prompt_tokens"] = usage["prompt_tokens"] or usage["estimated_prompt_tokens"]
+            if ANSWER_CACHE_ENABLED:
+                get_answer_cache().set(user.company_id, query_vector, messages, matches, parsed_response, (time.perf_counter() - generation_start) * 1000)
+
+        end = time.perf_counter()
+        timings = {
+            "retrieval_ms": round((generation_start - start) * 1000, 1),
+            "first_token_ms": round((first_token_at - start) * 1000, 1) if first_token_at else None,
+            "total_ms": round((end - start) * 1000, 1)
+        }
+        new_conversation_id = self._record_exchange(user, conversation_id, messages, parsed_response, matches, {
+            "cached": cached is not None,
+            "usage": usage,
+            "timings": timings,
+            "streamed": True
+        }, asked_at)
+
+        yield "done", {
             "response": parsed_response,
-            "conversation_id": new_conversation_id
+            "conversation_id": new_conversation_id,
+            "cached": cached is not None,
+            "usage": usage,
+            "timings": timings
         }
@@ -0,0 +1,200 @@
+"""
+Per-stage latency instrumentation for the chat and ingestion pipelines.
+
+`span(stage)` times a block of work. The duration is recorded in three places:
+- the stage_duration_seconds Prometheus histogram served on /metrics;
+- the current request's breakdown, which is returned as a Server-Timing
+  header when the request sends "X-Debug-Timings: 1";
+- an OpenTelemetry span, when OTEL_TRACES_ENABLED=true and opentelemetry is
+  installed. Spans are exported by whatever SDK and exporter the deployment
+  configures; with the API package alone they are no-ops.
+
+Histograms are kept in-process and rendered in the Prometheus text format by
+hand (no client library), so each worker process exposes its own series.
+"""
+import os
+import time
+import inspect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# When set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+OTEL_TRACES_ENABLED = os.getenv("OTEL_TRACES_ENABLED", "false").lower() == "true"
+DEBUG_TIMINGS_HEADER = b"x-debug-timings"
+
+# Seconds; covers cache hits (sub-ms) through slow generations and ingest batches
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    """Cumulative Prometheus histogram with a fixed label set."""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str], buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # labels -> (per-bucket counts, sum, count)
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = label_text + "," if label_text else ""
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Time spent per pipeline stage.", ("stage",))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency (until the response body is sent).", ("method", "route", "status"))
+
+# stage -> [total ms, calls] for the request being handled
+_breakdown: contextvars.ContextVar[Optional[Dict[str, List[float]]]] = contextvars.ContextVar("stage_breakdown", default=None)
+
+_tracer = None
+if OTEL_TRACES_ENABLED:
+    try:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer("customer-support-backend")
+    except ImportError:
+        print("OTEL_TRACES_ENABLED is set but opentelemetry is not installed; tracing disabled")
+
+
+def observe_stage(stage: str, seconds: float):
+    if METRICS_ENABLED:
+        STAGE_SECONDS.observe((stage,), seconds)
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        entry = breakdown.setdefault(stage, [0.0, 0])
+        entry[0] += seconds * 1000
+        entry[1] += 1
+
+
+@contextmanager
+def span(stage: str, **attributes: Any) -> Iterator[None]:
+    """
+    Times the enclosed block as `stage`. Works around awaits (and yields) in async code.
+    OTel spans are started without being made current, so they are safe across yields.
+    """
+    otel_span = _tracer.start_span(stage, attributes=attributes or None) if _tracer else None
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        if otel_span is not None:
+            otel_span.record_exception(e)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+        if otel_span is not None:
+            otel_span.end()
+
+
+def timed(stage: str) -> Callable:
+    """Decorator form of span() for sync and async functions (keeps the signature for FastAPI)."""
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(breakdown: Dict[str, List[float]]) -> str:
+    """Server-Timing header value, e.g. 'auth;dur=1.2, embed;dur=84.0, llm;dur=910.3;desc="2 calls"'."""
+    parts = []
+    for stage, (ms, calls) in breakdown.items():
+        part = f"{stage};dur={ms:.1f}"
+        if calls > 1:
+            part += f';desc="{calls} calls"'
+        parts.append(part)
+    return ", ".join(parts)
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for histogram in (REQUEST_SECONDS, STAGE_SECONDS):
+        lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware: records request latency per route template and collects the
+    per-stage breakdown. Requests sending "X-Debug-Timings: 1" get it back as
+    Server-Timing; streamed responses only include the stages that ran before the
+    first byte (the headers go out then).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        breakdown: Dict[str, List[float]] = {}
+        token = _breakdown.set(breakdown)
+        debug = dict(scope.get("headers") or []).get(DEBUG_TIMINGS_HEADER) in (b"1", b"true")
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if debug:
+                    total = ("total", [(time.perf_counter() - start) * 1000, 1])
+                    value = server_timing(dict([*breakdown.items(), total]))
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", value.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _breakdown.reset(token)
+            if METRICS_ENABLED:
+                route = scope.get("route")
+                # Route templates keep label cardinality bounded (no raw ids in paths)
+                path = getattr(route, "path", None) or "unmatched"
+                REQUEST_SECONDS.observe((scope.get("method", ""), path, str(status)), time.perf_counter() - start)
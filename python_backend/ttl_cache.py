@@ -0,0 +1,63 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """
+    Bounded in-process cache with per-entry expiry and LRU eviction.
+    Not shared between worker processes; TTLs bound how stale any worker can be.
+    """
+
+    def __init__(self, max_size: int, ttl: float, on_evict: Optional[Callable[[Hashable, V], None]] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: Hashable) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self.pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None):
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            old_key, (_, old_value) = self._entries.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(old_key, old_value)
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        if self.on_evict:
+            self.on_evict(key, entry[1])
+        return entry[1]
+
+    def items(self):
+        now = time.monotonic()
+        return [(k, v) for k, (expires_at, v) in self._entries.items() if expires_at > now]
+
+    def evict_expired(self):
+        now = time.monotonic()
+        for key in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+            self.pop(key)
+
+    def clear(self):
+        for key in list(self._entries):
+            self.pop(key)
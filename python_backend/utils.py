@@ -1,137 +1,187 @@
 import os
-import tempfile
 import asyncio
-from typing import List, Optional
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import httpx
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
 from langchain_core.documents import Document
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from supabase import create_client, Client, ClientOptions
+from model_registry import get_embeddings_model
+from supabase import AsyncClient, AsyncClientOptions
+from embedding_scheduler import EmbeddingScheduler, get_rate_limiter
+from embedding_cache import get_embedding_cache, make_cache_key
+from extraction import is_pdf, iter_pdf_pages, decode_text_file
+from vector_codec import to_vector
+from chunker import chunk_documents
+from telemetry import timed, span
+from admission import get_admission_controller, get_embedding_flights, INTERACTIVE
 
-def get_supabase_client(url: str, key: str, access_token: Optional[str] = None) -> Client:
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "50"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "20"))
+SUPABASE_HTTP_TIMEOUT = float(os.getenv("SUPABASE_HTTP_TIMEOUT", "120"))
+
+# One pool per event loop, keyed by id(loop). The loop is kept with its pool: ids are
+# reused once a loop is gone, so a pool is only handed out to the loop it was made on.
+_http_clients: Dict[int, Tuple[Optional[asyncio.AbstractEventLoop], httpx.AsyncClient]] = {}
+
+def _prune_http_clients():
+    """Drops pools that were closed or whose loop has closed (their connections went with it)."""
+    for loop_id, (loop, client) in list(_http_clients.items()):
+        if client.is_closed or (loop is not None and loop.is_closed()):
+            del _http_clients[loop_id]
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Process-wide pooled async HTTP transport shared by every Supabase client.
+    Keeps connections alive (HTTP/2 when h2 is installed) with a bounded pool,
+    so per-request clients skip the TLS handshake and SSL context setup.
+    Connections are bound to an event loop, so there is one pool per running loop.
+    """
+    try:
+        loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    entry = _http_clients.get(id(loop))
+    if entry is not None and entry[0] is loop and not entry[1].is_closed:
+        return entry[1]
+
+    _prune_http_clients()
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+    client = httpx.AsyncClient(
+        http2=http2,
+        timeout=SUPABASE_HTTP_TIMEOUT,
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_MAX_KEEPALIVE
+        )
+    )
+    _http_clients[id(loop)] = (loop, client)
+    return client
+
+async def close_http_client():
+    """Closes the running loop's pool (call before the loop shuts down)."""
+    loop = asyncio.get_running_loop()
+    entry = _http_clients.get(id(loop))
+    if entry is not None and entry[0] is loop:
+        del _http_clients[id(loop)]
+        await entry[1].aclose()
+
+def get_supabase_client(url: str, key: str, access_token: Optional[str] = None) -> AsyncClient:
+    """
+    Builds an async Supabase client on the shared HTTP transport.
+    Only the headers differ between clients (per-user Authorization), so this is cheap per request.
+    All queries must be awaited: `await client.table(...).select(...).execute()`.
+    """
     headers = {}
     if access_token:
         headers["Authorization"] = f"Bearer {access_token}"
     
-    return create_client(url, key, options=ClientOptions(headers=headers))
+    return AsyncClient(url, key, options=AsyncClientOptions(headers=headers, httpx_client=get_http_client()))
 
+def split_documents(docs: List[Document]) -> List[Document]:
+    """Token-sized, structure-aware chunks with source offsets (see chunker)."""
+    return chunk_documents(docs)
+
+@timed("process_file")
 def process_file(file_content: bytes, file_name: str) -> List[Document]:
     """
     Extracts text from a file (PDF or Text) and splits it into chunks.
+    PDFs are read from memory; see extraction.aiter_pages for the streaming, page-parallel path.
     """
-    file_ext = os.path.splitext(file_name)[1].lower()
-    
-    if file_ext == '.pdf':
-        # Create a temp file because PyPDFLoader expects a file path
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(file_content)
-            tmp_path = tmp_file.name
-        
+    if is_pdf(file_name):
         try:
-            loader = PyPDFLoader(tmp_path)
-            docs = loader.load()
+            docs = list(iter_pdf_pages(file_content, file_name))
             print(f"Extracted {len(docs)} pages from PDF")
         except Exception as e:
             print(f"Error loading PDF: {e}")
             docs = []
-        finally:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
-            
     else:
-        # Assume text-based
-        try:
-            text = file_content.decode('utf-8', errors='ignore')
-            # Check if text is empty or whitespace
-            if not text.strip():
-                print("Warning: Extracted text is empty")
-                docs = []
-            else:
-                print(f"Extracted text length: {len(text)} chars")
-                docs = [Document(page_content=text, metadata={"source": file_name})]
-        except Exception as e:
-            print(f"Error decoding text file: {e}")
-            docs = []
+        docs = decode_text_file(file_content, file_name)
 
     if not docs:
         print("No documents created from file content")
         return []
 
     # Split text
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
-    
-    split_docs = text_splitter.split_documents(docs)
+    split_docs = split_documents(docs)
     print(f"Split documents into {len(split_docs)} chunks")
     return split_docs
 
-async def generate_embeddings(texts: List[str], api_key: str, task_type: str = "retrieval_document") -> List[List[float]]:
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+EMBEDDING_DIMS = 384
+
+@timed("embed")
+async def generate_embeddings(
+    texts: List[str],
+    api_key: str,
+    task_type: str = "retrieval_document",
+    on_progress: Optional[Callable[[int], None]] = None,
+    tenant: Optional[str] = None,
+    priority: str = INTERACTIVE
+) -> List[np.ndarray]:
     """
-    Generates embeddings for the given texts using Gemini.
+    Generates embeddings for the given texts using Gemini, as float32 arrays.
+    Cached vectors are served from the EmbeddingCache; only misses go to the provider,
+    in concurrent batches through the per-key rate limited EmbeddingScheduler.
+    Each provider batch takes an admission slot for `tenant` at `priority` (may raise
+    OverloadedError), and texts a concurrent call for the same tenant is already embedding
+    are awaited instead of embedded again.
     Handles dimension mismatch by padding/truncating to 384 dims.
+    `on_progress` receives the running count of texts embedded (cache hits count immediately,
+    repeated texts once).
     """
-    
-    async def embed_batch_with_retry(model, batch_texts):
-        max_retries = 5
-        base_delay = 2 # seconds
-        
-        for attempt in range(max_retries):
-            try:
-                # Add a small delay between requests to be polite
-                if attempt == 0:
-                    await asyncio.sleep(0.5)
-                
+    cache = get_embedding_cache()
+    keys = [make_cache_key(EMBEDDING_MODEL, task_type, EMBEDDING_DIMS, t) for t in texts]
+    cached = await cache.get_many(list(dict.fromkeys(keys)))
+
+    # Embed each distinct missing text once
+    missing: Dict[str, str] = {}
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in missing:
+            missing[key] = text
+
+    cached_count = len(texts) - sum(1 for key in keys if key not in cached)
+    if on_progress and cached_count:
+        on_progress(cached_count)
+
+    # Texts a concurrent call for the same tenant is already embedding
+    # (scoped per tenant so one company's shed or failed call never fails another's)
+    flights = get_embedding_flights()
+    joined = {key: flight for key in missing if (flight := flights.get(f"{tenant}:{key}")) is not None}
+    own = {key: text for key, text in missing.items() if key not in joined}
+
+    if own:
+        embeddings_model = get_embeddings_model(EMBEDDING_MODEL, api_key, task_type)
+        admission = get_admission_controller()
+
+        async def embed_batch(batch_texts: List[str]) -> List[List[float]]:
+            async with admission.slot(tenant, priority):
                 # Use run_in_executor for synchronous embed_documents call to avoid blocking
-                loop = asyncio.get_event_loop()
-                embeddings = await loop.run_in_executor(None, model.embed_documents, batch_texts)
-                return embeddings
-            except Exception as e:
-                error_str = str(e)
-                # Check for rate limit errors (429 or RESOURCE_EXHAUSTED)
-                if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                    if attempt < max_retries - 1:
-                        wait_time = base_delay * (2 ** attempt) # Exponential backoff
-                        print(f"Rate limit hit. Retrying in {wait_time}s... (Attempt {attempt + 1}/{max_retries})")
-                        await asyncio.sleep(wait_time)
-                        continue
-                
-                if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                    print("Rate limit exhausted. Aborting.")
-                    raise Exception("Rate limit exhausted for embedding provider. Please try again later.")
-
-                print(f"Embedding error: {e}")
-                raise e
-
-    embeddings_model = GoogleGenerativeAIEmbeddings(
-        model="models/gemini-embedding-001",
-        google_api_key=api_key,
-        task_type=task_type
-    )
-    
-    # Gemini embedding models can be large.
-    # Process in batches to avoid rate limits
-    batch_size = 5
-    all_embeddings = []
-    
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
-        # Add delay before batch (except first)
-        if i > 0:
-            print(f"Sleeping 2s for Gemini rate limit... ({i}/{len(texts)})")
-            await asyncio.sleep(2)
-            
-        batch_embeddings = await embed_batch_with_retry(embeddings_model, batch)
-        all_embeddings.extend(batch_embeddings)
-    
-    # Convert to 384-dimensional vectors (truncate or pad as needed)
-    target_dim = 384
-    processed_embeddings: List[List[float]] = []
-    for emb in all_embeddings:
-        if len(emb) >= target_dim:
-            processed_embeddings.append(emb[:target_dim])
-        else:
-            processed_embeddings.append(emb + [0.0] * (target_dim - len(emb)))
-    return processed_embeddings
+                loop = asyncio.get_running_loop()
+                with span("embed_batch"):
+                    return await loop.run_in_executor(None, embeddings_model.embed_documents, batch_texts)
+
+        scheduler = EmbeddingScheduler(embed_batch, get_rate_limiter(api_key))
+        progress_callback = None
+        if on_progress:
+            def progress_callback(done: int):
+                on_progress(cached_count + done)
+
+        async def embed_own() -> Dict[str, np.ndarray]:
+            new_embeddings = await scheduler.embed(list(own.values()), on_progress=progress_callback)
+            # Convert to 384-dimensional float32 vectors (truncate or pad as needed)
+            fresh = {key: to_vector(emb, EMBEDDING_DIMS) for key, emb in zip(own.keys(), new_embeddings)}
+            await cache.set_many(fresh)
+            return fresh
+
+        cached.update(await asyncio.shield(flights.start([f"{tenant}:{key}" for key in own], embed_own())))
+
+    for key, flight in joined.items():
+        cached[key] = (await asyncio.shield(flight))[key]
+    if on_progress and joined:
+        on_progress(cached_count + len(missing))
+
+    return [cached[key] for key in keys]
@@ -0,0 +1,69 @@
+"""
+Embedding vectors as float32 NumPy arrays, and their wire/storage encodings.
+
+pgvector accepts its text format ("[0.1,0.2,...]") for vector columns and
+RPC parameters, so vectors are sent as one string rounded to
+VECTOR_WIRE_DECIMALS places instead of a JSON list of Python floats: about
+3.6KB instead of 8.4KB per 384-dim vector at the default of 6, encoded ~25x
+faster by orjson. Embeddings are near unit norm, so a fixed number of decimal
+places bounds the per-component error (0.5e-6 at 6, 0.5e-4 at 4, which is
+about what halfvec keeps); the effect on cosine similarity is below 1e-6.
+
+float16 / int8 quantization is for in-process storage (VECTOR_INDEX_DTYPE);
+int8 rows keep a per-row scale.
+"""
+import os
+from typing import Any, Iterable, Tuple
+import numpy as np
+import orjson
+
+VECTOR_WIRE_DECIMALS = int(os.getenv("VECTOR_WIRE_DECIMALS", "6"))
+
+
+def to_vector(values: Any, dims: int) -> np.ndarray:
+    """float32 array of exactly `dims` components (truncated or zero padded)."""
+    vector = np.asarray(values, dtype=np.float32).ravel()
+    if len(vector) > dims:
+        # Copy: a slice is a view that would keep the full provider vector alive in caches
+        return vector[:dims].copy()
+    if len(vector) == dims:
+        return vector
+    return np.pad(vector, (0, dims - len(vector)))
+
+
+def format_vector(vector: Any, decimals: int = VECTOR_WIRE_DECIMALS) -> str:
+    """pgvector text format with fixed precision."""
+    vector = np.round(np.asarray(vector, dtype=np.float32), decimals)
+    return orjson.dumps(vector, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
+def parse_vector(value: Any) -> np.ndarray:
+    """pgvector columns come back from PostgREST as "[0.1,0.2,...]" strings."""
+    if isinstance(value, str):
+        return np.asarray(orjson.loads(value), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def stack_vectors(values: Iterable[Any]) -> np.ndarray:
+    return np.stack([parse_vector(v) for v in values])
+
+
+def quantize(matrix: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Stores a float32 matrix as float32, float16 or int8.
+    Returns (values, scales); scales is empty unless dtype is int8.
+    """
+    if dtype == "float16":
+        return matrix.astype(np.float16), np.zeros(0, dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+        scales[scales == 0] = 1.0
+        values = np.round(matrix / scales[:, None]).astype(np.int8)
+        return values, scales.astype(np.float32)
+    return matrix.astype(np.float32, copy=False), np.zeros(0, dtype=np.float32)
+
+
+def dequantize(values: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    if values.dtype == np.int8:
+        return values.astype(np.float32) * scales[:, None]
+    return values.astype(np.float32, copy=False)
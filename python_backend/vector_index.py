@@ -0,0 +1,292 @@
+"""
+Optional in-process retrieval backend (RETRIEVAL_BACKEND=local).
+
+Each tenant's chunk vectors are held in a normalised float32 NumPy matrix
+keyed by company_id, so a query is one matrix-vector product instead of a
+match_documents round trip. Search is exact cosine similarity, the same
+ranking the RPC computes, so results match it up to float32 rounding.
+
+Tenants load in the background on their first query (which still goes to the
+RPC), are refreshed per document when ingestion finishes, expire after
+VECTOR_INDEX_TTL so writes from other processes show up, and are evicted LRU
+once the total footprint exceeds VECTOR_INDEX_MEMORY_MB.
+
+VECTOR_INDEX_DTYPE=float16 or int8 stores the matrix at a half / quarter of
+the float32 footprint; searches then dequantize it block by block.
+"""
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+import numpy as np
+from supabase import AsyncClient
+from keyword_index import BM25Index
+from vector_codec import stack_vectors, quantize, dequantize
+
+# "rpc" (default) or "local"
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "rpc")
+VECTOR_INDEX_MEMORY_MB = float(os.getenv("VECTOR_INDEX_MEMORY_MB", "512"))
+# Tenants larger than this stay on the RPC
+VECTOR_INDEX_MAX_VECTORS = int(os.getenv("VECTOR_INDEX_MAX_VECTORS", "200000"))
+VECTOR_INDEX_TTL = float(os.getenv("VECTOR_INDEX_TTL", "300"))
+# "float32" (default), "float16" or "int8"
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float32")
+LOAD_PAGE_SIZE = 1000
+# Above this many vectors the matrix product runs in a thread
+SEARCH_IN_THREAD_MIN_VECTORS = 20000
+# Rows dequantized at a time when searching a float16 / int8 matrix
+DEQUANTIZE_BLOCK_ROWS = 8192
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class TenantIndex:
+    """Flat exact-cosine index over one tenant's chunks."""
+
+    def __init__(self, dims: int = 384, dtype: str = VECTOR_INDEX_DTYPE):
+        self.dims = dims
+        self.dtype = dtype
+        self.ids: List[str] = []
+        self.document_ids: List[str] = []
+        self.contents: List[str] = []
+        self.matrix, self.scales = quantize(np.zeros((0, dims), dtype=np.float32), dtype)
+        self.loaded_at = time.monotonic()
+        self.content_bytes = 0
+        # Built on the first keyword query (hybrid retrieval only)
+        self._keyword: Optional[BM25Index] = None
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict[str, Any]], dims: int = 384, dtype: str = VECTOR_INDEX_DTYPE) -> "TenantIndex":
+        index = cls(dims, dtype)
+        index.add_rows(rows)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def nbytes(self) -> int:
+        # Matrix plus a rough allowance for the chunk text and ids
+        return self.matrix.nbytes + self.scales.nbytes + self.content_bytes + len(self.ids) * 100
+
+    def add_rows(self, rows: List[Dict[str, Any]]):
+        rows = [r for r in rows if r.get("embedding") is not None]
+        if not rows:
+            return
+        values, scales = quantize(normalize_rows(stack_vectors(r["embedding"] for r in rows)), self.dtype)
+        self.matrix = np.concatenate([self.matrix, values])
+        self.scales = np.concatenate([self.scales, scales])
+        self._keyword = None
+        for r in rows:
+            self.ids.append(r["id"])
+            self.document_ids.append(r.get("document_id"))
+            self.contents.append(r.get("content") or "")
+            self.content_bytes += len(self.contents[-1])
+
+    def without_documents(self, document_ids: Set[str]) -> "TenantIndex":
+        """Copy of the index minus the given documents (searches in flight keep the old one)."""
+        keep = [i for i, d in enumerate(self.document_ids) if d not in document_ids]
+        index = TenantIndex(self.dims, self.dtype)
+        index.matrix = self.matrix[keep]
+        index.scales = self.scales[keep] if len(self.scales) else self.scales
+        index.ids = [self.ids[i] for i in keep]
+        index.document_ids = [self.document_ids[i] for i in keep]
+        index.contents = [self.contents[i] for i in keep]
+        index.content_bytes = sum(len(c) for c in index.contents)
+        index.loaded_at = self.loaded_at
+        return index
+
+    def keyword_search(self, query: str, match_count: int = 5) -> List[Dict[str, Any]]:
+        if self._keyword is None:
+            self._keyword = BM25Index(self.contents)
+        return [
+            {"id": self.ids[i], "document_id": self.document_ids[i], "content": self.contents[i], "rank": score}
+            for i, score in self._keyword.search(query, match_count)
+        ]
+
+    def _scores(self, q: np.ndarray) -> np.ndarray:
+        if self.matrix.dtype == np.float32:
+            return self.matrix @ q
+        return np.concatenate([
+            dequantize(self.matrix[i:i + DEQUANTIZE_BLOCK_ROWS], self.scales[i:i + DEQUANTIZE_BLOCK_ROWS]) @ q
+            for i in range(0, len(self.matrix), DEQUANTIZE_BLOCK_ROWS)
+        ])
+
+    def search(self, query: List[float], match_count: int = 5, match_threshold: float = 0.5) -> List[Dict[str, Any]]:
+        """Same contract as the match_documents RPC: rows with similarity > threshold, best first."""
+        if not self.ids:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return []
+        scores = self._scores(q / norm)
+        k = min(match_count, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"id": self.ids[i], "document_id": self.document_ids[i], "content": self.contents[i], "similarity": float(scores[i])}
+            for i in top
+            if scores[i] > match_threshold
+        ]
+
+
+class VectorIndexRegistry:
+    """LRU of TenantIndex objects under a shared memory budget."""
+
+    def __init__(self, memory_budget_mb: float = VECTOR_INDEX_MEMORY_MB, max_vectors: int = VECTOR_INDEX_MAX_VECTORS, ttl: float = VECTOR_INDEX_TTL):
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.max_vectors = max_vectors
+        self.ttl = ttl
+        self._tenants: "OrderedDict[str, TenantIndex]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Task] = {}
+        # Tenants that are too large (or unscoped) to hold locally, with when we found out
+        self._rejected: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def memory_bytes(self) -> int:
+        return sum(index.nbytes() for index in self._tenants.values())
+
+    def _get(self, company_id: str) -> Optional[TenantIndex]:
+        index = self._tenants.get(company_id)
+        if index is None:
+            return None
+        if time.monotonic() - index.loaded_at > self.ttl:
+            # Stale: keep serving it while a fresh copy loads
+            return index
+        self._tenants.move_to_end(company_id)
+        return index
+
+    def _put(self, company_id: str, index: TenantIndex):
+        self._tenants[company_id] = index
+        self._tenants.move_to_end(company_id)
+        self._evict()
+
+    def _evict(self):
+        while self._tenants and self.memory_bytes() > self.memory_budget:
+            self._tenants.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, company_id: str):
+        self._tenants.pop(company_id, None)
+        self._rejected.pop(company_id, None)
+
+    async def _fetch_rows(self, client: AsyncClient, filters: Dict[str, str], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        start = 0
+        while True:
+            query = client.table("document_chunks").select("id, document_id, content, embedding")
+            for column, value in filters.items():
+                query = query.eq(column, value)
+            res = await query.order("id").range(start, start + LOAD_PAGE_SIZE - 1).execute()
+            page = res.data or []
+            rows.extend(page)
+            if len(page) < LOAD_PAGE_SIZE or (limit is not None and len(rows) > limit):
+                return rows
+            start += LOAD_PAGE_SIZE
+
+    async def load(self, client: AsyncClient, company_id: str) -> Optional[TenantIndex]:
+        try:
+            rows = await self._fetch_rows(client, {"company_id": company_id}, limit=self.max_vectors)
+        except Exception as e:
+            # Legacy schema without company_id on chunks can't be scoped per tenant
+            print(f"Vector index load failed for {company_id}: {e}")
+            self._rejected[company_id] = time.monotonic()
+            return None
+        if len(rows) > self.max_vectors:
+            print(f"Tenant {company_id} has more than {self.max_vectors} chunks; staying on match_documents")
+            self._rejected[company_id] = time.monotonic()
+            return None
+        index = await asyncio.to_thread(TenantIndex.from_rows, rows)
+        self._put(company_id, index)
+        return index
+
+    def _schedule_load(self, client: AsyncClient, company_id: str):
+        if company_id in self._loading:
+            return
+        task = asyncio.create_task(self.load(client, company_id))
+        self._loading[company_id] = task
+        task.add_done_callback(lambda _: self._loading.pop(company_id, None))
+
+    async def search(
+        self,
+        client: AsyncClient,
+        company_id: str,
+        query: List[float],
+        match_count: int = 5,
+        match_threshold: float = 0.5
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Returns matches from the local index, or None if the tenant isn't loaded yet
+        (a background load is started) or is too large - the caller should use the RPC.
+        """
+        rejected_at = self._rejected.get(company_id)
+        if rejected_at is not None and time.monotonic() - rejected_at < self.ttl:
+            self.misses += 1
+            return None
+
+        index = self._get(company_id)
+        if index is None or time.monotonic() - index.loaded_at > self.ttl:
+            self._schedule_load(client, company_id)
+        if index is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        if len(index) >= SEARCH_IN_THREAD_MIN_VECTORS:
+            return await asyncio.to_thread(index.search, query, match_count, match_threshold)
+        return index.search(query, match_count, match_threshold)
+
+    async def keyword_search(self, company_id: str, query: str, match_count: int = 5) -> Optional[List[Dict[str, Any]]]:
+        """BM25 over a loaded tenant's chunks; None if the tenant isn't loaded (use the RPC)."""
+        index = self._tenants.get(company_id)
+        if index is None:
+            return None
+        return await asyncio.to_thread(index.keyword_search, query, match_count)
+
+    async def refresh_document(self, client: AsyncClient, company_id: str, document_id: str):
+        """Swaps one document's chunks in a loaded tenant index (no-op if the tenant isn't loaded)."""
+        index = self._tenants.get(company_id)
+        if index is None:
+            return
+        rows = await self._fetch_rows(client, {"company_id": company_id, "document_id": document_id})
+        refreshed = index.without_documents({document_id})
+        refreshed.add_rows(rows)
+        if company_id not in self._tenants:
+            return
+        if len(refreshed) > self.max_vectors:
+            self.invalidate(company_id)
+            self._rejected[company_id] = time.monotonic()
+            return
+        self._tenants[company_id] = refreshed
+        self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "backend": RETRIEVAL_BACKEND,
+            "tenants": len(self._tenants),
+            "vectors": sum(len(index) for index in self._tenants.values()),
+            "memory_bytes": self.memory_bytes(),
+            "memory_budget_bytes": self.memory_budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+_registry: Optional[VectorIndexRegistry] = None
+
+
+def get_vector_index() -> VectorIndexRegistry:
+    global _registry
+    if _registry is None:
+        _registry = VectorIndexRegistry()
+    return _registry